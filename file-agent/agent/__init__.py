@@ -1,4 +1,5 @@
 from .node_agent import NodeAgent, get_node_agent
+from .async_node_agent import AsyncNodeAgent, get_async_node_agent
 from .sender import FileSender, get_file_sender
 from .grpc_client import HeuristicClient, get_heuristic_client
 from .timeline_client import TimelineClient, get_timeline_client
@@ -6,10 +7,12 @@ from .utils import get_logger
 
 __all__ = [
     'NodeAgent',
+    'AsyncNodeAgent',
     'FileSender',
     'HeuristicClient',
     'TimelineClient',
     'get_node_agent',
+    'get_async_node_agent',
     'get_file_sender',
     'get_heuristic_client',
     'get_timeline_client',
@@ -0,0 +1,56 @@
+"""Reassembly of a file delivered as byte ranges over several connections"""
+import os
+import threading
+from typing import Dict, Optional
+from .utils import preallocate, detach
+
+class RangeAssembly:
+    """A preallocated file filled with positional writes from many connections"""
+
+    def __init__(self, path: str, file_size: int, range_count: int):
+        self.path = path
+        self.file_size = file_size
+        self.range_count = range_count
+        detach(path)
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        preallocate(self.fd, file_size)
+        os.ftruncate(self.fd, file_size)
+        self.completed = set()
+        self.lock = threading.Lock()
+
+    def write(self, offset: int, data: memoryview):
+        while data:
+            written = os.pwrite(self.fd, data, offset)
+            data = data[written:]
+            offset += written
+
+    def complete_range(self, index: int) -> bool:
+        """Mark a range as fully written; True once every range has arrived"""
+        with self.lock:
+            self.completed.add(index)
+            return len(self.completed) == self.range_count
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+class AssemblyRegistry:
+    """In-progress assemblies keyed by transfer_id"""
+
+    def __init__(self):
+        self._assemblies: Dict[str, RangeAssembly] = {}
+        self._lock = threading.Lock()
+
+    def open(self, transfer_id: str, path: str, file_size: int, range_count: int) -> RangeAssembly:
+        with self._lock:
+            assembly = self._assemblies.get(transfer_id)
+            if assembly is None:
+                assembly = RangeAssembly(path, file_size, range_count)
+                self._assemblies[transfer_id] = assembly
+            return assembly
+
+    def pop(self, transfer_id: str) -> Optional[RangeAssembly]:
+        with self._lock:
+            return self._assemblies.pop(transfer_id, None)
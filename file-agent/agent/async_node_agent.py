@@ -0,0 +1,343 @@
+"""asyncio server for the hop protocol"""
+import asyncio
+import socket
+import threading
+import struct
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from .utils import (
+    get_logger, preallocate, detach,
+    NODE_HOST, NODE_PORT, RELAY_MODE, TRANSFER_TIMEOUT,
+    LISTEN_BACKLOG, MAX_CONCURRENT_TRANSFERS, CONN_BUFFER_SIZE, MAX_METADATA_SIZE
+)
+from .node_agent import NodeAgent
+from .protocol import encode_ack
+from .manifest import ChunkManifest, ChunkTracker
+from .hashing import new_hasher, hop_hash
+from .session import SESSION_PREAMBLE
+from .transport import receive_buffer_size
+
+logger = get_logger('agent.async_node_agent')
+
+class AsyncNodeAgent(NodeAgent):
+    """Event-loop variant of NodeAgent with bounded concurrency.
+
+    At most ``max_concurrent`` transfers are serviced at once; further
+    connections wait in the listen backlog or on the semaphore. Each
+    connection holds at most ``buffer_size`` bytes of payload, split into two
+    halves so one half is written and hashed in the executor while the other
+    is filled from the socket.
+
+    Destination and store-and-forward transfers run on the loop. Modes that
+    need a blocking socket (cut-through relaying, parallel ranges, resumes,
+    content offers, small relays spooled in memory, datagram flows) are
+    handed to the same executor with the metadata already parsed.
+
+    A multiplexed session lives as long as its neighbor stays up, so it holds
+    no slot: its reader runs on a thread of its own, and each stream it
+    opens waits for a slot like a new connection.
+    """
+
+    def __init__(
+        self,
+        host: str = NODE_HOST,
+        port: int = NODE_PORT,
+        receive_dir: str = 'receive-file',
+        relay_dir: str = 'relay-cache',
+        max_concurrent: int = MAX_CONCURRENT_TRANSFERS,
+        backlog: int = LISTEN_BACKLOG,
+        buffer_size: int = CONN_BUFFER_SIZE
+    ):
+        super().__init__(host, port, receive_dir, relay_dir)
+        self.max_concurrent = max_concurrent
+        self.backlog = backlog
+        self.buffer_size = buffer_size
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrent,
+            thread_name_prefix='transfer'
+        )
+        self.loop = None
+        self._slots = None
+        self._stop_event = None
+        self._tasks = set()
+
+    def start(self):
+        self.running = True
+        self.relay_cache.start_reporter()
+        if self.custody:
+            self.custody.start()
+        self.datagrams.start()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.stop()
+
+    def stop(self):
+        if not self.running:
+            return
+
+        self.running = False
+        if self.custody:
+            self.custody.stop()
+        self.datagrams.stop()
+
+        for session in list(self.sessions):
+            session.close()
+
+        if self.loop and self._stop_event:
+            try:
+                self.loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._slots = slots = asyncio.Semaphore(self.max_concurrent)
+
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.setblocking(False)
+
+        try:
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(self.backlog)
+        except OSError as e:
+            logger.error(f"Failed to bind to {self.host}:{self.port}: {e}")
+            self.server_socket.close()
+            return
+
+        stop_wait = asyncio.ensure_future(self._stop_event.wait())
+        try:
+            while self.running:
+                accept = asyncio.ensure_future(self.loop.sock_accept(self.server_socket))
+                await asyncio.wait({accept, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+                if not accept.done():
+                    accept.cancel()
+                    break
+
+                try:
+                    client_socket, client_address = accept.result()
+                except OSError as e:
+                    logger.error(f"Error accepting connection: {e}")
+                    continue
+
+                task = asyncio.create_task(
+                    self._serve_client(slots, client_socket, client_address)
+                )
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            stop_wait.cancel()
+            self.server_socket.close()
+            logger.info("Server socket closed")
+            for task in list(self._tasks):
+                task.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _serve_client(self, slots: asyncio.Semaphore, client_socket: socket.socket, client_address: tuple):
+        session = False
+        try:
+            async with slots:
+                head = await self._recv_exact(client_socket, 4)
+                if head == SESSION_PREAMBLE[:4]:
+                    if await self._recv_exact(client_socket, 4) == SESSION_PREAMBLE[4:]:
+                        session = True
+                    else:
+                        logger.error("Empty metadata frame")
+                else:
+                    await self._serve_transfer(client_socket, head)
+            if session:
+                # The slot is given back first; the reader thread owns the socket from here
+                threading.Thread(
+                    target=self._serve_session_blocking, args=(client_socket, client_address),
+                    daemon=True, name=f'session-{client_address[0]}'
+                ).start()
+
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out waiting for {client_address}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error handling client: {e}")
+        finally:
+            if not session:
+                client_socket.close()
+
+    async def _serve_transfer(self, client_socket: socket.socket, head: bytes):
+        """One transfer on a one-shot connection, its metadata length already read"""
+        metadata = await self._recv_frame(client_socket, head)
+        if not metadata:
+            logger.error("Failed to receive metadata")
+            return
+
+        if self._is_native(metadata):
+            refusal = await self._offload(self._admit, metadata)
+            if refusal:
+                logger.error(f"Refused {metadata['transfer_id']}: {refusal}")
+                await self.loop.sock_sendall(client_socket, encode_ack(False, refusal))
+                return
+            try:
+                await self._store_and_forward_async(
+                    client_socket, metadata, self._is_destination(metadata)
+                )
+            finally:
+                await asyncio.shield(self._offload(self._settle, metadata))
+        else:
+            await self._offload(self._process_blocking, client_socket, metadata)
+
+    def _is_native(self, metadata: dict) -> bool:
+        """Whether the loop can service this transfer without a blocking socket"""
+        if 'range' in metadata or 'datagram' in metadata or metadata.get('resume') or metadata.get('offer'):
+            return False
+        if self._spoolable(metadata):
+            return False
+        return self._is_destination(metadata) or RELAY_MODE != 'cut-through' or 'fanout' in metadata
+
+    def _process_blocking(self, client_socket: socket.socket, metadata: dict):
+        client_socket.settimeout(TRANSFER_TIMEOUT)
+        self._process_transfer(client_socket, metadata, memoryview(bytearray(receive_buffer_size(metadata))))
+
+    def _serve_session_blocking(self, client_socket: socket.socket, client_address: tuple):
+        client_socket.setblocking(True)
+        self._serve_session(client_socket, client_address)
+    
+    def _spawn_stream(self, stream, client_address: tuple):
+        # Called from the session's reader thread; streams wait for a slot like connections
+        try:
+            asyncio.run_coroutine_threadsafe(self._serve_stream(stream, client_address), self.loop)
+        except RuntimeError:
+            # The loop has stopped
+            stream.reset()
+
+    async def _serve_stream(self, stream, client_address: tuple):
+        async with self._slots:
+            await self._offload(self._handle_client, stream, client_address)
+    
+    def _offload(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    async def _store_and_forward_async(
+        self,
+        client_socket: socket.socket,
+        metadata: dict,
+        is_destination: bool
+    ):
+        file_size = metadata['file_size']
+        save_path = self._save_path(metadata, is_destination)
+
+        half = max(self.buffer_size // 2, 1)
+        buffers = [memoryview(bytearray(half)), memoryview(bytearray(half))]
+        hasher = new_hasher(hop_hash(metadata))
+        bytes_received = 0
+
+        manifest = None
+        if self._keeps_manifest(metadata):
+            manifest = await self._offload(
+                ChunkManifest.create, self._manifest_path(metadata, is_destination), file_size
+            )
+        f = await self._offload(self._open_for_write, save_path, file_size)
+        tracker = ChunkTracker(manifest, f.flush) if manifest else None
+        pending = None
+        try:
+            index = 0
+            while bytes_received < file_size:
+                view = buffers[index]
+                count = await self._fill(client_socket, view, file_size - bytes_received)
+                # The other buffer must be on disk before it is refilled
+                if pending:
+                    await pending
+                    pending = None
+                if not count:
+                    break
+                pending = self._offload(self._write_chunk, f, hasher, tracker, view[:count])
+                bytes_received += count
+                index ^= 1
+        finally:
+            if pending:
+                await asyncio.shield(pending)
+            await self._offload(f.close)
+            if manifest:
+                manifest.close()
+
+        if bytes_received < file_size:
+            logger.error(f"Upstream closed after {bytes_received}/{file_size} bytes")
+            if manifest:
+                logger.info(f"Partial file kept for resume: {metadata['transfer_id']}")
+            return
+
+        if metadata.get('integrity') == 'trailer':
+            trailer = await self._recv_frame(client_socket)
+            expected_md5 = trailer.get('md5') if trailer else None
+        else:
+            expected_md5 = metadata.get('md5')
+
+        actual_md5 = hasher.hexdigest()
+        if manifest:
+            manifest.remove()
+        if actual_md5 != expected_md5:
+            logger.error(f"MD5 mismatch! Expected {expected_md5}, got {actual_md5}")
+            await self._offload(self._discard, save_path)
+            await self.loop.sock_sendall(client_socket, encode_ack(False, "MD5 verification failed"))
+            return
+
+        await self.loop.sock_sendall(client_socket, encode_ack(True, "File received successfully"))
+        await self._offload(self._complete_transfer, metadata, save_path, is_destination, actual_md5)
+
+    @staticmethod
+    def _open_for_write(path: str, size: int):
+        detach(path)
+        f = open(path, 'wb')
+        preallocate(f, size)
+        return f
+
+    @staticmethod
+    def _write_chunk(f, hasher, tracker: Optional[ChunkTracker], view: memoryview):
+        hasher.update(view)
+        f.write(view)
+        if tracker:
+            tracker.update(view)
+
+    async def _fill(self, sock: socket.socket, view: memoryview, remaining: int) -> int:
+        """Read until ``view`` is full, the payload ends or the peer closes"""
+        target = min(len(view), remaining)
+        filled = 0
+        while filled < target:
+            count = await asyncio.wait_for(
+                self.loop.sock_recv_into(sock, view[filled:target]),
+                TRANSFER_TIMEOUT
+            )
+            if not count:
+                break
+            filled += count
+        return filled
+
+    async def _recv_exact(self, sock: socket.socket, n: int) -> Optional[bytearray]:
+        data = bytearray(n)
+        filled = await self._fill(sock, memoryview(data), n)
+        return data if filled == n else None
+
+    async def _recv_frame(self, sock: socket.socket, length_bytes: Optional[bytes] = None) -> Optional[dict]:
+        if length_bytes is None:
+            length_bytes = await self._recv_exact(sock, 4)
+        if not length_bytes:
+            return None
+
+        length = struct.unpack('!I', length_bytes)[0]
+        if length > MAX_METADATA_SIZE:
+            raise ValueError(f"Frame of {length} bytes exceeds MAX_METADATA_SIZE")
+
+        payload = await self._recv_exact(sock, length)
+        if not payload:
+            return None
+        return json.loads(payload.decode('utf-8'))
+
+# Singleton
+_async_agent = None
+
+def get_async_node_agent() -> AsyncNodeAgent:
+    global _async_agent
+    if _async_agent is None:
+        _async_agent = AsyncNodeAgent()
+    return _async_agent
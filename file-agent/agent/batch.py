@@ -0,0 +1,103 @@
+"""Batch sends: expanding file lists and packing small files into archives"""
+import os
+import glob
+import tarfile
+from typing import List, Tuple
+
+# Archive payloads carry ``"archive": {"format": "tar", "files": n}``
+ARCHIVE_FORMAT = 'tar'
+ARCHIVE_SUFFIX = '.tar'
+
+def collect_files(base_dir: str, patterns: List[str]) -> List[Tuple[str, str]]:
+    """(path, name) for every regular file matched by ``patterns``.
+
+    Patterns are globs relative to ``base_dir``; a directory matches every
+    file below it. ``name`` is the path relative to ``base_dir``. Each file
+    is listed once, in pattern order.
+    """
+    seen = set()
+    files = []
+    base_dir = os.path.abspath(base_dir)
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.join(base_dir, pattern), recursive=True))
+        for match in matches:
+            if os.path.isdir(match):
+                paths = []
+                for root, dirs, names in os.walk(match):
+                    dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                    paths.extend(os.path.join(root, name) for name in sorted(names))
+            else:
+                paths = [match]
+            for path in paths:
+                path = os.path.abspath(path)
+                if path in seen or not os.path.isfile(path):
+                    continue
+                seen.add(path)
+                files.append((path, os.path.relpath(path, base_dir)))
+    return files
+
+def flat_name(name: str) -> str:
+    """A relative path as a single filename (receivers save flat names)"""
+    return name.replace(os.sep, '_')
+
+def plan_batch(
+    files: List[Tuple[str, str]],
+    pack_threshold: int,
+    archive_bytes: int
+) -> Tuple[List[Tuple[str, str]], List[List[Tuple[str, str]]]]:
+    """Split ``files`` into ones sent on their own and groups of files
+    smaller than ``pack_threshold`` to pack together, each group holding up
+    to ``archive_bytes`` of file data. A group of one is sent on its own."""
+    singles = []
+    groups = []
+    group = []
+    group_bytes = 0
+    for path, name in files:
+        size = os.path.getsize(path)
+        if size >= pack_threshold:
+            singles.append((path, name))
+            continue
+        if group and group_bytes + size > archive_bytes:
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append((path, name))
+        group_bytes += size
+    if group:
+        groups.append(group)
+
+    for group in [g for g in groups if len(g) == 1]:
+        singles.extend(group)
+    return singles, [g for g in groups if len(g) > 1]
+
+def pack_archive(files: List[Tuple[str, str]], archive_path: str) -> int:
+    """Write ``files`` into an uncompressed tar under their relative names;
+    returns the archive size. Compression, if any, applies to the archive as
+    a whole like any other payload."""
+    with tarfile.open(archive_path, 'w', format=tarfile.PAX_FORMAT) as tar:
+        for path, name in files:
+            tar.add(path, arcname=name, recursive=False)
+    return os.path.getsize(archive_path)
+
+def unpack_archive(archive_path: str, target_dir: str) -> int:
+    """Extract a received archive into ``target_dir``; returns the file count.
+
+    Members that are not regular files or directories, or whose paths would
+    land outside ``target_dir``, are rejected.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    root = os.path.realpath(target_dir)
+    count = 0
+    with tarfile.open(archive_path, 'r:') as tar:
+        members = tar.getmembers()
+        for member in members:
+            destination = os.path.realpath(os.path.join(root, member.name))
+            if os.path.commonpath([root, destination]) != root:
+                raise ValueError(f"Archive member escapes target: {member.name}")
+            if not (member.isfile() or member.isdir()):
+                raise ValueError(f"Unsupported archive member: {member.name}")
+            count += member.isfile()
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(root, members=members, filter='data')
+        else:
+            tar.extractall(root, members=members)
+    return count
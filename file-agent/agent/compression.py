@@ -0,0 +1,134 @@
+"""Chunked payload compression, applied once at the source and undone at the destination.
+
+An encoded payload is a sequence of chunks, each ``[1B codec][4B raw
+length][4B stored length][stored bytes]``. Chunks that would not shrink by
+COMPRESS_MIN_SAVING are stored raw, so already-compressed data costs one
+cheap probe rather than a full compression pass.
+"""
+import lzma
+import time
+import zlib
+import struct
+import hashlib
+from typing import Optional, Tuple
+from .utils import COMPRESSION, COMPRESS_CHUNK_SIZE, COMPRESS_MIN_SAVING
+
+CHUNK_HEADER = struct.Struct('!BII')
+
+RAW, ZLIB, LZMA = 0, 1, 2
+CODECS = {'zlib': ZLIB, 'lzma': LZMA}
+DEFAULT_LEVELS = {'zlib': 6, 'lzma': 1}
+
+PROBE_SIZE = 65536
+
+def parse_codec(spec: Optional[str] = COMPRESSION) -> Optional[Tuple[str, int]]:
+    """``'zlib'``, ``'zlib:9'`` or ``'lzma:3'`` → (codec, level); None for ``'none'``"""
+    if not spec or spec.lower() == 'none':
+        return None
+    name, _, level = spec.lower().partition(':')
+    if name not in CODECS:
+        raise ValueError(f"Unknown compression codec: {spec}")
+    return name, int(level) if level else DEFAULT_LEVELS[name]
+
+def _compress(codec: int, level: int, data: bytes) -> bytes:
+    if codec == ZLIB:
+        return zlib.compress(data, level)
+    return lzma.compress(data, preset=level)
+
+def _decompress(codec: int, data: bytes) -> bytes:
+    if codec == ZLIB:
+        return zlib.decompress(data)
+    if codec == LZMA:
+        return lzma.decompress(data)
+    return data
+
+def _worth_compressing(chunk: bytes) -> bool:
+    """Cheap probe: does a fast pass over a sample save enough to bother"""
+    if len(chunk) <= PROBE_SIZE:
+        return True
+    sample = chunk[:PROBE_SIZE]
+    return len(zlib.compress(sample, 1)) < len(sample) * (1 - COMPRESS_MIN_SAVING)
+
+def encode_file(
+    source_path: str,
+    target_path: str,
+    codec: str,
+    level: int,
+    chunk_size: int = COMPRESS_CHUNK_SIZE
+) -> dict:
+    """Write the encoded form of ``source_path``; returns the encoding header
+    plus statistics (sizes, chunks stored raw, CPU seconds)"""
+    codec_id = CODECS[codec]
+    md5_hash = hashlib.md5()
+    original_size = 0
+    encoded_size = 0
+    chunks = 0
+    raw_chunks = 0
+    cpu_start = time.thread_time()
+
+    with open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            md5_hash.update(chunk)
+            stored = None
+            if _worth_compressing(chunk):
+                stored = _compress(codec_id, level, chunk)
+                if len(stored) >= len(chunk) * (1 - COMPRESS_MIN_SAVING):
+                    stored = None
+            if stored is None:
+                raw_chunks += 1
+                dst.write(CHUNK_HEADER.pack(RAW, len(chunk), len(chunk)))
+                dst.write(chunk)
+                encoded_size += CHUNK_HEADER.size + len(chunk)
+            else:
+                dst.write(CHUNK_HEADER.pack(codec_id, len(chunk), len(stored)))
+                dst.write(stored)
+                encoded_size += CHUNK_HEADER.size + len(stored)
+            original_size += len(chunk)
+            chunks += 1
+
+    return {
+        'codec': codec,
+        'level': level,
+        'chunk_size': chunk_size,
+        'size': original_size,
+        'md5': md5_hash.hexdigest(),
+        'encoded_size': encoded_size,
+        'chunks': chunks,
+        'raw_chunks': raw_chunks,
+        'cpu_seconds': time.thread_time() - cpu_start
+    }
+
+def decode_file(source_path: str, target_path: str) -> Tuple[str, int, float]:
+    """Decode an encoded payload; returns (MD5, size, CPU seconds) of the original"""
+    md5_hash = hashlib.md5()
+    size = 0
+    cpu_start = time.thread_time()
+    with open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+        while True:
+            header = src.read(CHUNK_HEADER.size)
+            if not header:
+                break
+            if len(header) < CHUNK_HEADER.size:
+                raise ValueError("Truncated chunk header")
+            codec_id, raw_length, stored_length = CHUNK_HEADER.unpack(header)
+            stored = src.read(stored_length)
+            if len(stored) < stored_length:
+                raise ValueError("Truncated chunk")
+            chunk = _decompress(codec_id, stored)
+            if len(chunk) != raw_length:
+                raise ValueError(f"Chunk decoded to {len(chunk)} bytes, expected {raw_length}")
+            md5_hash.update(chunk)
+            dst.write(chunk)
+            size += len(chunk)
+    return md5_hash.hexdigest(), size, time.thread_time() - cpu_start
+
+def format_stats(stats: dict) -> str:
+    ratio = stats['size'] / stats['encoded_size'] if stats['encoded_size'] else 1.0
+    return (
+        f"{stats['codec']}:{stats['level']} {stats['size']} → {stats['encoded_size']} bytes "
+        f"(ratio {ratio:.2f}x, {stats['raw_chunks']}/{stats['chunks']} chunks raw, "
+        f"{stats['cpu_seconds']:.3f}s CPU)"
+    )
@@ -0,0 +1,170 @@
+"""Content-addressed store of verified payloads, keyed by MD5"""
+import os
+import json
+import time
+import shutil
+import threading
+from typing import Dict, Optional, Tuple
+from .utils import get_logger, ensure_directory, CONTENT_CACHE_BYTES
+
+logger = get_logger('agent.content_store')
+
+OBJECT_DIR = '.objects'
+INDEX_FILE = 'index.json'
+
+def _link_or_copy(source: str, target: str):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+class ContentStore:
+    """Payloads this node has already verified, so a repeated transfer can
+    be answered from disk instead of crossing the link again.
+
+    Objects live under ``<root>/.objects/<md5>``; ``index.json`` records size
+    and last use so lookups and LRU eviction never scan the directory, and
+    the cache survives restarts. Relay files handed out by ``materialize``
+    are hard links where the filesystem allows, so they cost no extra space.
+    Delivered files are copied both ways: users may edit them in place,
+    which would otherwise change the cached object under its digest.
+    """
+
+    def __init__(self, root: str, budget: int = CONTENT_CACHE_BYTES):
+        self.directory = os.path.join(root, OBJECT_DIR)
+        self.index_path = os.path.join(self.directory, INDEX_FILE)
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        if self.enabled:
+            ensure_directory(self.directory)
+            self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def _object_path(self, md5: str) -> str:
+        return os.path.join(self.directory, md5)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Content index unreadable, starting empty: {e}")
+            self._entries = {}
+
+    def _save_index(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self.index_path)
+
+    def lookup(self, md5: Optional[str]) -> Optional[str]:
+        """Path of the object for ``md5``, marking it recently used"""
+        if not self.enabled or not md5:
+            return None
+        with self._lock:
+            entry = self._entries.get(md5)
+            if entry is None:
+                return None
+            path = self._object_path(md5)
+            if not os.path.exists(path):
+                del self._entries[md5]
+                self._save_index()
+                return None
+            entry['last_used'] = time.time()
+            return path
+
+    def latest(self, name: str) -> Optional[Tuple[str, str]]:
+        """(md5, path) of the most recently used object stored under ``name``,
+        i.e. the previous version of a file this node has seen"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            named = [(entry['last_used'], md5) for md5, entry in self._entries.items()
+                     if entry.get('name') == name]
+        for _, md5 in sorted(named, reverse=True):
+            path = self.lookup(md5)
+            if path:
+                return md5, path
+        return None
+    
+    def materialize(self, md5: Optional[str], target_path: str, link: bool = True) -> bool:
+        """Place a copy of the object at ``target_path``; False if not held.
+        Without ``link`` it is always a separate copy."""
+        path = self.lookup(md5)
+        if path is None:
+            return False
+        try:
+            if os.path.exists(target_path):
+                os.remove(target_path)
+            if link:
+                _link_or_copy(path, target_path)
+            else:
+                shutil.copyfile(path, target_path)
+            return True
+        except OSError as e:
+            logger.error(f"Failed to materialize {md5}: {e}")
+            return False
+
+    def add(self, path: str, md5: Optional[str], move: bool = False, name: Optional[str] = None):
+        """Record a verified file under its digest. With ``move`` the file is
+        taken over (or dropped if the object already exists); otherwise it is
+        copied, never linked. A None digest (a hash too weak to address
+        content) is not cached."""
+        if not self.enabled or md5 is None:
+            if move:
+                os.remove(path)
+            return
+
+        size = os.path.getsize(path)
+        if size > self.budget:
+            if move:
+                os.remove(path)
+            return
+
+        object_path = self._object_path(md5)
+        with self._lock:
+            if md5 in self._entries and os.path.exists(object_path):
+                self._entries[md5]['last_used'] = time.time()
+                if name:
+                    self._entries[md5]['name'] = name
+                if move:
+                    os.remove(path)
+                return
+            try:
+                if move:
+                    os.replace(path, object_path)
+                else:
+                    shutil.copyfile(path, object_path)
+            except OSError as e:
+                logger.error(f"Failed to cache {md5}: {e}")
+                return
+            self._entries[md5] = {'size': size, 'last_used': time.time(), 'name': name}
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        used = sum(entry['size'] for entry in self._entries.values())
+        for md5, entry in sorted(self._entries.items(), key=lambda item: item[1]['last_used']):
+            if used <= self.budget:
+                break
+            try:
+                os.remove(self._object_path(md5))
+            except FileNotFoundError:
+                pass
+            used -= entry['size']
+            del self._entries[md5]
+            logger.info(f"Evicted {md5} ({entry['size']} bytes) from content cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'objects': len(self._entries),
+                'bytes': sum(entry['size'] for entry in self._entries.values()),
+                'budget': self.budget
+            }
@@ -0,0 +1,290 @@
+"""Custody of relay files whose forward failed, retried until delivered"""
+import os
+import json
+import time
+import random
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+from .utils import (
+    get_logger, CUSTODY_BACKOFF, CUSTODY_MAX_BACKOFF, CUSTODY_REROUTE_AFTER, CUSTODY_MAX_AGE
+)
+from .grpc_client import get_heuristic_client
+from .topology import local_route
+
+logger = get_logger('agent.custody')
+
+QUEUE_FILE = '.custody.json'
+
+# Deliveries kept for the latency figures in ``stats``
+HISTORY = 1000
+
+def backoff_delay(failures: int, base: float = CUSTODY_BACKOFF, cap: float = CUSTODY_MAX_BACKOFF) -> float:
+    """Exponential backoff with equal jitter, so relays that lost the same
+    neighbor do not all retry at once when it comes back"""
+    delay = min(cap, base * (2 ** max(0, failures - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(round(q * (len(values) - 1))))], 3)
+
+class CustodyQueue:
+    """Relay files this node has ACKed but could not forward.
+
+    Once a relay ACKs a transfer, upstream hops consider it delivered, so the
+    relay keeps custody: the file stays pinned in the relay cache and the
+    forward is retried with jittered exponential backoff. After
+    ``reroute_after`` failed attempts through the same neighbor, a new path
+    from this node is requested from the heuristic service with that neighbor
+    (and the hops already travelled) excluded, falling back to a local search
+    over topology.json. Entries older than ``max_age``, or with no route
+    left around a dead neighbor, are given up and reported to
+    ``on_given_up``.
+
+    A neighbor routed around is remembered as down for the maximum backoff
+    (or until something is delivered through it), so later transfers headed
+    its way are rerouted as soon as they are taken into custody.
+
+    The queue is written to ``.custody.json`` in the relay cache directory on
+    every change, so custody survives a restart.
+    """
+
+    def __init__(
+        self,
+        relay_cache,
+        sender,
+        on_delivered: Optional[Callable[[dict], None]] = None,
+        on_given_up: Optional[Callable[[dict], None]] = None,
+        reroute_after: int = CUSTODY_REROUTE_AFTER,
+        max_age: float = CUSTODY_MAX_AGE
+    ):
+        self.relay_cache = relay_cache
+        self.sender = sender
+        self.on_delivered = on_delivered
+        self.on_given_up = on_given_up
+        self.reroute_after = reroute_after
+        self.max_age = max_age
+        self.queue_path = os.path.join(relay_cache.root, QUEUE_FILE)
+        self._entries: Dict[str, dict] = {}
+        self._down: Dict[str, float] = {}
+        self._wake = threading.Condition()
+        self._worker = None
+        self._running = False
+        self._held = deque(maxlen=HISTORY)
+        self._rerouted = deque(maxlen=HISTORY)
+        self._counters = {'taken': 0, 'delivered': 0, 'retries': 0, 'reroutes': 0, 'given_up': 0}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.queue_path, 'r') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Custody queue unreadable, starting empty: {e}")
+            return
+        for key, entry in entries.items():
+            if self.relay_cache.hold(key):
+                self._entries[key] = entry
+            else:
+                logger.error(f"Custody of {entry['transfer_id']} lost: {entry['path']} is no longer held")
+        if self._entries:
+            logger.info(f"Resumed custody of {len(self._entries)} relay files")
+        self._save()
+
+    def _save(self):
+        temp_path = self.queue_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self.queue_path)
+
+    def take(self, key: str, path: str, metadata: dict, md5: str, extra: dict) -> bool:
+        """Keep the relay file ``path`` of transfer ``key`` until it is
+        forwarded; False if the relay cache no longer holds it"""
+        if not self.relay_cache.hold(key):
+            return False
+        now = time.time()
+        entry = {
+            'path': path,
+            'filename': metadata['filename'],
+            'transfer_id': metadata['transfer_id'],
+            'route': list(metadata['route']),
+            'current_index': metadata['current_index'],
+            'md5': md5,
+            'extra': extra,
+            'hops': len(metadata['route']) - 1 - metadata['current_index'],
+            'taken': now,
+            'attempts': 0,
+            'since_reroute': 0,
+            'failed_hops': [],
+            'reroutes': 0,
+            'next_attempt': now + backoff_delay(1)
+        }
+        if self._is_down(entry['route'][entry['current_index'] + 1]) and self._reroute(entry):
+            entry['next_attempt'] = now
+        with self._wake:
+            previous = self._entries.pop(key, None)
+            self._entries[key] = entry
+            self._counters['taken'] += 1
+            self._save()
+            self._wake.notify()
+        if previous:
+            self.relay_cache.release(key)
+        logger.info(f"Took custody of {metadata['transfer_id']}; retrying in {entry['next_attempt'] - now:.1f}s")
+        return True
+
+    def start(self):
+        if self._worker is None:
+            self._running = True
+            self._worker = threading.Thread(target=self._run, name='custody', daemon=True)
+            self._worker.start()
+
+    def stop(self):
+        with self._wake:
+            self._running = False
+            self._wake.notify()
+
+    def _run(self):
+        while True:
+            with self._wake:
+                while self._running:
+                    due = self._next_due()
+                    if due is not None and self._entries[due]['next_attempt'] <= time.time():
+                        break
+                    wait = self._entries[due]['next_attempt'] - time.time() if due else None
+                    self._wake.wait(wait)
+                if not self._running:
+                    return
+                key = due
+                entry = dict(self._entries[key])
+            self._attempt(key, entry)
+
+    def _next_due(self) -> Optional[str]:
+        if not self._entries:
+            return None
+        return min(self._entries, key=lambda k: self._entries[k]['next_attempt'])
+
+    def _attempt(self, key: str, entry: dict):
+        if time.time() - entry['taken'] > self.max_age:
+            self._finish(key, entry, delivered=False, reason=f"held longer than {self.max_age:.0f}s")
+            return
+        if not os.path.exists(entry['path']):
+            self._finish(key, entry, delivered=False, reason=f"{entry['path']} is gone")
+            return
+
+        route, index = entry['route'], entry['current_index']
+        entry['attempts'] += 1
+        self._counters['retries'] += 1
+        try:
+            delivered = self.sender._send_to_next_hop(
+                entry['path'], entry['filename'], entry['transfer_id'], route, index, entry['md5'],
+                resume=True, extra=entry['extra']
+            )
+        except Exception as e:
+            logger.error(f"Custody retry of {entry['transfer_id']} failed: {e}")
+            delivered = False
+        if delivered:
+            self._down.pop(route[index + 1], None)
+            self._finish(key, entry, delivered=True)
+            return
+
+        entry['since_reroute'] += 1
+        delay = backoff_delay(entry['since_reroute'] + 1)
+        if entry['since_reroute'] >= self.reroute_after and self._reroute(entry):
+            delay = 0
+        entry['next_attempt'] = time.time() + delay
+        logger.info(f"Custody retry {entry['attempts']} of {entry['transfer_id']} failed; "
+                    f"next to {entry['route'][index + 1]} in {delay:.1f}s")
+        with self._wake:
+            # Unless the transfer was taken into custody afresh meanwhile
+            if self._entries.get(key, {}).get('taken') == entry['taken']:
+                self._entries[key] = entry
+                self._save()
+
+    def _reroute(self, entry: dict) -> bool:
+        """Replace the rest of the route with a path that avoids the next hop"""
+        route, index = entry['route'], entry['current_index']
+        here, dead, destination = route[index], route[index + 1], route[-1]
+        if dead == destination:
+            return False
+        if dead not in entry['failed_hops']:
+            entry['failed_hops'].append(dead)
+        self._down[dead] = time.time()
+        get_heuristic_client().invalidate_route(here, destination, failed_hop=dead)
+        excluded = set(entry['failed_hops']) | set(route[:index])
+
+        path = None
+        try:
+            result = get_heuristic_client().find_route_result(here, destination, exclude=sorted(excluded))
+            path = result['path'] if result else None
+        except Exception:
+            logger.error("Route query to the heuristic service failed")
+        # Servers that ignore ``exclude`` may hand back the dead route
+        if not self._avoids(path, here, excluded):
+            result = local_route(here, destination, excluded)
+            path = result['path'] if result else None
+        if not self._avoids(path, here, excluded):
+            logger.warning(f"No route from {here} to {destination} avoiding {', '.join(entry['failed_hops'])}")
+            return False
+
+        entry['route'] = route[:index] + path
+        entry['since_reroute'] = 0
+        entry['reroutes'] += 1
+        self._counters['reroutes'] += 1
+        logger.info(f"Rerouted {entry['transfer_id']} around {dead}: {' → '.join(path)}")
+        return True
+
+    def _is_down(self, neighbor: str) -> bool:
+        marked = self._down.get(neighbor)
+        return marked is not None and time.time() - marked < CUSTODY_MAX_BACKOFF
+
+    @staticmethod
+    def _avoids(path: Optional[List[str]], here: str, excluded: set) -> bool:
+        return bool(path) and len(path) >= 2 and path[0] == here and not excluded & set(path[1:-1])
+
+    def _finish(self, key: str, entry: dict, delivered: bool, reason: str = ''):
+        held = time.time() - entry['taken']
+        with self._wake:
+            self._entries.pop(key, None)
+            self._save()
+        if delivered:
+            self._counters['delivered'] += 1
+            self._held.append(held)
+            if entry['reroutes']:
+                self._rerouted.append(held)
+            via = ''
+            if entry['reroutes']:
+                path = entry['route'][entry['current_index']:]
+                via = f", rerouted via {' → '.join(path)} ({len(path) - 1 - entry['hops']:+d} hops)"
+            logger.info(f"Custody of {entry['transfer_id']} released: delivered after "
+                        f"{entry['attempts']} retries, held {held:.1f}s{via}")
+            if self.on_delivered:
+                self.on_delivered(entry)
+        else:
+            self._counters['given_up'] += 1
+            logger.error(f"Gave up custody of {entry['transfer_id']} after {entry['attempts']} retries: {reason}")
+            if self.on_given_up:
+                self.on_given_up(entry)
+        self.relay_cache.release(key)
+        stats = self.stats()
+        logger.info(f"Custody: {stats['held']} held; delivered={stats['delivered']} retries={stats['retries']} "
+                    f"reroutes={stats['reroutes']} given_up={stats['given_up']}; held p50 {stats['held_p50_s']}s, "
+                    f"rerouted p50 {stats['rerouted_p50_s']}s")
+
+    def stats(self) -> dict:
+        """Files held, counters since startup, and how long delivered files
+        were held (``rerouted_*`` only counts those that needed a new path)"""
+        with self._wake:
+            held = len(self._entries)
+        return {
+            'held': held,
+            **self._counters,
+            'held_p50_s': _percentile(list(self._held), 0.5),
+            'held_max_s': _percentile(list(self._held), 1.0),
+            'rerouted_p50_s': _percentile(list(self._rerouted), 0.5),
+            'rerouted_max_s': _percentile(list(self._rerouted), 1.0)
+        }
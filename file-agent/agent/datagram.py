@@ -0,0 +1,537 @@
+"""Reliable datagram transport for hop payloads on lossy, high-RTT links.
+
+The hop's metadata, trailer and ACK still travel over its TCP connection
+(or session stream); only the payload is sent as UDP datagrams to the
+receiver's node port. Each datagram carries a 22-byte header::
+
+    flow (8) | kind (1) | number (4) | index (1) | timestamp (8)
+
+DATA packets carry ``packet_size`` bytes at offset ``number * packet_size``.
+With FEC, each group of ``group`` data packets is followed by ``parity``
+PARITY packets (``number`` is the group, ``index`` the parity row; see
+fec.py). The receiver answers with SACKs, about every ``ACK_EVERY`` packets
+or ``ACK_DELAY`` seconds: ``number`` is the first packet not yet held, the
+timestamp echoes the newest send time seen, and the body holds the bytes
+that arrived, the highest packet held, and the missing ranges between the
+two. DONE is sent once every packet is held, recovered or received.
+
+The sender paces packets at a rate estimated from delivery, as BBR does:
+the bottleneck rate is the highest delivery rate seen over the last ten
+round trips, and pacing cycles through gains of 1.25, 0.75 and 1 around
+it. Random loss lowers single samples but not the maximum, so the rate is
+not cut on every lost packet as TCP's window is. Packets in flight are
+capped at twice the estimated bandwidth-delay product. A packet is resent
+once a packet sent ``reorder`` later has arrived, or after a timeout.
+"""
+import os
+import time
+import random
+import select
+import socket
+import struct
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+from .utils import (
+    get_logger, DATAGRAM_TRANSPORT, DATAGRAM_MIN_LOSS, DATAGRAM_FEC, DATAGRAM_FEC_GROUP,
+    DATAGRAM_PACKET_SIZE, DATAGRAM_RATE_MBPS
+)
+from . import fec
+
+logger = get_logger('agent.datagram')
+
+HEADER = struct.Struct('!QBIBd')
+SACK_BODY = struct.Struct('!QI')
+RANGE = struct.Struct('!II')
+
+DATA, PARITY, SACK, DONE = 1, 2, 3, 4
+
+ACK_EVERY = 16
+ACK_DELAY = 0.005
+# Packets sent before the first delivery sample arrives
+INITIAL_WINDOW = 64
+GAINS = (1.25, 0.75, 1, 1, 1, 1, 1, 1)
+MIN_RTO = 0.05
+BURST = 0.002
+
+def choose(profile: dict) -> Optional[dict]:
+    """Datagram settings for a link's profile, or None to use TCP.
+
+    ``DATAGRAM_TRANSPORT`` ``on`` uses datagrams on every link and ``auto``
+    on links whose loss rate reaches ``DATAGRAM_MIN_LOSS``. ``DATAGRAM_FEC``
+    ``auto`` sizes the parity to the loss rate.
+    """
+    loss = profile.get('loss_rate') or 0.0
+    if DATAGRAM_TRANSPORT == 'off' or (DATAGRAM_TRANSPORT == 'auto' and loss < DATAGRAM_MIN_LOSS):
+        return None
+    group = max(1, min(DATAGRAM_FEC_GROUP, fec.MAX_SYMBOLS // 2))
+    if DATAGRAM_FEC == 'auto':
+        parity = fec.parity_count(loss, group)
+        scheme = None if parity == 0 else 'xor' if parity == 1 else 'rs'
+    else:
+        scheme = DATAGRAM_FEC if DATAGRAM_FEC in fec.SCHEMES else None
+        parity = 1 if scheme == 'xor' else fec.parity_count(max(loss, DATAGRAM_MIN_LOSS), group) if scheme else 0
+    return {
+        'packet_size': DATAGRAM_PACKET_SIZE,
+        'fec': scheme,
+        'group': group,
+        'parity': max(1, parity) if scheme else 0
+    }
+
+def new_flow(params: dict) -> dict:
+    """Metadata for one transfer's flow"""
+    return dict(params, flow=random.getrandbits(63))
+
+class RateControl:
+    """Pacing rate and in-flight cap from delivery-rate samples"""
+
+    def __init__(self, initial_rate: float, initial_window: int):
+        self.initial_rate = initial_rate
+        self.initial_window = initial_window
+        self.samples = deque()
+        self.bottleneck = 0.0
+        self.min_rtt = None
+        self.srtt = None
+        self.rttvar = 0.0
+        self.startup = True
+        self.round_start = time.monotonic()
+        self.round_best = 0.0
+        self.stalled_rounds = 0
+        self.cycle = 0
+        self.last = None
+
+    def on_rtt(self, rtt: float):
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def on_delivery(self, now: float, arrived: int):
+        if self.last is None:
+            self.last = (now, arrived)
+            return
+        since, before = self.last
+        interval = max(0.01, (self.min_rtt or 0.04) / 4)
+        if now - since < interval:
+            return
+        self.last = (now, arrived)
+        self.samples.append((now, (arrived - before) / (now - since)))
+        horizon = now - 10 * max(self.srtt or 0.1, 0.05)
+        while self.samples and self.samples[0][0] < horizon:
+            self.samples.popleft()
+        self.bottleneck = max(rate for _, rate in self.samples)
+
+        if now - self.round_start < (self.srtt or 0.1):
+            return
+        self.round_start = now
+        if self.startup:
+            # Leave startup once the bottleneck stops growing by a quarter a round
+            if self.bottleneck >= 1.25 * self.round_best:
+                self.round_best = self.bottleneck
+                self.stalled_rounds = 0
+            else:
+                self.stalled_rounds += 1
+                self.startup = self.stalled_rounds < 3
+        else:
+            self.cycle = (self.cycle + 1) % len(GAINS)
+
+    @property
+    def rate(self) -> float:
+        if not self.bottleneck:
+            return self.initial_rate
+        if self.startup:
+            return max(self.initial_rate, 2 * self.bottleneck)
+        return GAINS[self.cycle] * self.bottleneck
+
+    def window(self, packet_size: int) -> float:
+        """Bytes allowed in flight"""
+        floor = INITIAL_WINDOW * packet_size
+        if not self.bottleneck or self.min_rtt is None:
+            return max(self.initial_window, floor)
+        return max(2 * self.bottleneck * self.min_rtt, floor)
+
+    @property
+    def rto(self) -> float:
+        if self.srtt is None:
+            return 1.0
+        return max(MIN_RTO, self.srtt + 4 * self.rttvar + ACK_DELAY)
+
+class DatagramSender:
+    """Sends one payload as a datagram flow and returns once the receiver
+    holds all of it. ``read(offset, length)`` supplies the payload.
+
+    The first round trip is paced at the link profile's bandwidth with its
+    bandwidth-delay product in flight (``DATAGRAM_RATE_MBPS`` and
+    ``INITIAL_WINDOW`` packets without a profile); delivery samples take over
+    from there.
+    """
+
+    def __init__(
+        self,
+        address: tuple,
+        flow: dict,
+        size: int,
+        read: Callable[[int, int], bytes],
+        profile: dict,
+        hasher=None,
+        on_sent: Optional[Callable[[], None]] = None
+    ):
+        self.address = address
+        self.flow = flow
+        self.size = size
+        self.read = read
+        self.timeout = profile['timeout']
+        self.hasher = hasher
+        self.on_sent = on_sent
+        self.packet_size = flow['packet_size']
+        self.count = -(-size // self.packet_size)
+        self.control = RateControl(
+            (profile['bandwidth_mbps'] or DATAGRAM_RATE_MBPS) * 1_000_000 / 8, profile['bdp'] or 0
+        )
+        self.acked = bytearray(self.count)
+        self.sent_at = [0.0] * self.count
+        self.in_flight = deque()
+        self.lost = deque()
+        self.cumulative = 0
+        self.sent_new = 0
+        self.acked_packets = 0
+        self.acked_bytes = 0
+        self.newest_echo = 0.0
+        self.stats = {'packets': 0, 'resent': 0, 'parity': 0, 'sacks': 0}
+
+    def _length(self, seq: int) -> int:
+        return min(self.packet_size, self.size - seq * self.packet_size)
+
+    def run(self) -> bool:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.connect(self.address)
+            sock.setblocking(False)
+            return self._run(sock)
+        finally:
+            sock.close()
+
+    def _run(self, sock: socket.socket) -> bool:
+        group = self.flow['group'] if self.flow['fec'] else 0
+        members = []
+        next_send = time.monotonic()
+        last_progress = time.monotonic()
+        start = last_progress
+
+        while True:
+            now = time.monotonic()
+            progress = self._receive(sock, now)
+            if progress is None:
+                self._log_done(now - start)
+                return True
+            if progress:
+                last_progress = now
+            elif now - last_progress > self.timeout:
+                logger.error(f"Datagram flow to {self.address[0]}:{self.address[1]} stalled "
+                             f"({self.cumulative}/{self.count} packets acknowledged)")
+                return False
+            self._detect_losses(now)
+
+            if now < next_send:
+                select.select([sock], [], [], min(next_send - now, 0.005))
+                continue
+            packet = None
+            if self.lost:
+                seq = self.lost.popleft()
+                if not self.acked[seq]:
+                    packet = self._data(sock, seq, now)
+                    self.stats['resent'] += 1
+            elif self.sent_new < self.count and self._room():
+                seq = self.sent_new
+                packet = self._data(sock, seq, now)
+                if group:
+                    members.append(packet)
+                    if len(members) == group or seq == self.count - 1:
+                        self._parity(sock, seq // group, members)
+                        members = []
+                self.sent_new += 1
+                if self.sent_new == self.count and self.on_sent:
+                    self.on_sent()
+            if packet is None:
+                select.select([sock], [], [], 0.002)
+                continue
+            next_send = max(next_send, now - BURST) + len(packet) / self.control.rate
+
+    def _room(self) -> bool:
+        """Whether the in-flight cap allows another new packet"""
+        return (self.sent_new - self.acked_packets) * self.packet_size < self.control.window(self.packet_size)
+
+    def _data(self, sock: socket.socket, seq: int, now: float) -> bytes:
+        data = self.read(seq * self.packet_size, self._length(seq))
+        if self.hasher is not None and not self.sent_at[seq]:
+            self.hasher.update(data)
+        self._send(sock, HEADER.pack(self.flow['flow'], DATA, seq, 0, now) + data)
+        self.sent_at[seq] = now
+        self.in_flight.append((now, seq))
+        self.stats['packets'] += 1
+        return data
+
+    def _parity(self, sock: socket.socket, group: int, members: list):
+        padded = [m.ljust(self.packet_size, b'\0') for m in members]
+        for row, parity in enumerate(fec.encode(padded, self.flow['parity'], self.flow['fec'])):
+            self._send(sock, HEADER.pack(self.flow['flow'], PARITY, group, row, time.monotonic()) + parity)
+            self.stats['parity'] += 1
+
+    def _send(self, sock: socket.socket, datagram: bytes):
+        try:
+            sock.send(datagram)
+        except (BlockingIOError, ConnectionRefusedError):
+            # A full socket buffer or an ICMP error from an earlier datagram;
+            # either way the packet counts as lost and will be resent
+            pass
+
+    def _receive(self, sock: socket.socket, now: float) -> Optional[bool]:
+        """Apply waiting SACKs; None once the receiver reports DONE"""
+        progress = False
+        while True:
+            try:
+                datagram = sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return progress
+            except ConnectionRefusedError:
+                continue
+            if len(datagram) < HEADER.size:
+                continue
+            flow, kind, number, _, stamp = HEADER.unpack_from(datagram)
+            if flow != self.flow['flow']:
+                continue
+            if kind == DONE:
+                return None
+            if kind != SACK:
+                continue
+            self.stats['sacks'] += 1
+            arrived, highest = SACK_BODY.unpack_from(datagram, HEADER.size)
+            if stamp > self.newest_echo:
+                self.newest_echo = stamp
+                self.control.on_rtt(now - stamp)
+            self.control.on_delivery(now, arrived)
+            progress |= self._apply_sack(number, highest, datagram[HEADER.size + SACK_BODY.size:])
+
+    def _apply_sack(self, cumulative: int, highest: int, ranges: bytes) -> bool:
+        before = self.acked_bytes
+        for seq in range(self.cumulative, min(cumulative, self.count)):
+            self._ack(seq)
+        self.cumulative = max(self.cumulative, cumulative)
+        missing = [RANGE.unpack_from(ranges, i) for i in range(0, len(ranges) - RANGE.size + 1, RANGE.size)]
+        seq = cumulative
+        for start, end in missing + [(highest + 1, highest + 1)]:
+            for held in range(seq, min(start, self.count)):
+                self._ack(held)
+            seq = end
+        return self.acked_bytes > before
+
+    def _ack(self, seq: int):
+        if not self.acked[seq]:
+            self.acked[seq] = 1
+            self.acked_packets += 1
+            self.acked_bytes += self._length(seq)
+
+    def _detect_losses(self, now: float):
+        """Mark packets lost that were overtaken by ``reorder`` or timed out"""
+        reorder = max(0.001, (self.control.min_rtt or 0) / 4)
+        cutoff = max(self.newest_echo - reorder, now - self.control.rto)
+        while self.in_flight and self.in_flight[0][0] < cutoff:
+            sent, seq = self.in_flight.popleft()
+            if not self.acked[seq] and self.sent_at[seq] == sent:
+                self.lost.append(seq)
+
+    def _log_done(self, seconds: float):
+        stats = self.stats
+        logger.info(f"Datagram flow to {self.address[0]}: {self.size} bytes in {seconds:.2f}s "
+                    f"({self.size * 8 / max(seconds, 1e-6) / 1e6:.1f} Mbit/s), {stats['packets']} packets, "
+                    f"{stats['resent']} resent, {stats['parity']} parity, "
+                    f"bottleneck {self.control.bottleneck * 8 / 1e6:.1f} Mbit/s, "
+                    f"min RTT {(self.control.min_rtt or 0) * 1000:.0f} ms")
+
+class DatagramFlow:
+    """Receiving side of one flow: writes packets into ``fd`` at their
+    offsets and rebuilds lost ones from parity"""
+
+    def __init__(self, sock: socket.socket, params: dict, fd: int, size: int):
+        self.sock = sock
+        self.id = params['flow']
+        self.packet_size = params['packet_size']
+        self.scheme = params.get('fec')
+        self.group = params.get('group', 0) if self.scheme else 0
+        self.fd = fd
+        self.size = size
+        self.count = -(-size // self.packet_size)
+        self.held = bytearray(self.count)
+        self.remaining = self.count
+        self.cumulative = 0
+        self.highest = 0
+        self.arrived = 0
+        self.newest_stamp = 0.0
+        self.parities: Dict[int, Dict[int, bytes]] = {}
+        self.address = None
+        self.pending = 0
+        self.last_ack = 0.0
+        self.last_packet = time.monotonic()
+        self.recovered = 0
+        self.done = threading.Event()
+        if self.count == 0:
+            self.done.set()
+
+    def _length(self, seq: int) -> int:
+        return min(self.packet_size, self.size - seq * self.packet_size)
+
+    def on_packet(self, kind: int, number: int, index: int, stamp: float, body: bytes, address: tuple, now: float):
+        self.address = address
+        self.last_packet = now
+        self.arrived += len(body) + HEADER.size
+        self.newest_stamp = max(self.newest_stamp, stamp)
+        if kind == DATA and number < self.count:
+            if not self.held[number]:
+                self._store(number, body)
+                if self.group:
+                    self._recover(number // self.group)
+        elif kind == PARITY and self.group and number * self.group < self.count:
+            self.parities.setdefault(number, {})[index] = body
+            self._recover(number)
+        self.pending += 1
+        if self.done.is_set():
+            self._send(HEADER.pack(self.id, DONE, self.count, 0, self.newest_stamp))
+        elif self.pending >= ACK_EVERY:
+            self.acknowledge(now)
+
+    def _store(self, seq: int, data: bytes):
+        os.pwrite(self.fd, data[:self._length(seq)], seq * self.packet_size)
+        self.held[seq] = 1
+        self.remaining -= 1
+        self.highest = max(self.highest, seq)
+        while self.cumulative < self.count and self.held[self.cumulative]:
+            self.cumulative += 1
+        if self.remaining == 0:
+            self.parities.clear()
+            self.done.set()
+
+    def _recover(self, group: int):
+        parity = self.parities.get(group)
+        if not parity:
+            return
+        first = group * self.group
+        members = range(first, min(first + self.group, self.count))
+        missing = [seq for seq in members if not self.held[seq]]
+        if not missing:
+            del self.parities[group]
+            return
+        if len(missing) > len(parity):
+            return
+        data = {
+            seq - first: os.pread(self.fd, self._length(seq), seq * self.packet_size).ljust(self.packet_size, b'\0')
+            for seq in members if self.held[seq]
+        }
+        rebuilt = fec.recover(len(members), data, parity, self.scheme)
+        del self.parities[group]
+        for offset, packet in (rebuilt or {}).items():
+            self._store(first + offset, packet)
+            self.recovered += 1
+
+    def acknowledge(self, now: float):
+        if self.address is None:
+            return
+        self.pending = 0
+        self.last_ack = now
+        if self.done.is_set():
+            self._send(HEADER.pack(self.id, DONE, self.count, 0, self.newest_stamp))
+            return
+        room = (self.packet_size - SACK_BODY.size) // RANGE.size
+        ranges = []
+        seq = self.cumulative
+        highest = self.highest
+        while seq <= self.highest:
+            if self.held[seq]:
+                seq += 1
+                continue
+            start = seq
+            while seq <= self.highest and not self.held[seq]:
+                seq += 1
+            if len(ranges) == room:
+                highest = start - 1
+                break
+            ranges.append(RANGE.pack(start, seq))
+        body = SACK_BODY.pack(self.arrived, highest) + b''.join(ranges)
+        self._send(HEADER.pack(self.id, SACK, self.cumulative, 0, self.newest_stamp) + body)
+
+    def _send(self, datagram: bytes):
+        try:
+            self.sock.sendto(datagram, self.address)
+        except OSError:
+            pass
+
+    def wait(self, idle_timeout: float) -> bool:
+        """Whether every packet arrived before the flow sat idle for ``idle_timeout``"""
+        while not self.done.wait(0.5):
+            if time.monotonic() - self.last_packet > idle_timeout:
+                return False
+        return True
+
+class DatagramListener:
+    """The UDP side of a node's port: routes datagrams to the flows that
+    transfers have opened and paces their SACKs"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.flows: Dict[int, DatagramFlow] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.bind((self.host, self.port))
+        except OSError as e:
+            sock.close()
+            logger.warning(f"Datagram transfers unavailable; cannot bind UDP {self.host}:{self.port}: {e}")
+            return False
+        sock.settimeout(ACK_DELAY)
+        self.sock = sock
+        threading.Thread(target=self._serve, name='datagrams', daemon=True).start()
+        return True
+
+    def stop(self):
+        if self.sock:
+            self.sock.close()
+
+    @property
+    def available(self) -> bool:
+        return self.sock is not None
+
+    def open(self, params: dict, fd: int, size: int) -> DatagramFlow:
+        flow = DatagramFlow(self.sock, params, fd, size)
+        with self._lock:
+            self.flows[flow.id] = flow
+        return flow
+
+    def close(self, flow: DatagramFlow):
+        with self._lock:
+            self.flows.pop(flow.id, None)
+
+    def _serve(self):
+        while True:
+            try:
+                datagram, address = self.sock.recvfrom(65536)
+            except socket.timeout:
+                datagram = None
+            except OSError:
+                return
+            now = time.monotonic()
+            if datagram is not None and len(datagram) >= HEADER.size:
+                flow_id, kind, number, index, stamp = HEADER.unpack_from(datagram)
+                flow = self.flows.get(flow_id)
+                if flow is not None and kind in (DATA, PARITY):
+                    with self._lock:
+                        flow.on_packet(kind, number, index, stamp, datagram[HEADER.size:], address, now)
+            for flow in list(self.flows.values()):
+                if flow.pending and now - flow.last_ack >= ACK_DELAY:
+                    with self._lock:
+                        flow.acknowledge(now)
@@ -0,0 +1,266 @@
+"""rsync-style delta encoding against an older copy held by the next hop.
+
+The receiver publishes one signature per ``block_size`` block of its basis
+file: rsync's rolling checksum (the "weak" hash: byte sum and weighted byte
+sum, each mod 2**16) and a 16-byte BLAKE2b (the "strong" hash). The sender slides a window over the new file, looks up
+the weak hash of every offset and confirms candidates with the strong hash;
+what it sends is a list of block references and literal byte ranges.
+
+Weak hashes for every window position are computed from prefix sums, a
+segment at a time. Everything is mod 2**16, so with numpy installed it is a
+handful of wrapping uint32 passes per segment; without numpy the same rolling
+update runs in Python, which is correct but much slower.
+"""
+import os
+import math
+import struct
+import hashlib
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from .utils import detach, DELTA_BLOCK_SIZE, CHUNK_SIZE
+from .protocol import recv_exact, iter_recv
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional speed-up
+    np = None
+
+SIGNATURE = struct.Struct('!I16s')
+OP_HEADER = struct.Struct('!BII')
+
+OP_END, OP_COPY, OP_LITERAL = 0, 1, 2
+
+# The op header's length field is 32 bits; longer literals are split
+MAX_LITERAL = 2 ** 32 - 1
+
+MAX_BLOCK_SIZE = 128 * 1024
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+def block_size_for(file_size: int) -> int:
+    """About sqrt(size), as rsync does, rounded to a power of two"""
+    if file_size <= 0:
+        return DELTA_BLOCK_SIZE
+    size = 1 << max(0, math.ceil(math.log2(math.sqrt(file_size))))
+    return max(DELTA_BLOCK_SIZE, min(MAX_BLOCK_SIZE, size))
+
+def strong_hash(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def _weak(a: int, b: int) -> int:
+    return ((b & 0xFFFF) << 16) | (a & 0xFFFF)
+
+def block_weak(block: bytes) -> int:
+    """Weak hash of one block: sum of bytes and sum of prefix sums"""
+    return _weak(sum(block), sum(accumulate(block)))
+
+def _block_weaks(data: bytes, block_size: int) -> list:
+    """Weak hashes of consecutive whole blocks of ``data``"""
+    if np is None:
+        return [block_weak(data[i:i + block_size]) for i in range(0, len(data), block_size)]
+    x = np.frombuffer(data, dtype=np.uint8).reshape(-1, block_size).astype(np.uint32)
+    weights = np.arange(block_size, 0, -1, dtype=np.uint32)
+    a = x.sum(axis=1, dtype=np.uint32)
+    b = (x * weights).sum(axis=1, dtype=np.uint32)
+    return ((((b & 0xFFFF) << 16) | (a & 0xFFFF))).tolist()
+
+def block_signatures(path: str, block_size: int) -> bytes:
+    """Packed (weak, blake2b-128) pairs for every block of ``path``"""
+    signatures = bytearray()
+    segment_size = max(1, SEGMENT_SIZE // block_size) * block_size
+    with open(path, 'rb') as f:
+        while True:
+            segment = f.read(segment_size)
+            if not segment:
+                break
+            whole = len(segment) - len(segment) % block_size
+            weaks = _block_weaks(segment[:whole], block_size) if whole else []
+            if whole < len(segment):
+                weaks.append(block_weak(segment[whole:]))
+            for index, weak in enumerate(weaks):
+                block = segment[index * block_size:(index + 1) * block_size]
+                signatures += SIGNATURE.pack(weak, strong_hash(block))
+    return bytes(signatures)
+
+def parse_signatures(data: bytes) -> Dict[int, List[Tuple[bytes, int]]]:
+    """weak hash → [(strong hash, block index)]"""
+    table: Dict[int, List[Tuple[bytes, int]]] = {}
+    for index, (weak, strong) in enumerate(SIGNATURE.iter_unpack(data)):
+        table.setdefault(weak, []).append((strong, index))
+    return table
+
+def _weak_hashes(segment: bytes, block_size: int, count: int):
+    """Weak hash of the ``block_size`` window at each of the first ``count`` offsets"""
+    if np is not None:
+        # a_k = P[k+B] - P[k]; b_k = Q[k+B] - Q[k] - B * P[k], with P the prefix
+        # sums of the bytes and Q those of P. uint32 wraparound is harmless
+        # because only the low 16 bits are kept.
+        x = np.frombuffer(segment, dtype=np.uint8)
+        p = np.zeros(len(x) + 1, dtype=np.uint32)
+        np.cumsum(x, dtype=np.uint32, out=p[1:])
+        q = np.zeros(len(x) + 1, dtype=np.uint32)
+        np.cumsum(p[1:], dtype=np.uint32, out=q[1:])
+        a = p[block_size:block_size + count] - p[:count]
+        b = q[block_size:block_size + count] - q[:count] - np.uint32(block_size) * p[:count]
+        return ((b & 0xFFFF) << 16) | (a & 0xFFFF)
+
+    hashes = []
+    a = sum(segment[:block_size])
+    b = sum(accumulate(segment[:block_size]))
+    for k in range(count):
+        hashes.append(_weak(a, b))
+        if k + block_size >= len(segment):
+            break
+        out_byte = segment[k]
+        a += segment[k + block_size] - out_byte
+        b += a - block_size * out_byte
+    return hashes
+
+class _WeakFilter:
+    """Vectorized membership test for weak hashes: a bitmap on the low bits
+    rejects almost every offset, and the few survivors are checked exactly"""
+
+    BITS = 1 << 22
+
+    def __init__(self, table: Dict[int, list]):
+        self.table = table
+        if np is not None:
+            self.keys = np.array(sorted(table), dtype=np.uint32)
+            self.bitmap = np.zeros(self.BITS, dtype=bool)
+            self.bitmap[self.keys & (self.BITS - 1)] = True
+
+    def candidates(self, weak) -> List[int]:
+        """Offsets whose weak hash appears in the signature table"""
+        if np is None:
+            return [k for k, value in enumerate(weak) if value in self.table]
+        survivors = np.flatnonzero(self.bitmap[weak & (self.BITS - 1)])
+        return survivors[np.isin(weak[survivors], self.keys)].tolist()
+
+def _segment_candidates(fd: int, start: int, block_size: int, weak_filter: _WeakFilter) -> List[Tuple[int, int]]:
+    """(offset, weak hash) of every candidate window starting in one segment"""
+    segment = os.pread(fd, SEGMENT_SIZE + block_size - 1, start)
+    count = len(segment) - block_size + 1
+    if count <= 0:
+        return []
+    weak = _weak_hashes(segment, block_size, count)
+    return [(start + k, int(weak[k])) for k in weak_filter.candidates(weak)]
+
+def compute_delta(path: str, signatures: bytes, block_size: int) -> List[tuple]:
+    """Ops that rebuild ``path`` from the basis the signatures describe:
+    ``('copy', first_block, block_count)`` and ``('literal', offset, length)``.
+
+    Segments are scanned for candidates in parallel (numpy releases the GIL);
+    the greedy left-to-right match over those candidates is sequential.
+    """
+    table = parse_signatures(signatures)
+    weak_filter = _WeakFilter(table)
+    file_size = os.path.getsize(path)
+    ops: List[tuple] = []
+    literal_start = 0
+
+    def emit_copy(index: int):
+        if ops and ops[-1][0] == 'copy' and ops[-1][1] + ops[-1][2] == index:
+            ops[-1] = ('copy', ops[-1][1], ops[-1][2] + 1)
+        else:
+            ops.append(('copy', index, 1))
+
+    def emit_literal(offset: int, length: int):
+        while length > 0:
+            piece = min(length, MAX_LITERAL)
+            ops.append(('literal', offset, piece))
+            offset += piece
+            length -= piece
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        starts = range(0, max(0, file_size - block_size + 1), SEGMENT_SIZE) if table else []
+        workers = (os.cpu_count() or 1) if np is not None else 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            scans = pool.map(
+                lambda start: _segment_candidates(fd, start, block_size, weak_filter), starts
+            )
+            for candidates in scans:
+                for offset, weak in candidates:
+                    if offset < literal_start:
+                        continue
+                    digest = strong_hash(os.pread(fd, block_size, offset))
+                    for strong, index in table[weak]:
+                        if strong == digest:
+                            if offset > literal_start:
+                                emit_literal(literal_start, offset - literal_start)
+                            emit_copy(index)
+                            literal_start = offset + block_size
+                            break
+    finally:
+        os.close(fd)
+
+    # Only full windows are matched, so a short final basis block is never
+    # referenced and the tail of the file goes as a literal
+    if file_size > literal_start:
+        emit_literal(literal_start, file_size - literal_start)
+    return ops
+
+def delta_size(ops: List[tuple], block_size: int) -> Tuple[int, int]:
+    """(literal bytes, bytes copied from the basis) — the latter approximate for a short last block"""
+    literal = sum(op[2] for op in ops if op[0] == 'literal')
+    copied = sum(op[2] for op in ops if op[0] == 'copy') * block_size
+    return literal, copied
+
+def send_delta(sock, path: str, ops: List[tuple], send_stream) -> None:
+    with open(path, 'rb') as f:
+        for op in ops:
+            if op[0] == 'copy':
+                sock.sendall(OP_HEADER.pack(OP_COPY, op[1], op[2]))
+            else:
+                sock.sendall(OP_HEADER.pack(OP_LITERAL, 0, op[2]))
+                f.seek(op[1])
+                send_stream(sock, f, op[2])
+    sock.sendall(OP_HEADER.pack(OP_END, 0, 0))
+
+def apply_delta(
+    sock,
+    basis_path: str,
+    target_path: str,
+    block_size: int,
+    buffer: memoryview,
+    hasher=None
+) -> Optional[Tuple[str, int]]:
+    """Rebuild the new file from delta ops read off ``sock``.
+
+    Returns (digest, size) of the rebuilt file under ``hasher`` (MD5 by
+    default), or None if the stream ended early.
+    """
+    hasher = hasher or hashlib.md5()
+    size = 0
+    detach(target_path)
+    with open(basis_path, 'rb') as basis, open(target_path, 'wb') as target:
+        while True:
+            header = recv_exact(sock, OP_HEADER.size)
+            if header is None:
+                return None
+            op, first, count = OP_HEADER.unpack(header)
+            if op == OP_END:
+                break
+            if op == OP_COPY:
+                basis.seek(first * block_size)
+                remaining = count * block_size
+                while remaining > 0:
+                    data = basis.read(min(remaining, CHUNK_SIZE * 8))
+                    if not data:
+                        break
+                    hasher.update(data)
+                    target.write(data)
+                    size += len(data)
+                    remaining -= len(data)
+            elif op == OP_LITERAL:
+                received = 0
+                for chunk in iter_recv(sock, count, buffer):
+                    hasher.update(chunk)
+                    target.write(chunk)
+                    received += len(chunk)
+                if received < count:
+                    return None
+                size += received
+            else:
+                raise ValueError(f"Unknown delta op {op}")
+    return hasher.hexdigest(), size
@@ -0,0 +1,48 @@
+"""Multicast sends: merging routes to several destinations into one tree
+
+A tree node is ``{"deliver": transfer_id or null, "children": {hop: node}}``.
+Each hop of a multicast transfer carries the receiving node's subtree as
+``"fanout"``; ``deliver`` is the timeline transfer_id of the destination
+the node is, if it is one.
+"""
+from typing import Dict, List
+
+def build_tree(source: str, routes: Dict[str, List[str]], transfer_ids: Dict[str, str]) -> dict:
+    """Merge the routes from ``source`` to each destination into a tree.
+
+    Routes are added shortest first. Each one is grafted onto the tree at
+    the last of its nodes already in it, so every node appears once and
+    receives the payload once, even where two routes reach it by different
+    paths.
+    """
+    root = {'deliver': None, 'children': {}}
+    nodes = {source: root}
+    for destination, route in sorted(routes.items(), key=lambda item: (len(item[1]), item[0])):
+        graft = max(i for i, hop in enumerate(route) if hop in nodes)
+        node = nodes[route[graft]]
+        for hop in route[graft + 1:]:
+            node = node['children'].setdefault(hop, {'deliver': None, 'children': {}})
+            nodes[hop] = node
+        node['deliver'] = transfer_ids[destination]
+    return root
+
+def tree_paths(tree: dict, source: str) -> Dict[str, List[str]]:
+    """The path from ``source`` to every node of the tree"""
+    paths = {source: [source]}
+    pending = [(source, tree)]
+    while pending:
+        name, node = pending.pop()
+        for hop, child in node['children'].items():
+            paths[hop] = paths[name] + [hop]
+            pending.append((hop, child))
+    return paths
+
+def deliveries(tree: dict) -> List[str]:
+    """transfer_ids of every destination in ``tree``, itself included"""
+    ids = [tree['deliver']] if tree.get('deliver') else []
+    for child in tree['children'].values():
+        ids.extend(deliveries(child))
+    return ids
+
+def edge_count(tree: dict) -> int:
+    return sum(1 + edge_count(child) for child in tree['children'].values())
@@ -0,0 +1,124 @@
+"""Forward error correction for datagram transfers: parity over groups of packets.
+
+A group of up to ``k`` equal-length data packets gets ``m`` parity packets;
+any ``m`` lost packets of the group can be rebuilt from the rest. ``xor``
+is the single-parity case. ``rs`` is a systematic Reed-Solomon code over
+GF(2^8) with a Cauchy generator, so every square submatrix is invertible
+and any ``m`` parities recover any ``m`` losses. Multiplying a packet by a
+constant is one ``bytes.translate`` and adding packets is an integer XOR,
+so the per-byte work runs in C.
+"""
+import math
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+SCHEMES = ('xor', 'rs')
+
+# Largest group plus parity count; the Cauchy points must stay distinct
+MAX_SYMBOLS = 255
+
+_EXP = [0] * 512
+_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    _EXP[_i] = _x
+    _LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+for _i in range(255, 512):
+    _EXP[_i] = _EXP[_i - 255]
+
+def gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+def gf_inv(a: int) -> int:
+    return _EXP[255 - _LOG[a]]
+
+@lru_cache(maxsize=256)
+def _table(c: int) -> bytes:
+    """``bytes.translate`` table multiplying every byte by ``c``"""
+    return bytes(gf_mul(c, x) for x in range(256))
+
+def _scale(data: bytes, c: int) -> bytes:
+    if c == 1:
+        return data
+    return data.translate(_table(c))
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+def _coefficient(row: int, column: int) -> int:
+    """Cauchy entry 1 / (x_row + y_column), with x = 255 - row and y = column"""
+    return gf_inv((MAX_SYMBOLS - row) ^ column)
+
+def parity_count(loss_rate: float, group: int) -> int:
+    """Parity packets a group needs to absorb about twice the expected loss"""
+    return min(group // 2, math.ceil(group * loss_rate * 2)) if loss_rate > 0 else 0
+
+def encode(packets: List[bytes], count: int, scheme: str) -> List[bytes]:
+    """``count`` parity packets for a group of equal-length ``packets``"""
+    if scheme == 'xor':
+        parity = packets[0]
+        for packet in packets[1:]:
+            parity = _xor(parity, packet)
+        return [parity]
+    parities = []
+    for row in range(count):
+        parity = None
+        for column, packet in enumerate(packets):
+            term = _scale(packet, _coefficient(row, column))
+            parity = term if parity is None else _xor(parity, term)
+        parities.append(parity)
+    return parities
+
+def _invert(matrix: List[List[int]]) -> List[List[int]]:
+    """Gauss-Jordan inverse over GF(2^8)"""
+    n = len(matrix)
+    rows = [row[:] + [int(i == j) for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next(r for r in range(col, n) if rows[r][col])
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = gf_inv(rows[col][col])
+        rows[col] = [gf_mul(scale, v) for v in rows[col]]
+        for r in range(n):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [v ^ gf_mul(factor, p) for v, p in zip(rows[r], rows[col])]
+    return [row[n:] for row in rows]
+
+def recover(size: int, data: Dict[int, bytes], parity: Dict[int, bytes], scheme: str) -> Optional[Dict[int, bytes]]:
+    """The missing members of a group of ``size`` packets, rebuilt from the
+    ``data`` and ``parity`` packets that arrived (by index); None if too many
+    are missing"""
+    missing = [i for i in range(size) if i not in data]
+    if not missing:
+        return {}
+    if len(missing) > len(parity):
+        return None
+    if scheme == 'xor':
+        rebuilt = parity[0]
+        for packet in data.values():
+            rebuilt = _xor(rebuilt, packet)
+        return {missing[0]: rebuilt}
+
+    rows = sorted(parity)[:len(missing)]
+    # Strip the known packets out of each parity, leaving a combination of the missing ones
+    syndromes = []
+    for row in rows:
+        syndrome = parity[row]
+        for column, packet in data.items():
+            syndrome = _xor(syndrome, _scale(packet, _coefficient(row, column)))
+        syndromes.append(syndrome)
+    inverse = _invert([[_coefficient(row, column) for column in missing] for row in rows])
+    rebuilt = {}
+    for i, column in enumerate(missing):
+        packet = None
+        for j, syndrome in enumerate(syndromes):
+            if inverse[i][j]:
+                term = _scale(syndrome, inverse[i][j])
+                packet = term if packet is None else _xor(packet, term)
+        rebuilt[column] = packet if packet is not None else bytes(len(syndromes[0]))
+    return rebuilt
@@ -1,18 +1,22 @@
 import grpc
 import sys
 import os
-from typing import Optional, Callable, List
+from typing import Optional, Callable, List, Set
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 from proto import algorithm_stream_pb2, algorithm_stream_pb2_grpc
-from .utils import get_logger, HEURISTIC_ADDR, ALGORITHM
+from .utils import get_logger, HEURISTIC_ADDR, ALGORITHM, ROUTE_DEADLINE
+from .route_cache import RouteCache
+from .topology import load_adjacency, local_route
 
 logger = get_logger('agent.grpc_client')
 
 class HeuristicClient:
-    def __init__(self, server_address: str = HEURISTIC_ADDR):
+    def __init__(self, server_address: str = HEURISTIC_ADDR, deadline: float = ROUTE_DEADLINE):
         self.server_address = server_address
+        self.deadline = deadline
+        self.cache = RouteCache()
         self.channel = None
         self.stub = None
     
@@ -31,18 +35,47 @@ class HeuristicClient:
         algorithm: str = ALGORITHM,
         on_step: Optional[Callable] = None
     ) -> Optional[List[str]]:
+        result = self.find_route_result(src, dst, algorithm, on_step)
+        return result['path'] if result else None
+    
+    def find_route_result(
+        self,
+        src: str,
+        dst: str,
+        algorithm: str = ALGORITHM,
+        on_step: Optional[Callable] = None,
+        exclude: Optional[List[str]] = None,
+        timeout: Optional[float] = None
+    ) -> Optional[dict]:
+        """Like find_route, but returns the full RouteResult as a dict.
+
+        Without ``on_step`` the server is asked to skip step events and a
+        recent result for (src, dst, algorithm) is served from the cache.
+        ``timeout`` overrides the per-call deadline (``ROUTE_DEADLINE``).
+        """
+        cacheable = on_step is None and not exclude
+        if cacheable:
+            cached = self.cache.get(src, dst, algorithm)
+            if cached:
+                return cached
+
         if not self.stub:
             self.connect()
         try:
             request = algorithm_stream_pb2.AlgorithmRunRequest(
                 algo=algorithm,
                 src=src,
-                dst=dst
+                dst=dst,
+                exclude=exclude or [],
+                result_only=on_step is None
             )
             
-            stream = self.stub.RunAlgorithm(request)
+            stream = self.stub.RunAlgorithm(
+                request,
+                timeout=self.deadline if timeout is None else timeout
+            )
             
-            route_path = None
+            route_result = None
             
             for event in stream:
                 if event.HasField('run_start'):
@@ -56,9 +89,17 @@ class HeuristicClient:
                 elif event.HasField('complete'):
                     complete = event.complete
                     if complete.result and complete.result.path:
-                        route_path = list(complete.result.path)
+                        result = complete.result
+                        route_result = {
+                            'path': list(result.path),
+                            'total_delay_ms': result.total_delay_ms,
+                            'min_bandwidth_mbps': result.min_bandwidth_mbps,
+                            'hop_count': result.hop_count
+                        }
             
-            return route_path
+            if cacheable and route_result:
+                self.cache.put(src, dst, algorithm, route_result)
+            return route_result
         
         except grpc.RpcError as e:
             logger.error(f"❌ gRPC error: {e.code()} - {e.details()}")
@@ -67,6 +108,53 @@ class HeuristicClient:
             logger.error(f"❌ Unexpected error: {e}")
             raise
     
+    def find_disjoint_routes(
+        self,
+        src: str,
+        dst: str,
+        k: int,
+        algorithm: str = ALGORITHM
+    ) -> List[dict]:
+        """Up to ``k`` routes whose intermediate nodes do not overlap.
+
+        Each further route is requested with the nodes used so far excluded.
+        Servers that ignore ``exclude`` hand back an overlapping path; the rest
+        of the routes then come from a local search over topology.json.
+        """
+        routes: List[dict] = []
+        used: Set[str] = set()
+
+        while len(routes) < k:
+            result = self.find_route_result(src, dst, algorithm, exclude=sorted(used))
+            if not result or not self._is_disjoint(result['path'], used, routes):
+                break
+            routes.append(result)
+            used.update(result['path'][1:-1])
+
+        if routes and len(routes) < k:
+            adjacency = load_adjacency()
+            while len(routes) < k:
+                result = local_route(src, dst, used, adjacency)
+                if not result or not self._is_disjoint(result['path'], used, routes):
+                    break
+                routes.append(result)
+                used.update(result['path'][1:-1])
+
+        return routes
+    
+    def invalidate_route(self, src: str, dst: str, failed_hop: Optional[str] = None):
+        """Forget routes after a failed transfer: the src→dst entries, and
+        with ``failed_hop`` every cached route through that node"""
+        self.cache.invalidate(src, dst)
+        if failed_hop:
+            self.cache.invalidate_node(failed_hop)
+    
+    @staticmethod
+    def _is_disjoint(path: List[str], used: Set[str], routes: List[dict]) -> bool:
+        if any(node in used for node in path[1:-1]):
+            return False
+        return all(path != route['path'] for route in routes)
+    
     def close(self):
         if self.channel:
             self.channel.close()
@@ -0,0 +1,156 @@
+"""Pluggable integrity hashes for hop verification.
+
+A hash spec names an algorithm (``md5``, ``sha256``, ``blake2b`` or
+``crc32``), optionally as a tree hash: ``blake2b-tree`` hashes the file in
+fixed-size leaves and the digest is the hash of the concatenated leaf
+digests, so a whole file can be hashed by every core at once. The source
+picks the spec and every hop verifies with it; the canonical form carries
+the leaf size (``blake2b-tree:4194304``) so all hops agree on the layout.
+"""
+import os
+import zlib
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from .utils import HASH_LEAF_SIZE, HASH_WORKERS
+
+class Crc32:
+    """hashlib-style wrapper around zlib.crc32"""
+
+    digest_size = 4
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def digest(self) -> bytes:
+        return self.value.to_bytes(4, 'big')
+
+    def hexdigest(self) -> str:
+        return f"{self.value:08x}"
+
+ALGORITHMS = {
+    'md5': hashlib.md5,
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+    'crc32': Crc32,
+}
+
+# Digests that are safe to use as content addresses
+COLLISION_RESISTANT = ('md5', 'sha256', 'blake2b')
+
+READ_SIZE = 1024 * 1024
+
+def parse_hash(spec: str) -> Tuple[str, int]:
+    """Split a hash spec into (algorithm, leaf size); leaf size 0 means flat"""
+    name, _, leaf = spec.strip().lower().partition(':')
+    tree = name.endswith('-tree')
+    if tree:
+        name = name[:-len('-tree')]
+    if name not in ALGORITHMS:
+        raise ValueError(f"Unknown hash {spec!r}; expected one of {', '.join(ALGORITHMS)}")
+    if not tree:
+        return name, 0
+    leaf_size = int(leaf) if leaf else HASH_LEAF_SIZE
+    if leaf_size <= 0:
+        raise ValueError(f"Invalid tree leaf size in {spec!r}")
+    return name, leaf_size
+
+def canonical_hash(spec: str) -> str:
+    """The spec as it travels in metadata, with the leaf size spelled out"""
+    name, leaf_size = parse_hash(spec)
+    return f"{name}-tree:{leaf_size}" if leaf_size else name
+
+def identifies_content(spec: str) -> bool:
+    return parse_hash(spec)[0] in COLLISION_RESISTANT
+
+def content_key(spec: str, digest: Optional[str]) -> Optional[str]:
+    """Content-store key for a verified digest, or None if the hash is too
+    weak to identify content. MD5 digests keep their bare form."""
+    if digest is None or not identifies_content(spec):
+        return None
+    name, leaf_size = parse_hash(spec)
+    if name == 'md5' and not leaf_size:
+        return digest
+    return f"{name}-{leaf_size}-{digest}" if leaf_size else f"{name}-{digest}"
+
+class TreeHasher:
+    """Streaming form of a tree hash: leaves are hashed as the bytes arrive"""
+
+    def __init__(self, name: str, leaf_size: int):
+        self.factory = ALGORITHMS[name]
+        self.leaf_size = leaf_size
+        self.leaves = []
+        self.leaf = self.factory()
+        self.filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.leaf_size - self.filled)
+            self.leaf.update(view[:take])
+            self.filled += take
+            view = view[take:]
+            if self.filled == self.leaf_size:
+                self.leaves.append(self.leaf.digest())
+                self.leaf = self.factory()
+                self.filled = 0
+
+    def hexdigest(self) -> str:
+        leaves = self.leaves + [self.leaf.digest()] if self.filled else self.leaves
+        return _root(self.factory, leaves)
+
+def _root(factory, leaves) -> str:
+    root = factory()
+    root.update(b''.join(leaves))
+    return root.hexdigest()
+
+def new_hasher(spec: str = 'md5'):
+    """An object with ``update`` and ``hexdigest`` for ``spec``"""
+    name, leaf_size = parse_hash(spec)
+    if leaf_size:
+        return TreeHasher(name, leaf_size)
+    return ALGORITHMS[name]()
+
+def hash_file(path: str, spec: str = 'md5', workers: int = HASH_WORKERS) -> str:
+    """Digest of a file on disk. Tree hashes read and hash their leaves on
+    ``workers`` threads (hashlib and zlib release the GIL on large buffers)."""
+    name, leaf_size = parse_hash(spec)
+    if not leaf_size:
+        hasher = ALGORITHMS[name]()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_SIZE), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    factory = ALGORITHMS[name]
+    file_size = os.path.getsize(path)
+    fd = os.open(path, os.O_RDONLY)
+
+    def hash_leaf(offset: int) -> bytes:
+        hasher = factory()
+        end = min(offset + leaf_size, file_size)
+        while offset < end:
+            chunk = os.pread(fd, min(READ_SIZE, end - offset), offset)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            offset += len(chunk)
+        return hasher.digest()
+
+    try:
+        offsets = range(0, file_size, leaf_size)
+        if workers > 1 and len(offsets) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(offsets))) as pool:
+                leaves = list(pool.map(hash_leaf, offsets))
+        else:
+            leaves = [hash_leaf(offset) for offset in offsets]
+    finally:
+        os.close(fd)
+    return _root(factory, leaves)
+
+def hop_hash(metadata: Optional[dict]) -> str:
+    """The hash a transfer's digests use; senders that predate ``hash`` use MD5"""
+    return (metadata or {}).get('hash') or 'md5'
@@ -0,0 +1,73 @@
+"""Link characteristics shared with the metric agent's SAGSIN link model"""
+import os
+import json
+import math
+import time
+import threading
+from typing import Optional
+from .utils import STREAM_WINDOW, MAX_PARALLEL_STREAMS, LINK_METRICS_FILE, LINK_METRICS_MAX_AGE
+
+try:
+    # The metric agent's tables, when its package is on the path (the Docker
+    # image sets PYTHONPATH=/app/metric-agent)
+    from network.utils import get_node_type, LINK_DELAYS, BANDWIDTH_RANGES, BASE_LOSS_RATES
+except ImportError:
+    # Every node is then of unknown type and every link gets the static
+    # profile below; measured links (live_link) are unaffected
+    def get_node_type(hostname: str) -> str:
+        return 'unknown'
+
+    LINK_DELAYS, BANDWIDTH_RANGES = {}, {}
+    BASE_LOSS_RATES = {'unknown': (0.001, 0.01)}
+
+def _pair_lookup(table: dict, src_type: str, dst_type: str, default: tuple) -> tuple:
+    # The tables list each pair once, in no particular order
+    return table.get((src_type, dst_type)) or table.get((dst_type, src_type)) or default
+
+def expected_link(src: str, dst: str) -> dict:
+    """Typical delay (ms), bandwidth (Mbit/s) and loss rate between two nodes, by node type"""
+    src_type = get_node_type(src)
+    dst_type = get_node_type(dst)
+    delay_min, delay_max = _pair_lookup(LINK_DELAYS, src_type, dst_type, (50, 250))
+    bandwidth_min, bandwidth_max = _pair_lookup(BANDWIDTH_RANGES, src_type, dst_type, (10, 100))
+    # The lossier end decides, as in the metric agent's link model
+    loss = max(sum(BASE_LOSS_RATES.get(t, BASE_LOSS_RATES['unknown'])) / 2 for t in (src_type, dst_type))
+    return {
+        'delay_ms': (delay_min + delay_max) / 2,
+        'bandwidth_mbps': (bandwidth_min + bandwidth_max) / 2,
+        'loss_rate': loss
+    }
+
+def bandwidth_delay_product(src: str, dst: str) -> int:
+    """Bytes in flight needed to keep the link full (delay is treated as RTT)"""
+    link = expected_link(src, dst)
+    return int(link['bandwidth_mbps'] * 1_000_000 / 8 * link['delay_ms'] / 1000)
+
+def default_stream_count(src: str, dst: str) -> int:
+    """Parallel TCP streams needed to cover the link's BDP with STREAM_WINDOW each"""
+    streams = math.ceil(bandwidth_delay_product(src, dst) / STREAM_WINDOW)
+    return max(1, min(streams, MAX_PARALLEL_STREAMS))
+
+_live = {'mtime': None, 'timestamp': 0.0, 'links': {}}
+_live_lock = threading.Lock()
+
+def live_link(neighbor: str) -> Optional[dict]:
+    """The metric agent's latest measurement of the link to ``neighbor``
+    (delay_ms, jitter_ms, loss_rate, bandwidth_mbps, available, ...), or None
+    if there is none younger than LINK_METRICS_MAX_AGE. The file is re-read
+    only when it changes."""
+    try:
+        mtime = os.stat(LINK_METRICS_FILE).st_mtime
+    except OSError:
+        return None
+    with _live_lock:
+        if mtime != _live['mtime']:
+            try:
+                with open(LINK_METRICS_FILE, 'r') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                return None
+            _live.update(mtime=mtime, timestamp=snapshot.get('timestamp', mtime), links=snapshot.get('links', {}))
+        if time.time() - _live['timestamp'] > LINK_METRICS_MAX_AGE:
+            return None
+        return _live['links'].get(neighbor)
@@ -0,0 +1,134 @@
+"""Chunk manifests that let an interrupted hop resume from the chunks already held"""
+import os
+import json
+import zlib
+from typing import Dict, List, Optional, Tuple
+from .utils import ensure_directory, RESUME_CHUNK_SIZE
+
+MANIFEST_DIR = '.manifests'
+
+def chunk_digests(file_path: str, chunk_size: int = RESUME_CHUNK_SIZE, hasher=None) -> Tuple[Optional[str], List[int]]:
+    """Per-chunk CRC32s and (optionally) the whole-file digest under
+    ``hasher`` in one read pass"""
+    crcs = []
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            if hasher:
+                hasher.update(chunk)
+            crcs.append(zlib.crc32(chunk))
+    return (hasher.hexdigest() if hasher else None), crcs
+
+class ChunkManifest:
+    """Append-only record of the verified chunks of one partial file.
+
+    The first line holds the transfer header (file size and chunk size); each
+    following line records one chunk index and the CRC32 of its bytes, written
+    only after the chunk itself has been flushed to the data file.
+    """
+
+    def __init__(self, path: str, file_size: int, chunk_size: int, chunks: Dict[int, int]):
+        self.path = path
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.chunks = chunks
+        self._log = None
+
+    @classmethod
+    def location(cls, save_dir: str, transfer_id: str) -> str:
+        return os.path.join(save_dir, MANIFEST_DIR, f"{transfer_id}.jsonl")
+
+    @classmethod
+    def create(cls, path: str, file_size: int, chunk_size: int = RESUME_CHUNK_SIZE) -> 'ChunkManifest':
+        ensure_directory(os.path.dirname(path))
+        manifest = cls(path, file_size, chunk_size, {})
+        manifest._log = open(path, 'w')
+        manifest._write({'file_size': file_size, 'chunk_size': chunk_size})
+        return manifest
+
+    @classmethod
+    def load(cls, path: str, file_size: int, chunk_size: int) -> Optional['ChunkManifest']:
+        """Reopen an existing manifest, or None if absent or for a different layout"""
+        try:
+            with open(path, 'r') as f:
+                header = json.loads(f.readline())
+                if header.get('file_size') != file_size or header.get('chunk_size') != chunk_size:
+                    return None
+                chunks = {}
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn final line from a crash
+                    chunks[entry['i']] = entry['crc']
+        except (OSError, ValueError):
+            return None
+
+        manifest = cls(path, file_size, chunk_size, chunks)
+        manifest._log = open(path, 'a')
+        return manifest
+
+    def chunk_count(self) -> int:
+        return max(1, -(-self.file_size // self.chunk_size))
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.file_size - index * self.chunk_size)
+
+    def record(self, index: int, crc: int):
+        self.chunks[index] = crc
+        self._write({'i': index, 'crc': crc})
+
+    def _write(self, entry: dict):
+        self._log.write(json.dumps(entry) + '\n')
+        self._log.flush()
+
+    def close(self):
+        if self._log:
+            self._log.close()
+            self._log = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class ChunkTracker:
+    """Feeds a manifest from a sequential write stream.
+
+    ``flush`` is called before a chunk is recorded so the manifest never
+    claims bytes that are still in a userspace buffer.
+    """
+
+    def __init__(self, manifest: ChunkManifest, flush=None):
+        self.manifest = manifest
+        self.flush = flush
+        self.index = 0
+        self.filled = 0
+        self.crc = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        chunk_size = self.manifest.chunk_size
+        while view:
+            take = min(len(view), chunk_size - self.filled)
+            self.crc = zlib.crc32(view[:take], self.crc)
+            self.filled += take
+            view = view[take:]
+            if self.filled == chunk_size:
+                self._record()
+
+    def finish(self):
+        if self.filled:
+            self._record()
+
+    def _record(self):
+        if self.flush:
+            self.flush()
+        self.manifest.record(self.index, self.crc)
+        self.index += 1
+        self.filled = 0
+        self.crc = 0
@@ -0,0 +1,107 @@
+"""Striping one file across several node-disjoint routes"""
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, List, Set
+from .utils import get_logger, preallocate, detach, RESUME_CHUNK_SIZE
+
+logger = get_logger('agent.multipath')
+
+TRACKER_FILE = '.stripes.json'
+
+def split_weighted(file_size: int, weights: List[float], align: int = RESUME_CHUNK_SIZE) -> List[dict]:
+    """Split ``file_size`` bytes into one contiguous range per weight.
+
+    Range lengths are proportional to the weights (route bottleneck
+    bandwidths) and rounded to ``align`` so stripes start on whole chunks
+    (and pages); the last range takes the remainder.
+    """
+    if sum(weights) <= 0:
+        weights = [1.0] * len(weights)
+    total = sum(weights)
+    ranges = []
+    offset = 0
+    cumulative = 0.0
+    for index, weight in enumerate(weights):
+        cumulative += weight
+        if index == len(weights) - 1:
+            end = file_size
+        else:
+            # Round the cumulative boundary so rounding errors do not pile
+            # up on the last stripe
+            end = min(file_size, max(offset, round(file_size * cumulative / total / align) * align))
+        ranges.append({'index': index, 'offset': offset, 'length': end - offset})
+        offset = end
+    return ranges
+
+def stripe_filename(filename: str, index: int) -> str:
+    return f"{filename}.stripe{index}"
+
+def merge_stripes(stripe_paths: List[str], target_path: str, file_size: int, hasher=None) -> str:
+    """Concatenate stripes in order into ``target_path``; returns its digest
+    under ``hasher`` (MD5 by default)"""
+    hasher = hasher or hashlib.md5()
+    detach(target_path)
+    with open(target_path, 'wb') as dst:
+        preallocate(dst, file_size)
+        for path in stripe_paths:
+            with open(path, 'rb') as src:
+                while True:
+                    chunk = src.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    dst.write(chunk)
+    return hasher.hexdigest()
+
+def remove_stripes(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+class StripeTracker:
+    """Stripes received at the destination, keyed by transfer_id.
+
+    Written to ``.stripes.json`` in the directory the stripes are saved to
+    on every change, so stripes that arrived before a restart still count
+    towards reassembly.
+    """
+
+    def __init__(self, directory: str):
+        self.state_path = os.path.join(directory, TRACKER_FILE)
+        self._received: Dict[str, Set[int]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                received = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Stripe state unreadable, starting empty: {e}")
+            return
+        self._received = {transfer_id: set(indexes) for transfer_id, indexes in received.items()}
+        if self._received:
+            logger.info(f"Resumed {len(self._received)} partly received multipath transfers")
+
+    def _save(self):
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({transfer_id: sorted(indexes) for transfer_id, indexes in self._received.items()}, f)
+        os.replace(temp_path, self.state_path)
+
+    def complete(self, transfer_id: str, index: int, count: int) -> bool:
+        """Record one verified stripe; True exactly once, when the last arrives"""
+        with self._lock:
+            received = self._received.setdefault(transfer_id, set())
+            received.add(index)
+            done = len(received) >= count
+            if done:
+                del self._received[transfer_id]
+            self._save()
+            return done
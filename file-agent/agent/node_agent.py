@@ -1,18 +1,42 @@
 import socket
-import struct
-import json
 import os
+import shutil
+import zlib
 import threading
-from typing import Dict
+from typing import Optional
 from .utils import (
-    get_logger, calculate_md5, ensure_directory,
-    get_timestamp, HOST_NAME, NODE_HOST, NODE_PORT, CHUNK_SIZE
+    get_logger, ensure_directory, preallocate, detach,
+    HOST_NAME, NODE_HOST, NODE_PORT, RELAY_MODE, RELAY_TEE, LISTEN_BACKLOG, CUSTODY_QUEUE, RESUME_CHUNK_SIZE
 )
 from .sender import FileSender
+from .assembly import AssemblyRegistry
+from .multipath import StripeTracker, merge_stripes, remove_stripes, stripe_filename
+from .batch import ARCHIVE_SUFFIX, unpack_archive
+from .compression import decode_file
+from .content_store import ContentStore
+from .relay_cache import RelayCache, check_free_space
+from .spool import MemorySpool
+from .custody import CustodyQueue
+from .hashing import new_hasher, hash_file, hop_hash, content_key
+from .fanout import deliveries
+from .delta import block_size_for, block_signatures, apply_delta
+from .manifest import ChunkManifest, ChunkTracker
+from .scheduler import get_scheduler, priority_of
+from .transport import receive_buffer_size, link_profile
+from .datagram import DatagramListener
 from .timeline_client import get_timeline_client
+from .protocol import (
+    recv_metadata, send_metadata, send_frame, recv_frame, send_trailer,
+    recv_exact, recv_expected_md5, iter_recv,
+    send_ack, recv_ack
+)
+from .session import SESSION_PREAMBLE, Session, Stream, accept_session
 
 logger = get_logger('agent.node_agent')
 
+# Metadata fields every hop forwards unchanged to the destination
+END_TO_END_FIELDS = ('stripe', 'encoding', 'hash', 'archive', 'priority', 'deadline')
+
 class NodeAgent:
     def __init__(
         self, 
@@ -30,18 +54,33 @@ class NodeAgent:
         ensure_directory(relay_dir)
         
         self.sender = FileSender(send_dir=relay_dir)
+        self.assemblies = AssemblyRegistry()
+        self.stripes = StripeTracker(receive_dir)
+        self.sessions = set()
+        self.store = ContentStore(relay_dir)
+        self.relay_cache = RelayCache(relay_dir)
+        self.relay_cache.sweep()
+        self.spool = MemorySpool()
+        self.datagrams = DatagramListener(host, port)
+        self.custody = CustodyQueue(
+            self.relay_cache, self.sender, self._custody_delivered, self._custody_given_up
+        ) if CUSTODY_QUEUE else None
         self.running = False
         self.server_socket = None
     
     def start(self):
         self.running = True
+        self.relay_cache.start_reporter()
+        if self.custody:
+            self.custody.start()
+        self.datagrams.start()
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.settimeout(1.0) 
         
         try:
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.server_socket.listen(LISTEN_BACKLOG)
         except OSError as e:
             logger.error(f"Failed to bind to {self.host}:{self.port}: {e}")
             return
@@ -73,6 +112,12 @@ class NodeAgent:
             return
         
         self.running = False
+        if self.custody:
+            self.custody.stop()
+        self.datagrams.stop()
+        
+        for session in list(self.sessions):
+            session.close()
         
         if self.server_socket:
             try:
@@ -83,103 +128,830 @@ class NodeAgent:
     
     def _handle_client(self, client_socket: socket.socket, client_address: tuple):
         try:
-            metadata_len_bytes = self._recv_exact(client_socket, 4)
-            if not metadata_len_bytes:
-                logger.error("Failed to receive metadata length")
+            head = recv_exact(client_socket, 4)
+            if head == SESSION_PREAMBLE[:4]:
+                if recv_exact(client_socket, 4) == SESSION_PREAMBLE[4:]:
+                    self._serve_session(client_socket, client_address)
+                else:
+                    logger.error("Empty metadata frame")
                 return
-            
-            metadata_len = struct.unpack('!I', metadata_len_bytes)[0]
-            
-            metadata_bytes = self._recv_exact(client_socket, metadata_len)
-            if not metadata_bytes:
+
+            metadata = recv_metadata(client_socket, head)
+            if not metadata:
                 logger.error("Failed to receive metadata")
                 return
-            
-            metadata = json.loads(metadata_bytes.decode('utf-8'))
-            
-            transfer_id = metadata['transfer_id']
-            filename = metadata['filename']
-            route = metadata['route']
-            current_index = metadata['current_index']
-            file_size = metadata['file_size']
-            expected_md5 = metadata['md5']
-
-            is_destination = current_index >= len(route) - 1
-            
-            save_dir = self.receive_dir if is_destination else self.relay_dir
-            # Add transfer_id prefix for final destination
-            if is_destination:
-                final_filename = f"{transfer_id}-{filename}"
+
+            # One receive buffer per connection, reused for every chunk and
+            # sized for the link the transfer arrives on
+            buffer = memoryview(bytearray(receive_buffer_size(metadata)))
+            self._process_transfer(client_socket, metadata, buffer)
+        
+        except Exception as e:
+            logger.error(f"Error handling client: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            client_socket.close()
+    
+    def _serve_session(self, client_socket: socket.socket, client_address: tuple):
+        """Serve a multiplexed session; each stream is handled like a one-shot connection"""
+        logger.info(f"Session from {client_address[0]} opened")
+        accept_session(client_socket)
+        session = Session(
+            client_socket,
+            on_open=lambda stream: self._spawn_stream(stream, client_address),
+            name=client_address[0]
+        )
+        self.sessions.add(session)
+        try:
+            session.run()
+        finally:
+            self.sessions.discard(session)
+        logger.info(f"Session from {client_address[0]} closed")
+    
+    def _spawn_stream(self, stream: Stream, client_address: tuple):
+        threading.Thread(
+            target=self._handle_client,
+            args=(stream, client_address),
+            daemon=True
+        ).start()
+    
+    def _process_transfer(self, client_socket: socket.socket, metadata: dict, buffer: memoryview):
+        is_destination = self._is_destination(metadata)
+        if self._spoolable(metadata):
+            spooled = self.spool.acquire(metadata['file_size'])
+            if spooled is not None:
+                self._spool_and_forward(client_socket, metadata, spooled)
+                return
+        refusal = self._admit(metadata)
+        if refusal:
+            self._refuse(client_socket, metadata, refusal)
+            return
+        try:
+            if metadata.get('offer') and self._answer_offer(client_socket, metadata, is_destination, buffer):
+                return
+            if 'range' in metadata:
+                self._receive_range(client_socket, metadata, is_destination, buffer)
+            elif metadata.get('resume'):
+                self._receive_resumable(client_socket, metadata, is_destination, buffer)
+            elif 'datagram' in metadata:
+                self._receive_datagrams(client_socket, metadata, is_destination)
+            elif not is_destination and RELAY_MODE == 'cut-through' and 'fanout' not in metadata:
+                self._relay_cut_through(client_socket, metadata, buffer)
             else:
-                final_filename = filename
-            save_path = os.path.join(save_dir, final_filename)
-            
+                self._store_and_forward(client_socket, metadata, is_destination, buffer)
+        finally:
+            self._settle(metadata)
+    
+    def _spoolable(self, metadata: dict) -> bool:
+        """Whether a relay can hold this transfer in memory: a small
+        store-and-forward hop that the content cache cannot answer"""
+        if self._is_destination(metadata) or RELAY_MODE == 'cut-through':
+            return False
+        if not self.spool.eligible(metadata['file_size']):
+            return False
+        if 'range' in metadata or 'datagram' in metadata or 'fanout' in metadata:
+            return False
+        if metadata.get('resume') or metadata.get('probe'):
+            return False
+        if metadata.get('offer'):
+            if self.store.lookup(content_key(hop_hash(metadata), metadata['md5'])):
+                return False
+            if metadata.get('delta') and self.store.latest(metadata['filename']):
+                return False
+        return True
+    
+    def _spool_and_forward(self, client_socket: socket.socket, metadata: dict, spooled: bytearray):
+        """Store-and-forward through a memory buffer: the payload is received,
+        verified and forwarded once without a file. If that forward fails it
+        is written to the relay cache and the buffer released before the
+        retries and their backoff."""
+        file_size = metadata['file_size']
+        save_path = self._save_path(metadata, False)
+        try:
+            if metadata.get('offer'):
+                send_frame(client_socket, {'status': 'SEND'})
+
+            payload = memoryview(spooled)[:file_size]
             bytes_received = 0
+            while bytes_received < file_size:
+                count = client_socket.recv_into(payload[bytes_received:], file_size - bytes_received)
+                if not count:
+                    logger.error(f"Upstream closed after {bytes_received}/{file_size} bytes")
+                    return
+                bytes_received += count
+
+            expected_md5 = recv_expected_md5(client_socket, metadata)
+            hasher = new_hasher(hop_hash(metadata))
+            hasher.update(payload)
+            actual_md5 = hasher.hexdigest()
+            if actual_md5 != expected_md5:
+                logger.error(f"MD5 mismatch! Expected {expected_md5}, got {actual_md5}")
+                send_ack(client_socket, False, "MD5 verification failed")
+                return
+
+            send_ack(client_socket, True, "File received successfully")
+            self._send_timeline_update(metadata['transfer_id'], 'PENDING')
+            if self.sender._send_to_next_hop(
+                save_path, metadata['filename'], metadata['transfer_id'], metadata['route'],
+                metadata['current_index'], actual_md5,
+                extra={k: metadata[k] for k in END_TO_END_FIELDS if k in metadata}, payload=payload
+            ):
+                logger.info("Relay successful")
+                return
+            if not self._persist(metadata, save_path, payload):
+                # Upstream already has our ACK, so nobody else will retry it
+                logger.error(f"Relay failed; no room to keep {metadata['filename']} in the relay cache")
+                self._send_timeline_update(metadata['transfer_id'], 'FAILED')
+                return
+        finally:
+            self.spool.release(spooled)
+
+        logger.info(f"Relay from memory failed; retrying from {save_path}")
+        try:
+            self._forward_relay(metadata, save_path, actual_md5)
+        finally:
+            self.relay_cache.release(self._transfer_key(metadata))
+    
+    def _persist(self, metadata: dict, save_path: str, payload: memoryview) -> bool:
+        """Write a spooled payload to the relay cache, as if stored there.
+        A written file stays admitted until the caller releases it, so it
+        cannot be evicted before it is forwarded or taken into custody."""
+        key = self._transfer_key(metadata)
+        if self.relay_cache.admit(key, save_path, len(payload)):
+            return False
+        try:
             with open(save_path, 'wb') as f:
-                while bytes_received < file_size:
-                    chunk_size = min(CHUNK_SIZE, file_size - bytes_received)
-                    chunk = client_socket.recv(chunk_size)
-                    if not chunk:
-                        break
+                f.write(payload)
+        except OSError as e:
+            logger.error(f"Failed to write {save_path}: {e}")
+            self.relay_cache.release(key)
+            self._discard(save_path)
+            return False
+        return True
+    
+    def _stores_relay_file(self, metadata: dict) -> bool:
+        if self._is_destination(metadata):
+            return False
+        # Cut-through relays write nothing unless teeing, but ranges, resumes,
+        # datagram flows, multicast branches and offers (HAVE copies, deltas)
+        # are always stored first
+        return (RELAY_MODE != 'cut-through' or RELAY_TEE or 'range' in metadata or 'datagram' in metadata
+                or 'fanout' in metadata or bool(metadata.get('resume') or metadata.get('offer')))
+    
+    def _admit(self, metadata: dict) -> Optional[str]:
+        """Check there is room for the incoming file; returns why not, or None"""
+        if self._is_destination(metadata):
+            return check_free_space(self.receive_dir, metadata['file_size'])
+        if not self._stores_relay_file(metadata):
+            return None
+        return self.relay_cache.admit(
+            self._transfer_key(metadata), self._save_path(metadata, False), metadata['file_size']
+        )
+    
+    def _settle(self, metadata: dict):
+        if self._stores_relay_file(metadata):
+            self.relay_cache.release(self._transfer_key(metadata))
+    
+    def _refuse(self, client_socket: socket.socket, metadata: dict, reason: str):
+        """Turn a transfer away before its payload; a session stream is reset
+        so the sender's pending writes fail at once"""
+        logger.error(f"Refused {metadata['transfer_id']}: {reason}")
+        if metadata.get('offer'):
+            send_frame(client_socket, {'status': 'ERROR', 'message': reason})
+        else:
+            send_ack(client_socket, False, reason)
+        if isinstance(client_socket, Stream):
+            client_socket.reset()
+    
+    def _discard(self, save_path: str):
+        """Delete a file that failed verification"""
+        try:
+            os.remove(save_path)
+        except FileNotFoundError:
+            pass
+    
+    def _answer_offer(
+        self,
+        client_socket: socket.socket,
+        metadata: dict,
+        is_destination: bool,
+        buffer: memoryview
+    ) -> bool:
+        """Reply to an "already have it?" offer; True if the exchange is over.
+
+        A miss on a plain offer is followed by the payload on this connection;
+        a ``probe`` (sent ahead of parallel ranges) ends at the reply. Either
+        becomes a delta if the sender allows one and an older copy of the same
+        filename is cached.
+        """
+        md5 = metadata['md5']
+        save_path = self._save_path(metadata, is_destination)
+        if not self.store.materialize(content_key(hop_hash(metadata), md5), save_path, link=not is_destination):
+            basis = self.store.latest(metadata['filename']) if metadata.get('delta') else None
+            if basis:
+                self._receive_delta(client_socket, metadata, is_destination, basis, buffer)
+                return True
+            send_frame(client_socket, {'status': 'SEND'})
+            return bool(metadata.get('probe'))
+
+        logger.info(f"Already holding {md5}; payload skipped")
+        send_frame(client_socket, {'status': 'HAVE'})
+        send_ack(client_socket, True, "File already held")
+        self._complete_transfer(metadata, save_path, is_destination, md5)
+        return True
+    
+    def _receive_delta(
+        self,
+        client_socket: socket.socket,
+        metadata: dict,
+        is_destination: bool,
+        basis: tuple,
+        buffer: memoryview
+    ):
+        """Publish block signatures of the cached ``basis`` and rebuild the
+        new file from the block references and literals the sender returns"""
+        basis_md5, basis_path = basis
+        save_path = self._save_path(metadata, is_destination)
+        # Link the basis so eviction cannot remove it mid-transfer
+        basis_copy = f"{save_path}.{self._transfer_key(metadata)}.basis"
+        detach(basis_copy)
+        try:
+            os.link(basis_path, basis_copy)
+        except OSError:
+            shutil.copyfile(basis_path, basis_copy)
+
+        try:
+            block_size = block_size_for(metadata['file_size'])
+            signatures = block_signatures(basis_copy, block_size)
+            send_frame(client_socket, {
+                'status': 'SIGNATURES',
+                'basis': basis_md5,
+                'block_size': block_size,
+                'length': len(signatures)
+            })
+            client_socket.sendall(signatures)
+
+            result = apply_delta(
+                client_socket, basis_copy, save_path, block_size, buffer,
+                new_hasher(hop_hash(metadata))
+            )
+        finally:
+            os.remove(basis_copy)
+
+        if result is None:
+            logger.error(f"Upstream closed during delta of {metadata['transfer_id']}")
+            return
+        actual_md5, size = result
+        if actual_md5 != metadata['md5'] or size != metadata['file_size']:
+            logger.error(f"MD5 mismatch! Expected {metadata['md5']}, got {actual_md5}")
+            self._discard(save_path)
+            send_ack(client_socket, False, "MD5 verification failed")
+            return
+
+        logger.info(f"Rebuilt {metadata['filename']} from delta against {basis_md5}")
+        send_ack(client_socket, True, "File received successfully")
+        self._complete_transfer(metadata, save_path, is_destination, actual_md5)
+    
+    def _is_destination(self, metadata: dict) -> bool:
+        # A multicast hop's route ends here; the tree says whether to keep a copy
+        if 'fanout' in metadata:
+            return bool(metadata['fanout']['deliver'])
+        return metadata['current_index'] >= len(metadata['route']) - 1
+    
+    def _save_path(self, metadata: dict, is_destination: bool) -> str:
+        transfer_id = metadata['transfer_id']
+        filename = metadata['filename']
+        if not is_destination:
+            # Unique per transfer (and stripe), so concurrent relays of one filename never collide
+            return self.relay_cache.path(self._transfer_key(metadata), filename)
+        return os.path.join(self.receive_dir, f"{transfer_id}-{filename}")
+    
+    def _store_and_forward(
+        self,
+        client_socket: socket.socket,
+        metadata: dict,
+        is_destination: bool,
+        buffer: memoryview
+    ):
+        file_size = metadata['file_size']
+        save_path = self._save_path(metadata, is_destination)
+        manifest = None
+        if self._keeps_manifest(metadata):
+            manifest = ChunkManifest.create(self._manifest_path(metadata, is_destination), file_size)
+        
+        # Hash while writing so the saved file is never re-read
+        hasher = new_hasher(hop_hash(metadata))
+        bytes_received = 0
+        detach(save_path)
+        try:
+            with open(save_path, 'wb') as f:
+                preallocate(f, file_size)
+                tracker = ChunkTracker(manifest, f.flush) if manifest else None
+                for chunk in iter_recv(client_socket, file_size, buffer):
+                    hasher.update(chunk)
                     f.write(chunk)
+                    if tracker:
+                        tracker.update(chunk)
                     bytes_received += len(chunk)
+        finally:
+            if manifest:
+                manifest.close()
 
-            # Verify MD5
-            actual_md5 = calculate_md5(save_path)
-            if actual_md5 != expected_md5:
-                logger.error(f"MD5 mismatch! Expected {expected_md5}, got {actual_md5}")
-                self._send_ack(client_socket, False, "MD5 verification failed")
+        if bytes_received < file_size:
+            logger.error(f"Upstream closed after {bytes_received}/{file_size} bytes")
+            if manifest:
+                logger.info(f"Partial file kept for resume: {metadata['transfer_id']}")
+            return
+
+        # Verify MD5
+        expected_md5 = recv_expected_md5(client_socket, metadata)
+        actual_md5 = hasher.hexdigest()
+        if manifest:
+            manifest.remove()
+        if actual_md5 != expected_md5:
+            logger.error(f"MD5 mismatch! Expected {expected_md5}, got {actual_md5}")
+            self._discard(save_path)
+            send_ack(client_socket, False, "MD5 verification failed")
+            return
+        
+        # Send ACK
+        send_ack(client_socket, True, "File received successfully")
+        self._complete_transfer(metadata, save_path, is_destination, actual_md5)
+    
+    def _receive_datagrams(self, client_socket: socket.socket, metadata: dict, is_destination: bool):
+        """Store a payload sent as a datagram flow (see datagram.py); the
+        metadata, trailer and ACK stay on this connection"""
+        if not self.datagrams.available:
+            send_frame(client_socket, {'status': 'ERROR', 'message': 'Datagram transfers unavailable'})
+            return
+        file_size = metadata['file_size']
+        save_path = self._save_path(metadata, is_destination)
+        previous_hop = metadata['route'][metadata['current_index'] - 1]
+        detach(save_path)
+        with open(save_path, 'wb+') as f:
+            preallocate(f, file_size)
+            flow = self.datagrams.open(metadata['datagram'], f.fileno(), file_size)
+            try:
+                send_frame(client_socket, {'status': 'READY'})
+                complete = flow.wait(link_profile(previous_hop)['timeout'])
+                if complete:
+                    # Held until the trailer arrives, so late packets still get DONE
+                    expected_md5 = recv_expected_md5(client_socket, metadata)
+            finally:
+                self.datagrams.close(flow)
+
+        if not complete:
+            logger.error(f"Datagram flow stalled with {flow.count - flow.remaining}/{flow.count} packets")
+            self._discard(save_path)
+            send_ack(client_socket, False, "Datagram flow stalled")
+            return
+        if flow.recovered:
+            logger.info(f"Rebuilt {flow.recovered} of {flow.count} packets from {flow.scheme} parity")
+
+        actual_md5 = hash_file(save_path, hop_hash(metadata))
+        if actual_md5 != expected_md5:
+            logger.error(f"MD5 mismatch! Expected {expected_md5}, got {actual_md5}")
+            self._discard(save_path)
+            send_ack(client_socket, False, "MD5 verification failed")
+            return
+
+        send_ack(client_socket, True, "File received successfully")
+        self._complete_transfer(metadata, save_path, is_destination, actual_md5)
+    
+    def _keeps_manifest(self, metadata: dict) -> bool:
+        """Whether a receive is worth a resume manifest: a resume only skips
+        whole chunks, so a file of one chunk is simply sent again"""
+        return bool(metadata.get('resume')) or metadata['file_size'] > RESUME_CHUNK_SIZE
+    
+    def _manifest_path(self, metadata: dict, is_destination: bool) -> str:
+        save_dir = self.receive_dir if is_destination else self.relay_dir
+        return ChunkManifest.location(save_dir, self._transfer_key(metadata))
+    
+    def _transfer_key(self, metadata: dict) -> str:
+        """Per-node identity of a transfer; stripes of one file share a transfer_id"""
+        stripe = metadata.get('stripe')
+        if stripe:
+            return f"{metadata['transfer_id']}.stripe{stripe['index']}"
+        return metadata['transfer_id']
+    
+    def _receive_resumable(
+        self,
+        client_socket: socket.socket,
+        metadata: dict,
+        is_destination: bool,
+        buffer: memoryview
+    ):
+        """Resume an interrupted hop: report the chunks already held, then
+        receive only the chunks the sender says are missing."""
+        transfer_id = metadata['transfer_id']
+        file_size = metadata['file_size']
+        chunk_size = metadata['chunk_size']
+        save_path = self._save_path(metadata, is_destination)
+        manifest_path = self._manifest_path(metadata, is_destination)
+
+        manifest = None
+        detach(save_path)
+        if os.path.exists(save_path):
+            manifest = ChunkManifest.load(manifest_path, file_size, chunk_size)
+        if manifest is None:
+            manifest = ChunkManifest.create(manifest_path, file_size, chunk_size)
+            open(save_path, 'wb').close()
+
+        try:
+            send_frame(client_socket, {'status': 'READY', 'have': manifest.chunks})
+            request = recv_frame(client_socket)
+            if request is None:
+                logger.error("Sender closed before requesting chunks")
                 return
-            
-            # Send ACK
-            self._send_ack(client_socket, True, "File received successfully")
-            
-            # Send timeline update
-            status = 'DONE' if is_destination else 'PENDING'
-            self._send_timeline_update(transfer_id, status)
-            
-            # If not destination, relay to next hop
+
+            with open(save_path, 'r+b') as f:
+                preallocate(f, file_size)
+                for index in request['chunks']:
+                    length = manifest.chunk_length(index)
+                    f.seek(index * chunk_size)
+                    crc = 0
+                    bytes_received = 0
+                    for chunk in iter_recv(client_socket, length, buffer):
+                        f.write(chunk)
+                        crc = zlib.crc32(chunk, crc)
+                        bytes_received += len(chunk)
+                    if bytes_received < length:
+                        logger.error(f"Upstream closed in chunk {index}; partial kept for resume: {transfer_id}")
+                        return
+                    f.flush()
+                    manifest.record(index, crc)
+        finally:
+            manifest.close()
+
+        logger.info(f"Resumed {transfer_id}: {len(request['chunks'])}/{manifest.chunk_count()} chunks sent")
+        expected_md5 = metadata['md5']
+        actual_md5 = hash_file(save_path, hop_hash(metadata))
+        manifest.remove()
+        if actual_md5 != expected_md5:
+            logger.error(f"MD5 mismatch! Expected {expected_md5}, got {actual_md5}")
+            self._discard(save_path)
+            send_ack(client_socket, False, "MD5 verification failed")
+            return
+
+        send_ack(client_socket, True, "File received successfully")
+        self._complete_transfer(metadata, save_path, is_destination, actual_md5)
+    
+    def _receive_range(
+        self,
+        client_socket: socket.socket,
+        metadata: dict,
+        is_destination: bool,
+        buffer: memoryview
+    ):
+        """Write one byte range of a parallel transfer at its offset.
+
+        Every range connection ACKs its own bytes; the connection that
+        completes the file verifies the whole-file digest, and its ACK carries
+        the result.
+        """
+        assembly_key = self._transfer_key(metadata)
+        byte_range = metadata['range']
+        save_path = self._save_path(metadata, is_destination)
+        assembly = self.assemblies.open(
+            assembly_key, save_path, metadata['file_size'], byte_range['count']
+        )
+
+        offset = byte_range['offset']
+        length = byte_range['length']
+        bytes_received = 0
+        try:
+            for chunk in iter_recv(client_socket, length, buffer):
+                assembly.write(offset + bytes_received, chunk)
+                bytes_received += len(chunk)
+        except Exception:
+            self.assemblies.pop(assembly_key)
+            assembly.close()
+            raise
+
+        if bytes_received < length:
+            logger.error(f"Range {byte_range['index']} closed after {bytes_received}/{length} bytes")
+            self.assemblies.pop(assembly_key)
+            assembly.close()
+            return
+
+        if not assembly.complete_range(byte_range['index']):
+            send_ack(client_socket, True, f"Range {byte_range['index']} received")
+            return
+
+        self.assemblies.pop(assembly_key)
+        assembly.close()
+
+        expected_md5 = metadata['md5']
+        actual_md5 = hash_file(save_path, hop_hash(metadata))
+        if actual_md5 != expected_md5:
+            logger.error(f"MD5 mismatch! Expected {expected_md5}, got {actual_md5}")
+            self._discard(save_path)
+            send_ack(client_socket, False, "MD5 verification failed")
+            return
+
+        send_ack(client_socket, True, "File received successfully")
+        self._complete_transfer(metadata, save_path, is_destination, actual_md5)
+    
+    def _complete_transfer(
+        self,
+        metadata: dict,
+        save_path: str,
+        is_destination: bool,
+        actual_md5: str
+    ):
+        """Report the verified file and, on relays, forward it to the next hop"""
+        transfer_id = metadata['transfer_id']
+        filename = metadata['filename']
+
+        if 'fanout' in metadata:
+            self._forward_branches(metadata, save_path, is_destination, actual_md5)
             if not is_destination:
-                next_success = self.sender._send_to_next_hop(
-                    file_path=save_path,
-                    filename=filename,
-                    transfer_id=transfer_id,
-                    route=route,
-                    current_index=current_index
-                )
-                
-                if next_success:
-                    logger.info(f"Relay successful")
-                    os.remove(save_path)
-                else:
-                    logger.error(f"Relay failed")
-            else:
-                logger.info(f"Final destination reached. File saved to {save_path}")
+                return
+            # The timeline tracks each destination of a multicast separately
+            transfer_id = metadata['fanout']['deliver']
+        if is_destination and 'stripe' in metadata:
+            self._complete_stripe(metadata, save_path)
+            return
+        if is_destination and 'encoding' in metadata:
+            if not self._decode_payload(save_path, metadata['encoding']):
+                return
+        if is_destination and 'archive' in metadata:
+            if not self._unpack_archive(save_path, metadata['archive']):
+                return
+
+        # Send timeline update
+        status = 'DONE' if is_destination else 'PENDING'
+        self._send_timeline_update(transfer_id, status)
         
+        # If not destination, relay to next hop
+        if not is_destination:
+            self._forward_relay(metadata, save_path, actual_md5)
+        else:
+            if 'encoding' not in metadata:
+                self.store.add(save_path, content_key(hop_hash(metadata), actual_md5), name=filename)
+            if 'archive' in metadata:
+                os.remove(save_path)
+                save_path = self._archive_dir(save_path)
+            logger.info(f"Final destination reached. File saved to {save_path}")
+    
+    def _forward_relay(self, metadata: dict, save_path: str, actual_md5: str):
+        """Forward a verified relay file to the next hop, keeping it for retry if that fails"""
+        filename = metadata['filename']
+        extra = {k: metadata[k] for k in END_TO_END_FIELDS if k in metadata}
+        # With custody a failed forward is retried from the queue, not in line
+        forward = self.sender._send_to_next_hop if self.custody else self.sender._send_with_retries
+        next_success = forward(
+            file_path=save_path,
+            filename=filename,
+            transfer_id=metadata['transfer_id'],
+            route=metadata['route'],
+            current_index=metadata['current_index'],
+            file_md5=actual_md5,
+            extra=extra
+        )
+        
+        if next_success:
+            logger.info("Relay successful")
+            self.store.add(save_path, content_key(hop_hash(metadata), actual_md5), move=True, name=filename)
+        else:
+            self._keep_failed_relay(metadata, save_path, actual_md5, extra)
+    
+    def _keep_failed_relay(self, metadata: dict, save_path: str, md5: str, extra: dict):
+        """Keep a relay file whose forward failed: in custody for retry when
+        there is a queue, otherwise in the relay cache until evicted or
+        expired. The caller still holds the file's admission."""
+        if self.custody and self.custody.take(self._transfer_key(metadata), save_path, metadata, md5, extra):
+            logger.error(f"Relay failed; {metadata['filename']} held in custody for retry")
+        else:
+            logger.error(f"Relay failed; {save_path} kept until evicted or expired")
+    
+    def _forward_branches(self, metadata: dict, save_path: str, is_destination: bool, actual_md5: str):
+        """Forward a multicast transfer to this node's children in its tree
+        (see fanout.py), reporting PENDING for every destination below them.
+        Failed branches are retried in line, not taken into custody, and
+        their destinations are reported FAILED."""
+        children = metadata['fanout']['children']
+        for child in children.values():
+            for transfer_id in deliveries(child):
+                self._send_timeline_update(transfer_id, 'PENDING')
+        failed = []
+        if children:
+            extra = {k: metadata[k] for k in END_TO_END_FIELDS if k in metadata}
+            failed = self.sender._fan_out(
+                save_path, metadata['filename'], metadata['transfer_id'], metadata['route'], actual_md5, extra, children
+            )
+            if failed:
+                unreached = [transfer_id for hop in failed for transfer_id in deliveries(children[hop])]
+                logger.error(f"Multicast branches to {', '.join(failed)} failed; {len(unreached)} destinations not reached")
+                for transfer_id in unreached:
+                    self._send_timeline_update(transfer_id, 'FAILED')
+            else:
+                logger.info(f"Multicast forwarded to {', '.join(children)}")
+        if is_destination:
+            return
+        if failed:
+            logger.error(f"Relay failed; {save_path} kept until evicted or expired")
+        else:
+            self.store.add(save_path, content_key(hop_hash(metadata), actual_md5), move=True, name=metadata['filename'])
+    
+    def _custody_delivered(self, entry: dict):
+        """A file held in custody reached the next hop; keep it as content"""
+        self.store.add(
+            entry['path'], content_key(hop_hash(entry['extra']), entry['md5']), move=True, name=entry['filename']
+        )
+    
+    def _custody_given_up(self, entry: dict):
+        """Custody of a file ran out; the transfer will not get past this relay"""
+        self._send_timeline_update(entry['transfer_id'], 'FAILED')
+    
+    def _complete_stripe(self, metadata: dict, save_path: str):
+        """Reassemble a multipath transfer once its last stripe has been verified"""
+        transfer_id = metadata['transfer_id']
+        stripe = metadata['stripe']
+        logger.info(f"Stripe {stripe['index'] + 1}/{stripe['count']} of {transfer_id} received")
+        if not self.stripes.complete(transfer_id, stripe['index'], stripe['count']):
+            return
+
+        target_path = os.path.join(self.receive_dir, f"{transfer_id}-{stripe['filename']}")
+        stripe_paths = [
+            os.path.join(self.receive_dir, f"{transfer_id}-{stripe_filename(stripe['filename'], i)}")
+            for i in range(stripe['count'])
+        ]
+        actual_md5 = merge_stripes(
+            stripe_paths, target_path, stripe['file_size'], new_hasher(hop_hash(metadata))
+        )
+        if actual_md5 != stripe['md5']:
+            logger.error(f"Reassembled MD5 mismatch! Expected {stripe['md5']}, got {actual_md5}")
+            remove_stripes(stripe_paths + [target_path])
+            return
+
+        remove_stripes(stripe_paths)
+        if 'encoding' in metadata and not self._decode_payload(target_path, metadata['encoding']):
+            return
+        self._send_timeline_update(transfer_id, 'DONE')
+        logger.info(f"Final destination reached. File saved to {target_path}")
+    
+    @staticmethod
+    def _archive_dir(save_path: str) -> str:
+        if save_path.endswith(ARCHIVE_SUFFIX):
+            return save_path[:-len(ARCHIVE_SUFFIX)]
+        return save_path + '.d'
+    
+    def _unpack_archive(self, save_path: str, archive: dict) -> bool:
+        """Extract a verified batch archive next to where it was saved"""
+        target_dir = self._archive_dir(save_path)
+        try:
+            count = unpack_archive(save_path, target_dir)
         except Exception as e:
-            logger.error(f"Error handling client: {e}")
-            import traceback
-            traceback.print_exc()
-        finally:
-            client_socket.close()
+            logger.error(f"Failed to unpack {archive.get('format')} archive {save_path}: {e}")
+            return False
+        if count != archive.get('files', count):
+            logger.error(f"Archive held {count} files, expected {archive['files']}")
+            return False
+        logger.info(f"Unpacked {count} files into {target_dir}")
+        return True
     
-    def _recv_exact(self, sock: socket.socket, n: int) -> bytes:
-        data = b''
-        while len(data) < n:
-            chunk = sock.recv(n - len(data))
-            if not chunk:
-                return None
-            data += chunk
-        return data
-    
-    def _send_ack(self, sock: socket.socket, success: bool, message: str):
-        ack = {
-            'status': 'OK' if success else 'ERROR',
-            'message': message,
-            'timestamp': get_timestamp()
-        }
-        ack_json = json.dumps(ack).encode('utf-8')
-        sock.sendall(ack_json)
+    def _decode_payload(self, save_path: str, encoding: dict) -> bool:
+        """Replace a verified compressed payload with the original file"""
+        decoded_path = save_path + '.decoding'
+        try:
+            actual_md5, size, cpu_seconds = decode_file(save_path, decoded_path)
+        except Exception as e:
+            logger.error(f"Failed to decode {encoding['codec']} payload: {e}")
+            if os.path.exists(decoded_path):
+                os.remove(decoded_path)
+            return False
+
+        if actual_md5 != encoding['md5']:
+            logger.error(f"Decoded MD5 mismatch! Expected {encoding['md5']}, got {actual_md5}")
+            os.remove(decoded_path)
+            return False
+
+        encoded_size = os.path.getsize(save_path)
+        os.replace(decoded_path, save_path)
+        ratio = size / encoded_size if encoded_size else 1.0
+        logger.info(f"Decompressed {encoding['codec']}: {encoded_size} → {size} bytes "
+                    f"(ratio {ratio:.2f}x, {cpu_seconds:.3f}s CPU)")
+        return True
+    
+    def _relay_cut_through(self, client_socket: socket.socket, metadata: dict, buffer: memoryview):
+        """Forward each chunk to the next hop as soon as it arrives.
+
+        The upstream ACK is only sent once the downstream hop has ACKed, so a
+        failure further along the route is reported back to the sender.
+        Backpressure comes from blocking ``sendall``: a slow downstream stops
+        us reading, and TCP flow control then throttles the upstream hop.
+        """
+        transfer_id = metadata['transfer_id']
+        route = metadata['route']
+        current_index = metadata['current_index']
+        file_size = metadata['file_size']
+        next_hop = route[current_index + 1]
+
+        link = get_scheduler().link(next_hop)
+        ticket = link.acquire(metadata)
+        try:
+            downstream = self.sender._connect(next_hop, priority=priority_of(metadata))
+        except Exception as e:
+            link.release(ticket)
+            logger.error(f"Cut-through connect to {next_hop} failed: {e}")
+            send_ack(client_socket, False, f"Downstream {next_hop} unreachable: {e}")
+            return
+
+        # With a tee the relay keeps draining upstream after a downstream
+        # failure; once the copy in relay-cache is verified the relay ACKs it
+        # and forwards it like a stored file, with retries or custody.
+        tee_path = self._save_path(metadata, False) if RELAY_TEE else None
+        if tee_path:
+            detach(tee_path)
+        tee = open(tee_path, 'wb') if tee_path else None
+        if tee:
+            preallocate(tee, file_size)
+        downstream_error = None
+        hasher = new_hasher(hop_hash(metadata))
+        bytes_received = 0
+
+        try:
+            try:
+                forwarded = dict(metadata, current_index=current_index + 1)
+                forwarded.pop('offer', None)
+                send_metadata(downstream, forwarded)
+            except Exception as e:
+                downstream_error = str(e)
+
+            for chunk in iter_recv(client_socket, file_size, buffer):
+                hasher.update(chunk)
+                if tee:
+                    tee.write(chunk)
+                if not downstream_error:
+                    try:
+                        downstream.sendall(chunk)
+                    except Exception as e:
+                        downstream_error = str(e)
+                        logger.error(f"Cut-through send to {next_hop} failed: {e}")
+                bytes_received += len(chunk)
+                if downstream_error and tee is None:
+                    break
+
+            if tee:
+                tee.close()
+
+            if downstream_error and not tee:
+                send_ack(client_socket, False, f"Downstream {next_hop} failed: {downstream_error}")
+                return
+
+            if bytes_received < file_size:
+                logger.error(f"Upstream closed after {bytes_received}/{file_size} bytes")
+                if tee_path:
+                    self._discard(tee_path)
+                return
+
+            expected_md5 = recv_expected_md5(client_socket, metadata)
+            actual_md5 = hasher.hexdigest()
+            if actual_md5 != expected_md5:
+                logger.error(f"MD5 mismatch! Expected {expected_md5}, got {actual_md5}")
+                if tee_path:
+                    self._discard(tee_path)
+                send_ack(client_socket, False, "MD5 verification failed")
+                return
+
+            self._send_timeline_update(transfer_id, 'PENDING')
+
+            if not downstream_error:
+                # The metadata was forwarded unchanged, so downstream expects
+                # the same trailer; pass on the digest we just verified.
+                try:
+                    if metadata.get('integrity') == 'trailer':
+                        send_trailer(downstream, actual_md5)
+                    ack = recv_ack(downstream)
+                except Exception as e:
+                    ack = {'status': 'ERROR', 'message': f"Downstream {next_hop} failed: {e}"}
+
+                if ack.get('status') == 'OK':
+                    logger.info("Relay successful")
+                    send_ack(client_socket, True, "File relayed successfully")
+                    if tee_path:
+                        os.remove(tee_path)
+                    return
+                downstream_error = ack.get('message', 'Downstream NACK')
+                logger.error(f"Relay failed: {downstream_error}")
+                if not tee:
+                    send_ack(client_socket, False, downstream_error)
+                    return
+
+            logger.info(f"Cut-through to {next_hop} failed; forwarding the verified copy {tee_path}")
+            send_ack(client_socket, True, "File received successfully")
+            downstream.close()
+            link.release(ticket)
+            ticket = None
+            self._forward_relay(metadata, tee_path, actual_md5)
+        finally:
+            if tee and not tee.closed:
+                tee.close()
+            downstream.close()
+            if ticket is not None:
+                link.release(ticket)
     
     def _send_timeline_update(self, transfer_id: str, status: str):
         try:
@@ -0,0 +1,126 @@
+"""Wire helpers shared by the hop sender and the node agent"""
+import io
+import os
+import stat
+import socket
+import struct
+import json
+from typing import BinaryIO, Iterator, Optional
+from .utils import get_timestamp, CHUNK_SIZE, ZERO_COPY
+
+def recv_exact(sock: socket.socket, n: int) -> Optional[bytearray]:
+    data = bytearray(n)
+    view = memoryview(data)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:], n - received)
+        if not count:
+            return None
+        received += count
+    return data
+
+def iter_recv(sock: socket.socket, size: int, buffer: memoryview) -> Iterator[memoryview]:
+    """Yield views of ``buffer`` holding the next bytes of a ``size``-byte payload.
+
+    The buffer is reused for every chunk, so each view is only valid until the
+    next iteration. Stops early if the peer closes the connection.
+    """
+    received = 0
+    while received < size:
+        count = sock.recv_into(buffer, min(len(buffer), size - received))
+        if not count:
+            return
+        received += count
+        # Full reads hand out the buffer itself; only short reads need a slice
+        yield buffer if count == len(buffer) else buffer[:count]
+
+def send_frame(sock: socket.socket, payload: dict):
+    """Send a length-prefixed JSON frame (metadata header or digest trailer)"""
+    payload_json = json.dumps(payload).encode('utf-8')
+    sock.sendall(struct.pack('!I', len(payload_json)) + payload_json)
+
+def recv_frame(sock: socket.socket, length_bytes: Optional[bytes] = None) -> Optional[dict]:
+    """Read one frame; ``length_bytes`` is its length prefix if already consumed"""
+    if length_bytes is None:
+        length_bytes = recv_exact(sock, 4)
+    if not length_bytes:
+        return None
+
+    length = struct.unpack('!I', length_bytes)[0]
+    payload_bytes = recv_exact(sock, length)
+    if not payload_bytes:
+        return None
+
+    return json.loads(payload_bytes.decode('utf-8'))
+
+def send_metadata(sock: socket.socket, metadata: dict):
+    send_frame(sock, metadata)
+
+def recv_metadata(sock: socket.socket, length_bytes: Optional[bytes] = None) -> Optional[dict]:
+    return recv_frame(sock, length_bytes)
+
+def send_trailer(sock: socket.socket, md5: str):
+    send_frame(sock, {'md5': md5})
+
+def recv_expected_md5(sock: socket.socket, metadata: dict) -> Optional[str]:
+    """Return the digest the payload must match.
+
+    Legacy senders put ``md5`` in the metadata header; with
+    ``integrity == 'trailer'`` it follows the payload as its own frame.
+    """
+    if metadata.get('integrity') != 'trailer':
+        return metadata.get('md5')
+    trailer = recv_frame(sock)
+    return trailer.get('md5') if trailer else None
+
+def is_regular_file(source) -> bool:
+    try:
+        return stat.S_ISREG(os.fstat(source.fileno()).st_mode)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return False
+
+def send_stream(
+    sock: socket.socket,
+    source: BinaryIO,
+    size: int,
+    md5_hash=None,
+    zero_copy: bool = ZERO_COPY,
+    chunk_size: int = CHUNK_SIZE
+) -> int:
+    """Send ``size`` bytes from ``source`` starting at its current position.
+
+    Regular files go through ``socket.sendfile`` (``os.sendfile`` where the
+    platform has it) so the payload never enters Python. Anything that has
+    to see the bytes (``md5_hash``) or is not backed by a file falls back to
+    a read/sendall loop of ``chunk_size`` reads.
+    """
+    if zero_copy and md5_hash is None and is_regular_file(source):
+        return sock.sendfile(source, offset=source.tell(), count=size)
+
+    bytes_sent = 0
+    while bytes_sent < size:
+        chunk = source.read(min(chunk_size, size - bytes_sent))
+        if not chunk:
+            break
+        if md5_hash:
+            md5_hash.update(chunk)
+        sock.sendall(chunk)
+        bytes_sent += len(chunk)
+    return bytes_sent
+
+def encode_ack(success: bool, message: str) -> bytes:
+    ack = {
+        'status': 'OK' if success else 'ERROR',
+        'message': message,
+        'timestamp': get_timestamp()
+    }
+    return json.dumps(ack).encode('utf-8')
+
+def send_ack(sock: socket.socket, success: bool, message: str):
+    sock.sendall(encode_ack(success, message))
+
+def recv_ack(sock: socket.socket) -> dict:
+    ack_data = sock.recv(1024)
+    if not ack_data:
+        return {'status': 'ERROR', 'message': 'Connection closed before ACK'}
+    return json.loads(ack_data.decode('utf-8'))
@@ -0,0 +1,249 @@
+"""Space accounting for the files a relay holds between receiving and forwarding"""
+import os
+import json
+import time
+import shutil
+import threading
+from typing import Dict, Optional
+from .utils import (
+    get_logger, ensure_directory, RELAY_CACHE_BYTES, RELAY_CACHE_MAX_AGE, MIN_FREE_BYTES, RELAY_CACHE_STATS_INTERVAL
+)
+from .manifest import ChunkManifest
+
+logger = get_logger('agent.relay_cache')
+
+INDEX_FILE = '.relay-index.json'
+
+def free_space(directory: str) -> Optional[int]:
+    try:
+        stat = os.statvfs(directory)
+    except (OSError, AttributeError):
+        return None
+    return stat.f_bavail * stat.f_frsize
+
+def check_free_space(directory: str, size: int, min_free: int = MIN_FREE_BYTES) -> Optional[str]:
+    """Why ``size`` more bytes should not be written to ``directory``, or None"""
+    free = free_space(directory)
+    if free is not None and free - size < min_free:
+        return f"Insufficient disk space: {size} bytes requested, {free} free, {min_free} reserved"
+    return None
+
+def _remove(path: str) -> int:
+    """Delete a file or directory; returns the bytes it held"""
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+            shutil.rmtree(path, ignore_errors=True)
+            return size
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except OSError:
+        return 0
+
+class RelayCache:
+    """Relay files, one per transfer, within a byte budget.
+
+    Every transfer a relay stores gets its own path (``<transfer key>-<filename>``)
+    and is admitted only if its ``file_size`` fits both the budget and the free
+    disk space. Room is made by evicting idle files, least recently used
+    first: ones whose forward failed, or partial ones kept for a resume. Idle
+    files older than ``max_age`` are expired. Files in use are never evicted.
+
+    ``.relay-index.json`` lists the files so that, at startup, anything else in
+    the directory (left by a crash or an older layout) is swept away.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        budget: int = RELAY_CACHE_BYTES,
+        max_age: float = RELAY_CACHE_MAX_AGE,
+        min_free: int = MIN_FREE_BYTES
+    ):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self.budget = budget
+        self.max_age = max_age
+        self.min_free = min_free
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._active: Dict[str, int] = {}
+        self._counters = {'admitted': 0, 'rejected': 0, 'evicted': 0, 'expired': 0}
+        self._reporter = None
+        ensure_directory(root)
+        self._load_index()
+
+    def path(self, key: str, filename: str) -> str:
+        return os.path.join(self.root, f"{key}-{filename}")
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Relay index unreadable, starting empty: {e}")
+            self._entries = {}
+
+    def _save_index(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self.index_path)
+
+    def sweep(self):
+        """Remove whatever a previous run left that the index does not account
+        for: partial writes, delta bases, files from before per-transfer paths"""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if not os.path.exists(entry['path']):
+                    self._drop(key)
+            known = {os.path.basename(entry['path']) for entry in self._entries.values()}
+            count = freed = 0
+            for name in os.listdir(self.root):
+                if name.startswith('.') or name in known:
+                    continue
+                freed += _remove(os.path.join(self.root, name))
+                count += 1
+            manifests = os.path.dirname(ChunkManifest.location(self.root, 'x'))
+            if os.path.isdir(manifests):
+                for name in os.listdir(manifests):
+                    if name[:-len('.jsonl')] not in self._entries:
+                        _remove(os.path.join(manifests, name))
+            self._save_index()
+        if count:
+            logger.info(f"Swept {count} orphaned relay files ({freed} bytes)")
+
+    def admit(self, key: str, path: str, size: int) -> Optional[str]:
+        """Reserve ``size`` bytes for the transfer ``key``; returns why it was
+        refused, or None. Every admission is matched by ``release``."""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            # A resume, retry or another range of a file already held
+            needed = 0 if entry else size
+            if self.budget > 0 and size > self.budget:
+                return self._reject(f"Relay cache budget is {self.budget} bytes; transfer needs {size}")
+            while True:
+                over_budget = self.budget > 0 and self._used() + needed > self.budget
+                no_space = check_free_space(self.root, needed, self.min_free)
+                if not over_budget and not no_space:
+                    break
+                if not self._evict_one():
+                    return self._reject(no_space or f"Relay cache full: {self._used()} of {self.budget} bytes held")
+            now = time.time()
+            if entry is None:
+                entry = self._entries[key] = {'path': path, 'size': size, 'created': now}
+            entry['last_used'] = now
+            self._active[key] = self._active.get(key, 0) + 1
+            self._counters['admitted'] += 1
+            self._save_index()
+            return None
+
+    def release(self, key: str):
+        """The transfer's handler is done; its file stays accounted for (and
+        becomes evictable) only if it is still there"""
+        with self._lock:
+            active = self._active.get(key, 0) - 1
+            if active > 0:
+                self._active[key] = active
+                return
+            self._active.pop(key, None)
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if os.path.exists(entry['path']):
+                entry['last_used'] = time.time()
+            else:
+                self._drop(key)
+            self._save_index()
+
+    def hold(self, key: str) -> bool:
+        """Pin the file already held for ``key`` against eviction and expiry,
+        as an admission does; False if there is none. Matched by ``release``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry['path']):
+                return False
+            entry['last_used'] = time.time()
+            self._active[key] = self._active.get(key, 0) + 1
+            return True
+
+    def _reject(self, reason: str) -> str:
+        self._counters['rejected'] += 1
+        logger.warning(reason)
+        return reason
+
+    def _used(self) -> int:
+        return sum(entry['size'] for entry in self._entries.values())
+
+    def _idle(self) -> list:
+        return sorted(
+            (key for key in self._entries if key not in self._active),
+            key=lambda k: self._entries[k]['last_used']
+        )
+
+    def _evict_one(self) -> bool:
+        idle = self._idle()
+        if not idle:
+            return False
+        entry = self._entries[idle[0]]
+        logger.info(f"Evicted {os.path.basename(entry['path'])} ({entry['size']} bytes) from relay cache")
+        self._drop(idle[0])
+        self._counters['evicted'] += 1
+        return True
+
+    def _expire(self):
+        if self.max_age <= 0:
+            return
+        cutoff = time.time() - self.max_age
+        expired = [key for key in self._idle() if self._entries[key]['last_used'] < cutoff]
+        for key in expired:
+            logger.info(f"Expired {os.path.basename(self._entries[key]['path'])} from relay cache")
+            self._drop(key)
+        self._counters['expired'] += len(expired)
+        if expired:
+            self._save_index()
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        _remove(entry['path'])
+        _remove(ChunkManifest.location(self.root, key))
+
+    def stats(self) -> dict:
+        """Occupancy (files, bytes, budget and free disk) and counters since startup"""
+        with self._lock:
+            idle = self._idle()
+            return {
+                'files': len(self._entries),
+                'active': len(self._active),
+                'bytes': self._used(),
+                'idle_bytes': sum(self._entries[key]['size'] for key in idle),
+                'budget': self.budget,
+                'free_disk': free_space(self.root),
+                'oldest_idle_s': round(time.time() - self._entries[idle[0]]['last_used']) if idle else None,
+                **self._counters
+            }
+
+    def start_reporter(self):
+        if self._reporter is None and RELAY_CACHE_STATS_INTERVAL > 0:
+            self._reporter = threading.Thread(target=self._report, name='relay-cache-stats', daemon=True)
+            self._reporter.start()
+
+    def _report(self):
+        last = None
+        while True:
+            time.sleep(RELAY_CACHE_STATS_INTERVAL)
+            with self._lock:
+                self._expire()
+            stats = self.stats()
+            summary = {k: v for k, v in stats.items() if k not in ('free_disk', 'oldest_idle_s')}
+            if summary == last:
+                continue
+            last = summary
+            logger.info(f"Relay cache: {stats['files']} files ({stats['active']} active), "
+                        f"{stats['bytes']}/{stats['budget'] or 'unlimited'} bytes, {stats['idle_bytes']} idle; "
+                        f"admitted={stats['admitted']} rejected={stats['rejected']} "
+                        f"evicted={stats['evicted']} expired={stats['expired']}")
@@ -0,0 +1,58 @@
+"""Recently computed routes, so repeated sends skip the heuristic service"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from .utils import ROUTE_CACHE_TTL, ROUTE_CACHE_SIZE
+
+class RouteCache:
+    """LRU cache of route results keyed by (src, dst, algo), each valid for ``ttl`` seconds"""
+
+    def __init__(self, ttl: float = ROUTE_CACHE_TTL, max_entries: int = ROUTE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple[str, str, str], Tuple[float, dict]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, src: str, dst: str, algorithm: str) -> Optional[dict]:
+        key = (src, dst, algorithm)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1], path=list(entry[1]['path']))
+
+    def put(self, src: str, dst: str, algorithm: str, result: dict):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        key = (src, dst, algorithm)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, src: str, dst: str, algorithm: Optional[str] = None):
+        """Drop the cached route(s) from src to dst, for one or every algorithm"""
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == src and key[1] == dst and algorithm in (None, key[2]):
+                    del self._entries[key]
+
+    def invalidate_node(self, node: str):
+        """Drop every cached route that passes through ``node``"""
+        with self._lock:
+            for key, (_, result) in list(self._entries.items()):
+                if node in result['path'][1:]:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,301 @@
+"""Per-next-hop transfer scheduling: priority classes, deadlines and pacing.
+
+A transfer's metadata may carry a ``priority`` class (``control``, ``high``,
+``normal`` or ``bulk``) and a ``deadline`` (UNIX seconds); both travel end to
+end, so every relay orders the transfer the same way. Each next hop admits
+at most SCHEDULER_SLOTS hops at a time; waiting hops are admitted by class,
+then earliest deadline, then arrival.
+
+Bytes sent to a neighbor draw from a token bucket refilled at that link's
+``bandwidth_mbps`` as last measured by the metric agent (times
+PACING_FACTOR), so the queue builds here, where it can be ordered, instead
+of on the link. When several classes wait for tokens the highest goes
+first, so a command file is not stuck behind the chunks of a bulk transfer.
+Without a fresh measurement sends are not paced.
+"""
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+from .utils import (
+    get_logger, SCHEDULER_SLOTS, SCHEDULER_PACING, PACING_FACTOR, PACING_BURST, SCHEDULER_STATS_INTERVAL
+)
+from .links import live_link
+
+logger = get_logger('agent.scheduler')
+
+PRIORITIES = ('control', 'high', 'normal', 'bulk')
+DEFAULT_PRIORITY = 'normal'
+
+# Largest send issued between two token checks
+PACING_CHUNK = 64 * 1024
+# How long a measured rate is reused before the metric file is checked again
+RATE_REFRESH = 1.0
+
+def priority_of(metadata: Optional[dict]) -> str:
+    priority = (metadata or {}).get('priority') or DEFAULT_PRIORITY
+    return priority if priority in PRIORITIES else DEFAULT_PRIORITY
+
+def deadline_of(metadata: Optional[dict]) -> Optional[float]:
+    try:
+        return float((metadata or {})['deadline'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _rank(priority: str) -> int:
+    return PRIORITIES.index(priority) if priority in PRIORITIES else PRIORITIES.index(DEFAULT_PRIORITY)
+
+class ClassStats:
+    """Queue depth and waiting time of one priority class on one link"""
+
+    def __init__(self):
+        self.queued = 0
+        self.active = 0
+        self.admitted = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.pacing_wait = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'queued': self.queued,
+            'active': self.active,
+            'admitted': self.admitted,
+            'wait_avg_ms': round(self.wait_total / self.admitted * 1000, 1) if self.admitted else 0.0,
+            'wait_max_ms': round(self.wait_max * 1000, 1),
+            'pacing_wait_s': round(self.pacing_wait, 3)
+        }
+
+class TokenBucket:
+    """Byte pacing at a variable rate; waiting senders are served by rank"""
+
+    def __init__(self):
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def consume(self, nbytes: int, rank: int, rate: float) -> float:
+        """Block until ``nbytes`` may be sent at ``rate`` bytes/s; returns the wait"""
+        start = time.monotonic()
+        burst = max(rate * PACING_BURST, PACING_CHUNK)
+        ticket = (rank, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+                    self.updated = now
+                    if self._waiters[0] == ticket:
+                        if self.tokens > 0:
+                            # Sends larger than the balance go into debt, which
+                            # the next sender waits out
+                            self.tokens -= nbytes
+                            break
+                        self._cond.wait(max(-self.tokens / rate, 0.001))
+                    else:
+                        self._cond.wait()
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+        return time.monotonic() - start
+
+class LinkScheduler:
+    """Admission and pacing for every hop sent to one neighbor"""
+
+    def __init__(self, neighbor: str, slots: int = SCHEDULER_SLOTS):
+        self.neighbor = neighbor
+        self.slots = max(1, slots)
+        self.bucket = TokenBucket()
+        self.classes = {priority: ClassStats() for priority in PRIORITIES}
+        self._active = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._rate = None
+        self._rate_checked = 0.0
+
+    def acquire(self, metadata: Optional[dict]) -> tuple:
+        """Wait for a slot; returns the ticket to ``release``"""
+        priority = priority_of(metadata)
+        deadline = deadline_of(metadata)
+        ticket = (_rank(priority), deadline if deadline is not None else float('inf'), next(self._seq))
+        stats = self.classes[priority]
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            stats.queued += 1
+            try:
+                while self._waiting[0] != ticket or self._active >= self.slots:
+                    self._cond.wait()
+            finally:
+                stats.queued -= 1
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+            self._active += 1
+            stats.active += 1
+            waited = time.monotonic() - start
+            stats.admitted += 1
+            stats.wait_total += waited
+            stats.wait_max = max(stats.wait_max, waited)
+
+        if waited >= 0.1:
+            logger.info(f"{priority} hop to {self.neighbor} waited {waited:.2f}s for a slot")
+        if deadline is not None and time.time() > deadline:
+            logger.warning(f"{priority} hop to {self.neighbor} admitted past its deadline")
+        return ticket
+
+    def release(self, ticket: tuple):
+        with self._cond:
+            self._active -= 1
+            self.classes[PRIORITIES[ticket[0]]].active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, metadata: Optional[dict]):
+        ticket = self.acquire(metadata)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def rate(self) -> Optional[float]:
+        """Pacing rate in bytes/s, or None to send unpaced"""
+        now = time.monotonic()
+        if now - self._rate_checked >= RATE_REFRESH:
+            link = live_link(self.neighbor)
+            mbps = (link or {}).get('bandwidth_mbps') or 0
+            # An unavailable link reports 0; the hop's own timeouts deal with it
+            self._rate = mbps * 1_000_000 / 8 * PACING_FACTOR if mbps > 0 else None
+            self._rate_checked = now
+        return self._rate
+
+    def pace(self, nbytes: int, priority: str):
+        rate = self.rate()
+        if rate:
+            waited = self.bucket.consume(nbytes, _rank(priority), rate)
+            self.classes[priority].pacing_wait += waited
+
+    def stats(self) -> dict:
+        rate = self.rate()
+        with self._cond:
+            return {
+                'rate_mbps': round(rate * 8 / 1_000_000, 2) if rate else None,
+                'active': self._active,
+                'classes': {priority: stats.as_dict() for priority, stats in self.classes.items()}
+            }
+
+class PacedSocket:
+    """A connection (socket or session stream) whose sends are paced by a
+    LinkScheduler; everything else is passed through"""
+
+    def __init__(self, sock, link: LinkScheduler, priority: str):
+        self.sock = sock
+        self.link = link
+        self.priority = priority
+
+    def sendall(self, data):
+        view = memoryview(data).cast('B')
+        if not self.link.rate():
+            return self.sock.sendall(view)
+        for start in range(0, len(view), PACING_CHUNK):
+            piece = view[start:start + PACING_CHUNK]
+            self.link.pace(len(piece), self.priority)
+            self.sock.sendall(piece)
+
+    def send(self, data) -> int:
+        view = memoryview(data).cast('B')[:PACING_CHUNK]
+        self.link.pace(len(view), self.priority)
+        return self.sock.send(view)
+
+    def sendfile(self, file, offset: int = 0, count: Optional[int] = None) -> int:
+        if not self.link.rate():
+            return self.sock.sendfile(file, offset=offset, count=count)
+        sent = 0
+        while count is None or sent < count:
+            size = PACING_CHUNK if count is None else min(PACING_CHUNK, count - sent)
+            self.link.pace(size, self.priority)
+            n = self.sock.sendfile(file, offset=offset + sent, count=size)
+            if not n:
+                break
+            sent += n
+        return sent
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+def unwrap(sock):
+    """The connection under any pacing wrapper"""
+    return sock.sock if isinstance(sock, PacedSocket) else sock
+
+class Scheduler:
+    """One LinkScheduler per next hop, created on first use"""
+
+    def __init__(self, slots: int = SCHEDULER_SLOTS, pacing: bool = SCHEDULER_PACING):
+        self.slots = slots
+        self.pacing = pacing
+        self._links: Dict[str, LinkScheduler] = {}
+        self._lock = threading.Lock()
+        self._reporter = None
+
+    def link(self, neighbor: str) -> LinkScheduler:
+        with self._lock:
+            link = self._links.get(neighbor)
+            if link is None:
+                link = self._links[neighbor] = LinkScheduler(neighbor, self.slots)
+                self._start_reporter()
+            return link
+
+    def admit(self, neighbor: str, metadata: Optional[dict]):
+        return self.link(neighbor).admit(metadata)
+
+    def paced(self, sock, neighbor: str, priority: str = DEFAULT_PRIORITY):
+        """``sock`` wrapped so its sends to ``neighbor`` are paced"""
+        if not self.pacing:
+            return sock
+        return PacedSocket(sock, self.link(neighbor), priority)
+
+    def stats(self) -> Dict[str, dict]:
+        """Per neighbor: pacing rate, hops in flight, and per class the queue
+        depth, hops admitted, slot wait (average and max) and pacing wait"""
+        with self._lock:
+            links = dict(self._links)
+        return {neighbor: link.stats() for neighbor, link in links.items()}
+
+    def _start_reporter(self):
+        if self._reporter is None and SCHEDULER_STATS_INTERVAL > 0:
+            self._reporter = threading.Thread(target=self._report, name='scheduler-stats', daemon=True)
+            self._reporter.start()
+
+    def _report(self):
+        last = None
+        while True:
+            time.sleep(SCHEDULER_STATS_INTERVAL)
+            stats = self.stats()
+            if stats == last:
+                continue
+            last = stats
+            for neighbor, link in stats.items():
+                busy = {p: c for p, c in link['classes'].items() if c['admitted'] or c['queued']}
+                summary = ', '.join(
+                    f"{p} queued={c['queued']} admitted={c['admitted']} wait avg={c['wait_avg_ms']}ms "
+                    f"max={c['wait_max_ms']}ms paced={c['pacing_wait_s']}s"
+                    for p, c in busy.items()
+                )
+                rate = f"{link['rate_mbps']} Mbit/s" if link['rate_mbps'] else 'unpaced'
+                logger.info(f"Scheduler {neighbor} ({rate}, {link['active']} active): {summary or 'idle'}")
+
+# Singleton
+_scheduler = None
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
@@ -1,19 +1,42 @@
 import socket
 import os
-import struct
-import json
 import uuid
-from typing import List
+import json
+import time
+import mmap
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 from .utils import (
-    get_logger, calculate_md5, get_file_size, 
-    get_timestamp, CHUNK_SIZE, TRANSFER_TIMEOUT, HOST_NAME
+    get_logger, get_file_size, 
+    get_timestamp, ensure_directory, HOST_NAME, INTEGRITY_MODE,
+    MIN_STREAM_BYTES, RESUME_CHUNK_SIZE, HOP_RETRIES, RETRY_BACKOFF, CONNECTION_POOL, COMPRESSION,
+    CONTENT_CACHE_BYTES, DELTA_TRANSFER, DELTA_MIN_SIZE, INTEGRITY_HASH,
+    BATCH_PACK_THRESHOLD, BATCH_ARCHIVE_BYTES, BATCH_PIPELINE_DEPTH
 )
 from .grpc_client import get_heuristic_client
 from .utils import NODE_PORT
 from .timeline_client import get_timeline_client
+from .protocol import (
+    send_metadata, send_frame, recv_frame, send_trailer, send_stream, recv_ack, recv_exact
+)
+from .manifest import chunk_digests
+from .session import Stream, get_session_pool
+from .compression import parse_codec, encode_file, format_stats
+from .delta import compute_delta, delta_size, send_delta
+from .hashing import canonical_hash, hash_file, new_hasher, hop_hash, identifies_content
+from .links import default_stream_count
+from .transport import link_profile, connect, node_address
+from .datagram import DatagramSender, new_flow
+from .scheduler import get_scheduler, priority_of, unwrap
+from .batch import ARCHIVE_FORMAT, ARCHIVE_SUFFIX, collect_files, flat_name, plan_batch, pack_archive
+from .multipath import split_weighted, stripe_filename
+from .fanout import build_tree, tree_paths, deliveries, edge_count
 
 logger = get_logger('agent.sender')
 
+ENCODED_DIR = '.encoded'
+
 class FileSender:
     """Handles file sending through multiple hops"""
     
@@ -25,8 +48,16 @@ class FileSender:
         self, 
         filename: str, 
         destination: str,
-        algorithm: str = 'astar'
+        algorithm: str = 'astar',
+        streams: Optional[int] = None,
+        compression: str = COMPRESSION,
+        priority: Optional[str] = None,
+        deadline: Optional[float] = None,
+        transfer_id: Optional[str] = None
     ) -> bool:
+        """``priority`` (a scheduler class) and ``deadline`` (UNIX seconds)
+        order the transfer against others sharing a next hop, on every hop.
+        ``transfer_id`` lets the caller pick the id its timeline events carry."""
         file_path = os.path.join(self.send_dir, filename)
         
         if not os.path.exists(file_path):
@@ -36,56 +67,653 @@ class FileSender:
         logger.info(f"Starting file transfer: {filename} → {destination}")
         logger.info(f"   Source: {HOST_NAME}")
 
-        client = get_heuristic_client()
-        route = client.find_route(HOST_NAME, destination, algorithm)
+        route = self._find_route(destination, algorithm)
+        if route is None:
+            return False
+        
+        transfer_id = transfer_id or str(uuid.uuid4())
+        payload_path, encoding = self._encode_payload(file_path, transfer_id, compression)
+        schedule = transfer_schedule(priority, deadline)
+        self._save_transfer_record(transfer_id, {
+            'filename': filename,
+            'destination': destination,
+            'route': route,
+            'payload_path': payload_path,
+            'encoding': encoding,
+            'schedule': schedule
+        })
+        
+        success = self._send_to_next_hop(
+            file_path=payload_path,
+            filename=filename,
+            transfer_id=transfer_id,
+            route=route,
+            current_index=0,
+            streams=streams,
+            extra=self._source_extra(encoding, schedule)
+        )
+        if not success:
+            get_heuristic_client().invalidate_route(HOST_NAME, destination, failed_hop=route[1])
+        
+        return self._finish_source_send(transfer_id, success, payload_path if encoding else None)
+    
+    def _find_route(self, destination: str, algorithm: str) -> Optional[List[str]]:
+        """A route from this node to ``destination``, or None (logged)"""
+        try:
+            route = get_heuristic_client().find_route(HOST_NAME, destination, algorithm)
+        except Exception:
+            logger.error("Route query to the heuristic service failed")
+            return None
         
         if not route or len(route) < 2:
             logger.error(f"No valid route found to {destination}")
-            return False
+            return None
         
         if route[0] != HOST_NAME:
             logger.error(f"Route source {route[0]} doesn't match current node {HOST_NAME}")
+            return None
+        return route
+    
+    def send_batch(
+        self,
+        patterns: List[str],
+        destination: str,
+        algorithm: str = 'astar',
+        pack_threshold: int = BATCH_PACK_THRESHOLD,
+        compression: str = COMPRESSION,
+        priority: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> bool:
+        """Send every file matched by ``patterns`` (globs or directories under
+        the send directory) to one destination.
+
+        The route is looked up once. Files go out BATCH_PIPELINE_DEPTH at a
+        time as streams of the pooled session to the first hop, so one file's
+        ACK round trip overlaps the next file's payload. Files smaller than
+        ``pack_threshold`` are packed into tar archives of up to
+        BATCH_ARCHIVE_BYTES, which the destination unpacks into
+        ``<transfer_id>-<archive>/``. Every file or archive is its own transfer,
+        all with the same ``priority`` and ``deadline``.
+        """
+        files = collect_files(self.send_dir, patterns)
+        if not files:
+            logger.error(f"No files match {' '.join(patterns)} in {self.send_dir}")
             return False
-        
+
+        route = self._find_route(destination, algorithm)
+        if route is None:
+            return False
+
+        batch_id = str(uuid.uuid4())[:8]
+        schedule = transfer_schedule(priority, deadline)
+        singles, groups = plan_batch(files, pack_threshold, BATCH_ARCHIVE_BYTES) if pack_threshold > 0 else (files, [])
+        jobs = [(path, flat_name(name), None) for path, name in singles]
+        archive_dir = os.path.join(self.send_dir, '.batch')
+        for index, group in enumerate(groups):
+            ensure_directory(archive_dir)
+            archive_path = os.path.join(archive_dir, f"batch-{batch_id}-{index}{ARCHIVE_SUFFIX}")
+            pack_archive(group, archive_path)
+            jobs.append((archive_path, os.path.basename(archive_path), len(group)))
+
+        total_bytes = sum(os.path.getsize(path) for path, _ in files)
+        logger.info(f"Batch {batch_id}: {len(files)} files ({total_bytes} bytes) → {destination} "
+                    f"as {len(jobs)} transfers ({len(groups)} archives) via {' → '.join(route)}")
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, BATCH_PIPELINE_DEPTH)) as pool:
+            results = list(pool.map(
+                lambda job: self._send_batch_item(job[0], job[1], destination, route, job[2], compression, schedule),
+                jobs
+            ))
+        elapsed = max(time.monotonic() - start, 1e-9)
+
+        sent_files = sum((count or 1) for (_, _, count), ok in zip(jobs, results) if ok)
+        sent_bytes = sum(
+            sum(os.path.getsize(path) for path, _ in group)
+            for group, ok in zip([[s] for s in singles] + groups, results) if ok
+        )
+        logger.info(f"Batch {batch_id}: {sent_files}/{len(files)} files, {sent_bytes} bytes in {elapsed:.2f}s "
+                    f"({sent_bytes / elapsed / 1e6:.1f} MB/s, {sent_files / elapsed:.1f} files/s)")
+        return all(results)
+    
+    def _send_batch_item(
+        self,
+        file_path: str,
+        filename: str,
+        destination: str,
+        route: List[str],
+        archive_files: Optional[int],
+        compression: str,
+        schedule: Optional[dict] = None
+    ) -> bool:
         transfer_id = str(uuid.uuid4())
-        
+        payload_path, encoding = self._encode_payload(file_path, transfer_id, compression)
+        extra = self._source_extra(encoding, schedule)
+        if archive_files:
+            extra['archive'] = {'format': ARCHIVE_FORMAT, 'files': archive_files}
+        self._save_transfer_record(transfer_id, {
+            'filename': filename,
+            'destination': destination,
+            'route': route,
+            'payload_path': payload_path,
+            'encoding': encoding,
+            'archive': extra.get('archive'),
+            'schedule': schedule
+        })
+        success = self._send_with_retries(payload_path, filename, transfer_id, route, 0, extra=extra)
+        if success and archive_files:
+            os.remove(file_path)
+        return self._finish_source_send(transfer_id, success, payload_path if encoding else None)
+    
+    def send_file_multipath(
+        self,
+        filename: str,
+        destination: str,
+        algorithm: str = 'astar',
+        paths: int = 2,
+        compression: str = COMPRESSION,
+        priority: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> bool:
+        """Stripe a file across up to ``paths`` node-disjoint routes.
+
+        Each route carries one contiguous stripe, sized in proportion to the
+        route's bottleneck bandwidth, as an ordinary hop-by-hop transfer that
+        shares the parent transfer_id. The destination reassembles the stripes
+        and reports DONE once all of them have arrived.
+        """
+        file_path = os.path.join(self.send_dir, filename)
+
+        if not os.path.exists(file_path):
+            logger.error(f"File not found: {file_path}")
+            return False
+
+        try:
+            routes = get_heuristic_client().find_disjoint_routes(HOST_NAME, destination, paths, algorithm)
+        except Exception:
+            logger.error("Route query to the heuristic service failed")
+            return False
+        if len(routes) < 2:
+            logger.info(f"Only {len(routes)} disjoint route(s) to {destination}; sending on a single path")
+            return self.send_file_to_destination(
+                filename, destination, algorithm, compression=compression, priority=priority, deadline=deadline
+            )
+
+        transfer_id = str(uuid.uuid4())
+        payload_path, encoding = self._encode_payload(file_path, transfer_id, compression)
+        try:
+            return self._send_stripes(
+                payload_path, filename, destination, transfer_id, routes, encoding,
+                transfer_schedule(priority, deadline)
+            )
+        finally:
+            if encoding:
+                os.remove(payload_path)
+    
+    def _send_stripes(
+        self,
+        file_path: str,
+        filename: str,
+        destination: str,
+        transfer_id: str,
+        routes: List[dict],
+        encoding: Optional[dict],
+        schedule: Optional[dict] = None
+    ) -> bool:
+        file_size = get_file_size(file_path)
+        ranges = split_weighted(file_size, [r['min_bandwidth_mbps'] for r in routes])
+        # Files too small to give every route a whole chunk use fewer routes
+        pairs = [(route, r) for route, r in zip(routes, ranges) if r['length']]
+        if len(pairs) < 2:
+            return self._send_single_route(
+                file_path, filename, transfer_id, routes[0]['path'], encoding, schedule
+            )
+        routes = [route for route, _ in pairs]
+        ranges = split_weighted(file_size, [r['min_bandwidth_mbps'] for r in routes])
+
+        source_extra = self._source_extra(encoding, schedule)
+        file_md5 = hash_file(file_path, hop_hash(source_extra))
+
+        logger.info(f"Striping {filename} → {destination} over {len(routes)} routes")
+        stripes = []
+        # Each stripe is a slice of the mapped file, sent as an in-memory
+        # payload, so no stripe is copied to disk first
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for route, byte_range in zip(routes, ranges):
+                    offset, length = byte_range['offset'], byte_range['length']
+                    logger.info(f"   Stripe {byte_range['index']}: {length} bytes via {' → '.join(route['path'])}")
+                    extra = {
+                        **source_extra,
+                        'stripe': {
+                            'filename': filename,
+                            'index': byte_range['index'],
+                            'count': len(ranges),
+                            'offset': offset,
+                            'file_size': file_size,
+                            'md5': file_md5
+                        }
+                    }
+                    stripes.append((
+                        stripe_filename(filename, byte_range['index']), view[offset:offset + length], route['path'], extra
+                    ))
+
+                with ThreadPoolExecutor(max_workers=len(stripes)) as pool:
+                    results = list(pool.map(
+                        lambda s: self._send_with_retries(
+                            file_path, s[0], transfer_id, s[2], 0, extra=s[3], payload=s[1]
+                        ),
+                        stripes
+                    ))
+            finally:
+                # The map cannot close while slices of it are still exported
+                for stripe in stripes:
+                    stripe[1].release()
+                view.release()
+
+        success = all(results)
+        if success:
+            logger.info(f"File sent successfully: {transfer_id}")
+            self._send_timeline_update(transfer_id, "PENDING")
+        else:
+            failed = [s[3]['stripe']['index'] for s, ok in zip(stripes, results) if not ok]
+            logger.error(f"Multipath transfer failed: {transfer_id} (stripes {failed})")
+        return success
+    
+    def _send_single_route(
+        self,
+        file_path: str,
+        filename: str,
+        transfer_id: str,
+        route: List[str],
+        encoding: Optional[dict],
+        schedule: Optional[dict] = None
+    ) -> bool:
+        success = self._send_with_retries(
+            file_path, filename, transfer_id, route, 0,
+            extra=self._source_extra(encoding, schedule)
+        )
+        if success:
+            logger.info(f"File sent successfully: {transfer_id}")
+            self._send_timeline_update(transfer_id, "PENDING")
+        else:
+            logger.error(f"File transfer failed: {transfer_id}")
+        return success
+    
+    def send_file_multicast(
+        self,
+        filename: str,
+        destinations: List[str],
+        algorithm: str = 'astar',
+        compression: str = COMPRESSION,
+        priority: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> bool:
+        """Send one file to several destinations over a distribution tree.
+
+        The routes to every destination are merged into one tree (see
+        fanout.py), so the payload crosses each tree edge once however many
+        destinations lie beyond it. A node with several children reads its
+        copy once and streams it to all of them. Every destination gets its
+        own transfer_id, so the timeline shows each delivery as a transfer of
+        its own; the tree's hops share a parent transfer_id.
+        """
+        file_path = os.path.join(self.send_dir, filename)
+
+        if not os.path.exists(file_path):
+            logger.error(f"File not found: {file_path}")
+            return False
+
+        unique = list(dict.fromkeys(destinations))
+        routes = {}
+        for destination in unique:
+            route = self._find_route(destination, algorithm)
+            if route is not None:
+                routes[destination] = route
+        if not routes:
+            return False
+
+        transfer_id = str(uuid.uuid4())
+        transfer_ids = {destination: str(uuid.uuid4()) for destination in routes}
+        tree = build_tree(HOST_NAME, routes, transfer_ids)
+        paths = tree_paths(tree, HOST_NAME)
+        logger.info(f"Multicast {transfer_id}: {filename} → {len(routes)} destinations over "
+                    f"{edge_count(tree)} tree edges instead of {sum(len(r) - 1 for r in routes.values())} hops")
+        for destination, path in ((d, paths[d]) for d in routes):
+            logger.info(f"   {destination} ({transfer_ids[destination]}): {' → '.join(path)}")
+
+        payload_path, encoding = self._encode_payload(file_path, transfer_id, compression)
+        try:
+            failed = self._fan_out(
+                payload_path, filename, transfer_id, [HOST_NAME], None,
+                self._source_extra(encoding, transfer_schedule(priority, deadline)), tree['children']
+            )
+        finally:
+            if encoding:
+                os.remove(payload_path)
+
+        unreached = set()
+        for hop in failed:
+            unreached.update(deliveries(tree['children'][hop]))
+        for destination, branch_id in transfer_ids.items():
+            if branch_id not in unreached:
+                self._send_timeline_update(branch_id, "PENDING")
+        sent = len(routes) - len(unreached)
+        if sent == len(unique):
+            logger.info(f"File sent successfully: {transfer_id}")
+        else:
+            logger.error(f"Multicast transfer {transfer_id} reached the first hop for {sent}/{len(unique)} destinations")
+        return sent == len(unique)
+    
+    def _fan_out(
+        self,
+        file_path: str,
+        filename: str,
+        transfer_id: str,
+        route: List[str],
+        file_md5: Optional[str],
+        extra: dict,
+        children: Dict[str, dict]
+    ) -> List[str]:
+        """Send a multicast transfer to the children of this node's tree
+        node; ``route`` is the path from the source to this node. Returns
+        the children that could not be reached.
+
+        Children whose links stream over TCP share one read of the file (see
+        ``_send_branches``); a lone child, datagram links and branches that
+        failed there are sent one by one with the usual retries.
+        """
+        branches = {hop: dict(extra, fanout=node) for hop, node in children.items()}
+        shared = [hop for hop in branches if not link_profile(hop)['datagram']]
+        if len(shared) < 2:
+            shared = []
+        retry = self._send_branches(file_path, filename, transfer_id, route, file_md5, branches, shared) if shared else []
+        alone = [hop for hop in branches if hop not in shared] + retry
+        if not alone:
+            return []
+        with ThreadPoolExecutor(max_workers=len(alone)) as pool:
+            results = list(pool.map(
+                lambda hop: self._send_with_retries(
+                    file_path, filename, transfer_id, route + [hop], len(route) - 1, file_md5, extra=branches[hop]
+                ),
+                alone
+            ))
+        return [hop for hop, ok in zip(alone, results) if not ok]
+    
+    def _send_branches(
+        self,
+        file_path: str,
+        filename: str,
+        transfer_id: str,
+        route: List[str],
+        file_md5: Optional[str],
+        branches: Dict[str, dict],
+        hops: List[str]
+    ) -> List[str]:
+        """Send the file to several next hops at once: each chunk is read
+        (and hashed) once and written to every connection. The slowest branch
+        paces the others. Returns the hops that failed."""
+        spec = hop_hash(branches[hops[0]])
+        file_size = get_file_size(file_path)
+        use_trailer = INTEGRITY_MODE == 'trailer'
+        if file_md5 is None and not use_trailer:
+            file_md5 = hash_file(file_path, spec)
+        hasher = new_hasher(spec) if file_md5 is None else None
+        socks = {}
+        failed = []
+
+        with ExitStack() as stack:
+            for hop in hops:
+                stack.enter_context(get_scheduler().admit(hop, branches[hop]))
+                try:
+                    sock = self._connect(hop, priority=priority_of(branches[hop]))
+                    stack.callback(sock.close)
+                    metadata = {
+                        'transfer_id': transfer_id,
+                        'filename': filename,
+                        'route': route + [hop],
+                        'current_index': len(route),
+                        'file_size': file_size,
+                        'timestamp': get_timestamp(),
+                        **branches[hop]
+                    }
+                    if use_trailer:
+                        metadata['integrity'] = 'trailer'
+                    else:
+                        metadata['md5'] = file_md5
+                    send_metadata(sock, metadata)
+                    socks[hop] = sock
+                except Exception as e:
+                    logger.error(f"Error sending file to {hop}: {e}")
+                    failed.append(hop)
+
+            chunk_size = max((link_profile(hop)['chunk_size'] for hop in socks), default=RESUME_CHUNK_SIZE)
+            with open(file_path, 'rb') as f:
+                sent = 0
+                while socks and sent < file_size:
+                    chunk = f.read(min(chunk_size, file_size - sent))
+                    if not chunk:
+                        break
+                    if hasher:
+                        hasher.update(chunk)
+                    for hop, sock in list(socks.items()):
+                        try:
+                            sock.sendall(chunk)
+                        except Exception as e:
+                            logger.error(f"Error sending file to {hop}: {e}")
+                            del socks[hop]
+                            failed.append(hop)
+                    sent += len(chunk)
+
+            for hop, sock in socks.items():
+                try:
+                    if use_trailer:
+                        send_trailer(sock, file_md5 or hasher.hexdigest())
+                    if not self._check_ack(recv_ack(sock)):
+                        failed.append(hop)
+                except Exception as e:
+                    logger.error(f"Error sending file to {hop}: {e}")
+                    failed.append(hop)
+        return failed
+    
+    def _source_extra(self, encoding: Optional[dict], schedule: Optional[dict] = None) -> dict:
+        """End-to-end fields the source sets: the integrity hash every hop
+        verifies with, if compressed the payload encoding, and the scheduling
+        class and deadline, if any"""
+        extra = {'hash': canonical_hash(INTEGRITY_HASH)}
+        if encoding:
+            extra['encoding'] = encoding
+        extra.update(schedule or {})
+        return extra
+    
+    def _encode_payload(self, file_path: str, transfer_id: str, compression: str) -> Tuple[str, Optional[dict]]:
+        """Compress the file once, at the source; relays forward the encoded
+        bytes untouched and only the destination decodes them.
+
+        Returns the path to send and the ``encoding`` metadata, or the
+        original path and None when compression is off or does not pay.
+        """
+        codec = parse_codec(compression)
+        if codec is None:
+            return file_path, None
+
+        encoded_path = os.path.join(self.send_dir, ENCODED_DIR, f"{transfer_id}.enc")
+        ensure_directory(os.path.dirname(encoded_path))
+        stats = encode_file(file_path, encoded_path, *codec)
+        logger.info(f"Compressed {os.path.basename(file_path)}: {format_stats(stats)}")
+
+        if stats['encoded_size'] >= stats['size']:
+            logger.info("Payload does not compress; sending it raw")
+            os.remove(encoded_path)
+            return file_path, None
+        encoding = {key: stats[key] for key in ('codec', 'level', 'chunk_size', 'size', 'md5')}
+        return encoded_path, encoding
+    
+    def resume_transfer(self, transfer_id: str) -> bool:
+        """Continue a failed send from the chunks the first hop already holds"""
+        record = self._load_transfer_record(transfer_id)
+        if record is None:
+            logger.error(f"No resumable transfer: {transfer_id}")
+            return False
+
+        file_path = record.get('payload_path') or os.path.join(self.send_dir, record['filename'])
+        if not os.path.exists(file_path):
+            logger.error(f"File not found: {file_path}")
+            return False
+
+        encoding = record.get('encoding')
+        extra = self._source_extra(encoding, record.get('schedule'))
+        if record.get('archive'):
+            extra['archive'] = record['archive']
+        logger.info(f"Resuming transfer {transfer_id}: {record['filename']} → {record['destination']}")
         success = self._send_to_next_hop(
             file_path=file_path,
-            filename=filename,
+            filename=record['filename'],
             transfer_id=transfer_id,
-            route=route,
-            current_index=0
+            route=record['route'],
+            current_index=0,
+            resume=True,
+            extra=extra
         )
-        
+        return self._finish_source_send(transfer_id, success, file_path if encoding else None)
+    
+    def _finish_source_send(self, transfer_id: str, success: bool, encoded_path: Optional[str] = None) -> bool:
         if success:
             logger.info(f"File sent successfully: {transfer_id}")
+            self._remove_transfer_record(transfer_id)
+            if encoded_path:
+                os.remove(encoded_path)
             self._send_timeline_update(transfer_id, "PENDING")
         else:
             logger.error(f"File transfer failed: {transfer_id}")
-        
+            logger.info(f"Resume with: python main.py send --resume {transfer_id}")
         return success
     
+    def _transfer_record_path(self, transfer_id: str) -> str:
+        return os.path.join(self.send_dir, '.transfers', f"{transfer_id}.json")
+    
+    def _save_transfer_record(self, transfer_id: str, record: dict):
+        path = self._transfer_record_path(transfer_id)
+        ensure_directory(os.path.dirname(path))
+        with open(path, 'w') as f:
+            json.dump(record, f)
+    
+    def _load_transfer_record(self, transfer_id: str) -> Optional[dict]:
+        try:
+            with open(self._transfer_record_path(transfer_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _remove_transfer_record(self, transfer_id: str):
+        try:
+            os.remove(self._transfer_record_path(transfer_id))
+        except FileNotFoundError:
+            pass
+    
     def _send_to_next_hop(
         self,
         file_path: str,
         filename: str,
         transfer_id: str,
         route: List[str],
-        current_index: int
+        current_index: int,
+        file_md5: Optional[str] = None,
+        streams: Optional[int] = None,
+        resume: bool = False,
+        extra: Optional[dict] = None,
+        payload: Optional[memoryview] = None
     ) -> bool:
+        """Send one hop once the next hop's scheduler admits it (see
+        ``_send_hop``)"""
         if current_index >= len(route) - 1:
             logger.error("Already at destination")
             return False
-        
+        with get_scheduler().admit(route[current_index + 1], extra):
+            return self._send_hop(
+                file_path, filename, transfer_id, route, current_index, file_md5, streams, resume, extra, payload
+            )
+    
+    def _send_hop(
+        self,
+        file_path: str,
+        filename: str,
+        transfer_id: str,
+        route: List[str],
+        current_index: int,
+        file_md5: Optional[str] = None,
+        streams: Optional[int] = None,
+        resume: bool = False,
+        extra: Optional[dict] = None,
+        payload: Optional[memoryview] = None
+    ) -> bool:
+        """Send one hop. ``file_md5`` is a digest the caller already verified
+        (e.g. a relay that just received the file); it is passed along as-is
+        instead of hashing the file again.
+
+        ``streams`` > 1 splits the file into byte ranges sent over parallel
+        connections; by default it is derived from the link's bandwidth-delay
+        product and capped so each stream carries at least MIN_STREAM_BYTES.
+
+        ``resume`` asks the next hop which chunks of ``transfer_id`` it
+        already holds and sends only the missing ones.
+
+        ``extra`` holds end-to-end metadata fields (e.g. ``stripe``) that every
+        hop carries unchanged to the destination.
+
+        ``payload`` is the file held in memory (a relay's spool); it is sent
+        whole over one connection and ``file_path`` is not read.
+
+        Links whose profile picks datagrams (``DATAGRAM_TRANSPORT``) carry
+        the payload over UDP in one flow, unless resuming.
+        """
         next_hop = route[current_index + 1]
+        spec = hop_hash(extra)
+        sock = None
+        profile = link_profile(next_hop)
+        datagram = profile['datagram']
+
+        if payload is not None:
+            resume, streams = False, 1
+            if file_md5 is None:
+                hasher = new_hasher(spec)
+                hasher.update(payload)
+                file_md5 = hasher.hexdigest()
+
+        if resume:
+            return self._send_resumable(
+                file_path, filename, transfer_id, route, current_index, file_md5, extra
+            )
+
+        if datagram:
+            streams = 1
+        if streams is None:
+            streams = default_stream_count(route[current_index], next_hop)
+        if streams > 1 and os.path.exists(file_path):
+            streams = min(streams, get_file_size(file_path) // MIN_STREAM_BYTES)
+            if streams > 1:
+                # Ranges carry the whole-file digest anyway, so asking first is cheap
+                if file_md5 is None:
+                    file_md5 = hash_file(file_path, spec)
+                if self._already_held(file_path, filename, transfer_id, route, current_index, file_md5, extra):
+                    return True
+                return self._send_striped(
+                    file_path, filename, transfer_id, route, current_index, file_md5, streams, extra
+                )
 
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(TRANSFER_TIMEOUT)
-            sock.connect((next_hop, NODE_PORT))
+            sock = self._connect(next_hop, priority=priority_of(extra))
             
-            file_size = get_file_size(file_path)
-            file_md5 = calculate_md5(file_path)
+            file_size = len(payload) if payload is not None else get_file_size(file_path)
+            if not file_size:
+                datagram = None
+            # Only session peers understand offers; the digest has to be known
+            # up front for the receiver to look it up.
+            offer = CONTENT_CACHE_BYTES > 0 and isinstance(unwrap(sock), Stream) and identifies_content(spec)
+            use_trailer = INTEGRITY_MODE == 'trailer' and not offer
+            if file_md5 is None and not use_trailer:
+                file_md5 = hash_file(file_path, spec)
             
             metadata = {
                 'transfer_id': transfer_id,
@@ -93,32 +721,54 @@ class FileSender:
                 'route': route,
                 'current_index': current_index + 1, 
                 'file_size': file_size,
-                'md5': file_md5,
-                'timestamp': get_timestamp()
+                'timestamp': get_timestamp(),
+                **(extra or {})
             }
+            if use_trailer:
+                metadata['integrity'] = 'trailer'
+            else:
+                metadata['md5'] = file_md5
+            if offer:
+                metadata['offer'] = True
+                if DELTA_TRANSFER and file_size >= DELTA_MIN_SIZE and payload is None:
+                    metadata['delta'] = True
+            if datagram:
+                metadata['datagram'] = new_flow(datagram)
             
-            metadata_json = json.dumps(metadata).encode('utf-8')
-            
-            sock.sendall(struct.pack('!I', len(metadata_json)))
-            sock.sendall(metadata_json)
+            send_metadata(sock, metadata)
 
-            bytes_sent = 0
-            with open(file_path, 'rb') as f:
-                while True:
-                    chunk = f.read(CHUNK_SIZE)
-                    if not chunk:
-                        break
-                    sock.sendall(chunk)
-                    bytes_sent += len(chunk)
+            if offer:
+                reply = recv_frame(sock)
+                if not reply:
+                    logger.error(f"{next_hop} closed before answering the offer")
+                    return False
+                if reply.get('status') == 'HAVE':
+                    logger.info(f"{next_hop} already holds {file_md5}; payload skipped")
+                    return self._check_ack(recv_ack(sock))
+                if reply.get('status') == 'SIGNATURES':
+                    return self._send_delta(sock, file_path, reply, next_hop)
+                if reply.get('status') == 'ERROR':
+                    logger.error(f"{next_hop} refused the transfer: {reply.get('message')}")
+                    return False
 
-            ack_data = sock.recv(1024)
-            ack = json.loads(ack_data.decode('utf-8'))
-            
-            if ack.get('status') == 'OK':
-                return True
+            # Hash while streaming unless the digest is already known; with a
+            # known digest the payload goes out zero-copy.
+            hasher = new_hasher(spec) if file_md5 is None else None
+            if datagram:
+                # The trailer follows the last new packet rather than DONE, saving a round trip
+                trailer = (lambda: send_trailer(sock, file_md5 or hasher.hexdigest())) if use_trailer else None
+                if not self._send_datagrams(sock, file_path, payload, metadata, profile, hasher, trailer):
+                    return False
+            elif payload is not None:
+                sock.sendall(payload)
             else:
-                logger.error(f"NACK received: {ack.get('message')}")
-                return False
+                with open(file_path, 'rb') as f:
+                    send_stream(sock, f, file_size, hasher, chunk_size=profile['chunk_size'])
+
+            if use_trailer and not datagram:
+                send_trailer(sock, file_md5 or hasher.hexdigest())
+
+            return self._check_ack(recv_ack(sock))
         
         except socket.timeout:
             logger.error(f"Timeout connecting to {next_hop}")
@@ -127,7 +777,293 @@ class FileSender:
             logger.error(f"Error sending file: {e}")
             return False
         finally:
-            sock.close()
+            if sock:
+                sock.close()
+    
+    def _send_datagrams(
+        self,
+        sock,
+        file_path: str,
+        payload: Optional[memoryview],
+        metadata: dict,
+        profile: dict,
+        hasher=None,
+        on_sent: Optional[Callable[[], None]] = None
+    ) -> bool:
+        """The payload as a datagram flow, once the next hop has opened it;
+        ``on_sent`` runs once every packet has gone out at least once"""
+        next_hop = profile['neighbor']
+        reply = recv_frame(sock)
+        if not reply or reply.get('status') != 'READY':
+            logger.error(f"{next_hop} did not open a datagram flow: {(reply or {}).get('message', 'closed')}")
+            return False
+        f = None
+        if payload is not None:
+            read = lambda offset, length: bytes(payload[offset:offset + length])
+        else:
+            f = open(file_path, 'rb')
+            read = lambda offset, length: os.pread(f.fileno(), length, offset)
+        try:
+            return DatagramSender(
+                node_address(next_hop), metadata['datagram'], metadata['file_size'], read, profile, hasher, on_sent
+            ).run()
+        finally:
+            if f:
+                f.close()
+    
+    def _already_held(
+        self,
+        file_path: str,
+        filename: str,
+        transfer_id: str,
+        route: List[str],
+        current_index: int,
+        file_md5: str,
+        extra: Optional[dict] = None
+    ) -> bool:
+        """Probe whether the next hop already holds ``file_md5``; if it does,
+        it completes the hop from its own copy. If it holds an older version
+        instead, the hop is completed with a delta against it."""
+        if CONTENT_CACHE_BYTES <= 0 or not identifies_content(hop_hash(extra)):
+            return False
+        next_hop = route[current_index + 1]
+        sock = None
+        try:
+            sock = self._connect(next_hop, priority=priority_of(extra))
+            if not isinstance(unwrap(sock), Stream):
+                return False
+            file_size = get_file_size(file_path)
+            send_metadata(sock, {
+                'transfer_id': transfer_id,
+                'filename': filename,
+                'route': route,
+                'current_index': current_index + 1,
+                'file_size': file_size,
+                'md5': file_md5,
+                'offer': True,
+                'probe': True,
+                'delta': DELTA_TRANSFER and file_size >= DELTA_MIN_SIZE,
+                'timestamp': get_timestamp(),
+                **(extra or {})
+            })
+            reply = recv_frame(sock)
+            if reply and reply.get('status') == 'SIGNATURES':
+                return self._send_delta(sock, file_path, reply, next_hop)
+            if reply and reply.get('status') == 'ERROR':
+                logger.error(f"{next_hop} refused the transfer: {reply.get('message')}")
+            if not reply or reply.get('status') != 'HAVE':
+                return False
+            logger.info(f"{next_hop} already holds {file_md5}; payload skipped")
+            return self._check_ack(recv_ack(sock))
+        except Exception as e:
+            logger.error(f"Offer to {next_hop} failed: {e}")
+            return False
+        finally:
+            if sock:
+                sock.close()
+    
+    def _send_delta(self, sock, file_path: str, reply: dict, next_hop: str) -> bool:
+        """Send ``file_path`` as a delta against the older copy the next hop
+        described in its SIGNATURES reply"""
+        block_size = reply['block_size']
+        signatures = recv_exact(sock, reply['length'])
+        if signatures is None:
+            logger.error(f"{next_hop} closed while sending block signatures")
+            return False
+
+        start = time.monotonic()
+        ops = compute_delta(file_path, bytes(signatures), block_size)
+        literal, copied = delta_size(ops, block_size)
+        logger.info(f"Delta against {reply['basis']} on {next_hop}: {literal} literal bytes, "
+                    f"{copied} copied ({time.monotonic() - start:.2f}s to match)")
+        send_delta(sock, file_path, ops, send_stream)
+        return self._check_ack(recv_ack(sock))
+    
+    def _check_ack(self, ack: dict) -> bool:
+        if ack.get('status') == 'OK':
+            return True
+        logger.error(f"NACK received: {ack.get('message')}")
+        return False
+    
+    def _send_with_retries(
+        self,
+        file_path: str,
+        filename: str,
+        transfer_id: str,
+        route: List[str],
+        current_index: int,
+        file_md5: Optional[str] = None,
+        extra: Optional[dict] = None,
+        payload: Optional[memoryview] = None
+    ) -> bool:
+        """Send one hop, resuming from the chunks already delivered on failure
+        (an in-memory ``payload`` is simply sent again)"""
+        if self._send_to_next_hop(
+            file_path, filename, transfer_id, route, current_index, file_md5, extra=extra, payload=payload
+        ):
+            return True
+
+        for attempt in range(1, HOP_RETRIES + 1):
+            delay = RETRY_BACKOFF * (2 ** (attempt - 1))
+            logger.info(f"Retrying hop to {route[current_index + 1]} in {delay:.1f}s ({attempt}/{HOP_RETRIES})")
+            time.sleep(delay)
+            if self._send_to_next_hop(
+                file_path, filename, transfer_id, route, current_index, file_md5,
+                resume=True, extra=extra, payload=payload
+            ):
+                return True
+        get_heuristic_client().invalidate_route(
+            route[current_index], route[-1], failed_hop=route[current_index + 1]
+        )
+        return False
+    
+    def _send_resumable(
+        self,
+        file_path: str,
+        filename: str,
+        transfer_id: str,
+        route: List[str],
+        current_index: int,
+        file_md5: Optional[str],
+        extra: Optional[dict] = None
+    ) -> bool:
+        next_hop = route[current_index + 1]
+        sock = None
+        try:
+            file_size = get_file_size(file_path)
+            hasher = new_hasher(hop_hash(extra)) if file_md5 is None else None
+            digest, crcs = chunk_digests(file_path, RESUME_CHUNK_SIZE, hasher)
+            file_md5 = file_md5 or digest
+
+            sock = self._connect(next_hop, priority=priority_of(extra))
+            send_metadata(sock, {
+                'transfer_id': transfer_id,
+                'filename': filename,
+                'route': route,
+                'current_index': current_index + 1,
+                'file_size': file_size,
+                'md5': file_md5,
+                'resume': True,
+                'chunk_size': RESUME_CHUNK_SIZE,
+                'timestamp': get_timestamp(),
+                **(extra or {})
+            })
+
+            reply = recv_frame(sock)
+            if not reply or reply.get('status') != 'READY':
+                logger.error(f"Resume refused by {next_hop}: {reply}")
+                return False
+
+            have = reply.get('have', {})
+            missing = [i for i, crc in enumerate(crcs) if have.get(str(i)) != crc]
+            if file_size == 0:
+                missing = []
+            logger.info(f"Resuming {transfer_id} at {next_hop}: sending {len(missing)}/{len(crcs)} chunks")
+            send_frame(sock, {'chunks': missing})
+
+            with open(file_path, 'rb') as f:
+                for index in missing:
+                    offset = index * RESUME_CHUNK_SIZE
+                    f.seek(offset)
+                    send_stream(sock, f, min(RESUME_CHUNK_SIZE, file_size - offset))
+
+            ack = recv_ack(sock)
+            if ack.get('status') == 'OK':
+                return True
+            logger.error(f"NACK received: {ack.get('message')}")
+            return False
+
+        except Exception as e:
+            logger.error(f"Error resuming transfer to {next_hop}: {e}")
+            return False
+        finally:
+            if sock:
+                sock.close()
+    
+    def _send_striped(
+        self,
+        file_path: str,
+        filename: str,
+        transfer_id: str,
+        route: List[str],
+        current_index: int,
+        file_md5: Optional[str],
+        streams: int,
+        extra: Optional[dict] = None
+    ) -> bool:
+        next_hop = route[current_index + 1]
+        try:
+            file_size = get_file_size(file_path)
+            # Ranges are verified together once reassembled, so the whole-file
+            # digest has to travel in every range header.
+            if file_md5 is None:
+                file_md5 = hash_file(file_path, hop_hash(extra))
+        except Exception as e:
+            logger.error(f"Error preparing striped send: {e}")
+            return False
+
+        metadata = {
+            'transfer_id': transfer_id,
+            'filename': filename,
+            'route': route,
+            'current_index': current_index + 1,
+            'file_size': file_size,
+            'md5': file_md5,
+            'timestamp': get_timestamp(),
+            **(extra or {})
+        }
+        ranges = split_ranges(file_size, streams)
+        logger.info(f"Sending {filename} to {next_hop} over {len(ranges)} streams")
+
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            results = list(pool.map(
+                lambda r: self._send_range(file_path, next_hop, metadata, r),
+                ranges
+            ))
+        return all(results)
+    
+    def _send_range(self, file_path: str, next_hop: str, metadata: dict, byte_range: dict) -> bool:
+        sock = None
+        try:
+            # Ranges exist to get several TCP windows, so each needs its own connection
+            sock = self._connect(next_hop, pooled=False, priority=priority_of(metadata))
+            send_metadata(sock, dict(metadata, range=byte_range))
+            with open(file_path, 'rb') as f:
+                f.seek(byte_range['offset'])
+                send_stream(sock, f, byte_range['length'])
+
+            ack = recv_ack(sock)
+            if ack.get('status') == 'OK':
+                return True
+            logger.error(f"NACK for range {byte_range['index']}: {ack.get('message')}")
+            return False
+        except Exception as e:
+            logger.error(f"Error sending range {byte_range['index']} to {next_hop}: {e}")
+            return False
+        finally:
+            if sock:
+                sock.close()
+    
+    def _connect(
+        self,
+        next_hop: str,
+        pooled: bool = CONNECTION_POOL,
+        priority: Optional[str] = None
+    ) -> socket.socket:
+        """A connection to the next hop: a stream on the pooled session when the
+        neighbor accepts sessions, otherwise a fresh one-shot TCP connection
+        tuned to the link's transport profile. Sends on it are paced by the
+        next hop's scheduler as ``priority``."""
+        scheduler = get_scheduler()
+        priority = priority or priority_of(None)
+        profile = link_profile(next_hop)
+        if pooled:
+            stream = get_session_pool().open_stream(next_hop)
+            if stream is not None:
+                stream.settimeout(profile['timeout'])
+                return scheduler.paced(stream, next_hop, priority)
+
+        return scheduler.paced(connect(next_hop, NODE_PORT, profile), next_hop, priority)
     
     def _send_timeline_update(self, transfer_id: str, status: str):
         try:
@@ -140,6 +1076,26 @@ class FileSender:
         except Exception as e:
             logger.error(f"Error sending timeline update: {e}")
 
+def transfer_schedule(priority: Optional[str] = None, deadline: Optional[float] = None) -> dict:
+    """The ``priority``/``deadline`` metadata fields a source sets, if any"""
+    schedule = {}
+    if priority:
+        schedule['priority'] = priority
+    if deadline is not None:
+        schedule['deadline'] = deadline
+    return schedule
+
+def split_ranges(file_size: int, count: int) -> List[dict]:
+    """Split ``file_size`` bytes into ``count`` contiguous, near-equal ranges"""
+    base, extra = divmod(file_size, count)
+    ranges = []
+    offset = 0
+    for index in range(count):
+        length = base + (1 if index < extra else 0)
+        ranges.append({'index': index, 'count': count, 'offset': offset, 'length': length})
+        offset += length
+    return ranges
+
 # Singleton instance
 _sender = None
 
@@ -0,0 +1,469 @@
+"""Multiplexed sessions: many hop transfers over one persistent connection per neighbor.
+
+A session starts with SESSION_PREAMBLE in both directions. After that every
+write is a frame ``[1B type][4B stream id][4B length][payload]``. Each stream
+carries one ordinary hop exchange (metadata frame, payload, trailer, ACK), so
+the receive paths are shared with one-shot connections; ``Stream`` stands in
+for the socket.
+
+Legacy agents read the preamble's zero length as an empty metadata frame and
+hang up, which tells the pool to fall back to one connection per transfer.
+
+Streams start with SESSION_WINDOW bytes of credit. The dialing side may send
+a ``SETTINGS`` frame (stream 0, ``!I`` window) asking for a larger per-stream
+window sized to the link; the accepting side caps it at SESSION_WINDOW_MAX
+and grants the difference on every stream it opens. Agents that predate
+``SETTINGS`` drop the frame and keep the default.
+"""
+import time
+import struct
+import select
+import socket
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+from .utils import (
+    get_logger, NODE_PORT, TRANSFER_TIMEOUT,
+    SESSION_WINDOW, SESSION_WINDOW_MAX, SESSION_KEEPALIVE, SESSION_IDLE_TIMEOUT
+)
+from .protocol import recv_exact
+from .transport import link_profile, connect
+
+logger = get_logger('agent.session')
+
+SESSION_PREAMBLE = struct.pack('!I', 0) + b'SGS1'
+FRAME_HEADER = struct.Struct('!BII')
+
+OPEN, DATA, CLOSE, RESET, WINDOW, PING, PONG, SETTINGS = range(1, 9)
+
+MAX_DATA_FRAME = 65536
+# How long a neighbor that refused the session preamble is left on one-shot connections
+LEGACY_RECHECK = 300
+
+class SessionClosed(ConnectionError):
+    pass
+
+class Stream:
+    """Socket-like end of one multiplexed stream.
+
+    Sends are limited by the credit the peer has granted (``SESSION_WINDOW``
+    bytes of buffer per stream); received bytes are credited back as they
+    are consumed, so a slow receiver stalls only its own stream.
+    """
+
+    def __init__(self, session: 'Session', stream_id: int, window: int, credit: Optional[int] = None):
+        self.session = session
+        self.stream_id = stream_id
+        self.window = window
+        self._inbound = deque()
+        self._cond = threading.Condition()
+        self._send_credit = window if credit is None else credit
+        self._consumed = 0
+        self._eof = False
+        self._error = None
+        self._timeout = None
+        self.closed = False
+
+    def settimeout(self, timeout: Optional[float]):
+        self._timeout = timeout
+
+    def gettimeout(self) -> Optional[float]:
+        return self._timeout
+
+    def _wait(self, ready: Callable[[], bool]):
+        """Wait on the condition (held by the caller) until ``ready()`` or timeout"""
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        while not ready():
+            if self._error:
+                raise self._error
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise socket.timeout('timed out')
+            self._cond.wait(remaining)
+
+    def recv_into(self, buffer, nbytes: int = 0) -> int:
+        view = memoryview(buffer)
+        nbytes = nbytes or len(view)
+        with self._cond:
+            self._wait(lambda: self._inbound or self._eof or self._error)
+            if not self._inbound:
+                if self._error:
+                    raise self._error
+                return 0
+            count = 0
+            while self._inbound and count < nbytes:
+                chunk = self._inbound[0]
+                take = min(len(chunk), nbytes - count)
+                view[count:count + take] = chunk[:take]
+                count += take
+                if take == len(chunk):
+                    self._inbound.popleft()
+                else:
+                    self._inbound[0] = chunk[take:]
+            self._consumed += count
+            grant = 0
+            if self._consumed >= self.window // 2:
+                grant, self._consumed = self._consumed, 0
+        if grant:
+            self.session._send_frame(WINDOW, self.stream_id, struct.pack('!I', grant))
+        return count
+
+    def recv(self, bufsize: int) -> bytes:
+        data = bytearray(bufsize)
+        count = self.recv_into(data, bufsize)
+        return bytes(data[:count])
+
+    def sendall(self, data):
+        view = memoryview(data).cast('B')
+        while view:
+            with self._cond:
+                self._wait(lambda: self._send_credit > 0 or self._error)
+                if self._error:
+                    raise self._error
+                take = min(len(view), self._send_credit, MAX_DATA_FRAME)
+                self._send_credit -= take
+            self.session._send_frame(DATA, self.stream_id, view[:take])
+            view = view[take:]
+
+    def send(self, data) -> int:
+        self.sendall(data)
+        return len(data)
+
+    def sendfile(self, file, offset: int = 0, count: Optional[int] = None) -> int:
+        file.seek(offset)
+        total = 0
+        while count is None or total < count:
+            want = MAX_DATA_FRAME if count is None else min(MAX_DATA_FRAME, count - total)
+            chunk = file.read(want)
+            if not chunk:
+                break
+            self.sendall(chunk)
+            total += len(chunk)
+        return total
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.session._forget(self.stream_id)
+        if not self._error:
+            try:
+                self.session._send_frame(CLOSE, self.stream_id)
+            except OSError:
+                pass
+
+    def reset(self):
+        """Abort the stream; the peer's pending and later sends fail"""
+        if self.closed:
+            return
+        self.closed = True
+        self.session._forget(self.stream_id)
+        try:
+            self.session._send_frame(RESET, self.stream_id)
+        except OSError:
+            pass
+
+    # Called from the session reader
+    def _feed(self, data: bytes):
+        with self._cond:
+            self._inbound.append(data)
+            self._cond.notify_all()
+
+    def _grant(self, credit: int):
+        with self._cond:
+            self._send_credit += credit
+            self._cond.notify_all()
+
+    def _finish(self):
+        with self._cond:
+            self._eof = True
+            self._cond.notify_all()
+
+    def _fail(self, error: Exception):
+        with self._cond:
+            self._error = error
+            self._cond.notify_all()
+
+def _send_parts(sock: socket.socket, *parts):
+    """Send ``parts`` back to back without joining them into one buffer"""
+    views = [memoryview(part).cast('B') for part in parts if len(part)]
+    if not hasattr(sock, 'sendmsg'):
+        for view in views:
+            sock.sendall(view)
+        return
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if sent:
+            views[0] = views[0][sent:]
+
+class Session:
+    """One persistent connection carrying many streams.
+
+    The side that dialed opens streams (odd ids); the accepting side hands
+    each new stream to ``on_open``. A reader thread (or ``run`` on the
+    accepting side) demultiplexes frames, answers keepalive pings and, with
+    ``idle_timeout``, closes the connection once it has carried no stream
+    for that long. ``on_close`` is called once the session has shut down.
+
+    A frame that fails part-way may leave a torn frame on the wire, after
+    which the peer can no longer parse the connection, so any send error
+    shuts the whole session down and fails all of its streams.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        on_open: Optional[Callable[[Stream], None]] = None,
+        window: int = SESSION_WINDOW,
+        keepalive: float = SESSION_KEEPALIVE,
+        idle_timeout: Optional[float] = None,
+        name: str = '',
+        timeout: float = TRANSFER_TIMEOUT,
+        on_close: Optional[Callable[['Session'], None]] = None
+    ):
+        self.sock = sock
+        self.on_open = on_open
+        self.on_close = on_close
+        self.window = window
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.name = name
+        self.streams: Dict[int, Stream] = {}
+        self.closed = False
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._last_recv = time.monotonic()
+        self._last_active = time.monotonic()
+        self.sock.settimeout(timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True, name=f'session-{self.name}').start()
+
+    def request_window(self):
+        """Ask the peer for ``window`` bytes of credit per stream"""
+        if self.window > SESSION_WINDOW:
+            self._send_frame(SETTINGS, 0, struct.pack('!I', self.window))
+
+    def open_stream(self) -> Stream:
+        with self._lock:
+            if self.closed:
+                raise SessionClosed(f"Session to {self.name} is closed")
+            # The extra credit a larger window needs comes from the peer
+            stream = Stream(self, self._next_id, self.window, credit=SESSION_WINDOW)
+            self._next_id += 2
+            self.streams[stream.stream_id] = stream
+            self._last_active = time.monotonic()
+        try:
+            self._send_frame(OPEN, stream.stream_id)
+        except OSError as e:
+            self.close()
+            raise SessionClosed(str(e))
+        return stream
+
+    def _forget(self, stream_id: int):
+        with self._lock:
+            self.streams.pop(stream_id, None)
+            self._last_active = time.monotonic()
+
+    def _send_frame(self, frame_type: int, stream_id: int, payload=b''):
+        header = FRAME_HEADER.pack(frame_type, stream_id, len(payload))
+        with self._send_lock:
+            if self.closed:
+                raise SessionClosed(f"Session to {self.name} is closed")
+            try:
+                _send_parts(self.sock, header, payload)
+            except Exception as e:
+                logger.error(f"Session {self.name} failed sending a frame: {e}")
+                self._shutdown(SessionClosed(f"Session to {self.name} lost: {e}"))
+                raise
+
+    def run(self):
+        """Read frames until the connection fails or the session is closed"""
+        error = None
+        try:
+            while not self.closed:
+                readable, _, _ = select.select([self.sock], [], [], self.keepalive)
+                if not readable:
+                    self._on_quiet()
+                    continue
+                header = recv_exact(self.sock, FRAME_HEADER.size)
+                if header is None:
+                    break
+                frame_type, stream_id, length = FRAME_HEADER.unpack(header)
+                payload = recv_exact(self.sock, length) if length else b''
+                if payload is None:
+                    break
+                self._last_recv = time.monotonic()
+                self._dispatch(frame_type, stream_id, payload)
+        except (OSError, ValueError) as e:
+            if not self.closed:
+                error = e
+                logger.error(f"Session {self.name} failed: {e}")
+        finally:
+            self._shutdown(SessionClosed(f"Session to {self.name} lost: {error or 'closed by peer'}"))
+
+    def _on_quiet(self):
+        now = time.monotonic()
+        if now - self._last_recv > 3 * self.keepalive:
+            raise ConnectionError('keepalive timeout')
+        with self._lock:
+            idle = not self.streams and now - self._last_active > (self.idle_timeout or float('inf'))
+        if idle:
+            logger.info(f"Closing idle session {self.name}")
+            self.close()
+            return
+        self._send_frame(PING, 0)
+
+    def _dispatch(self, frame_type: int, stream_id: int, payload: bytes):
+        if frame_type == PING:
+            self._send_frame(PONG, 0)
+            return
+        if frame_type == PONG:
+            return
+        if frame_type == SETTINGS:
+            requested = struct.unpack('!I', payload)[0]
+            self.window = max(SESSION_WINDOW, min(requested, SESSION_WINDOW_MAX))
+            return
+
+        if frame_type == OPEN:
+            if self.on_open is None:
+                self._send_frame(RESET, stream_id)
+                return
+            stream = Stream(self, stream_id, self.window)
+            with self._lock:
+                self.streams[stream_id] = stream
+                self._last_active = time.monotonic()
+            if self.window > SESSION_WINDOW:
+                self._send_frame(WINDOW, stream_id, struct.pack('!I', self.window - SESSION_WINDOW))
+            self.on_open(stream)
+            return
+
+        with self._lock:
+            stream = self.streams.get(stream_id)
+        if stream is None:
+            return  # closed locally; late frames are dropped
+        if frame_type == DATA:
+            stream._feed(payload)
+        elif frame_type == WINDOW:
+            stream._grant(struct.unpack('!I', payload)[0])
+        elif frame_type == CLOSE:
+            stream._finish()
+        elif frame_type == RESET:
+            stream._fail(ConnectionResetError(f"Stream {stream_id} reset by peer"))
+
+    def close(self):
+        self._shutdown(SessionClosed(f"Session to {self.name} closed"))
+
+    def _shutdown(self, error: Exception):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            streams = list(self.streams.values())
+            self.streams.clear()
+        for stream in streams:
+            stream._fail(error)
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        if self.on_close:
+            self.on_close(self)
+
+def accept_session(sock: socket.socket):
+    """Answer a peer's preamble; the caller then runs a Session on ``sock``"""
+    sock.sendall(SESSION_PREAMBLE)
+
+class SessionPool:
+    """Warm sessions to next hops, dialed on first use and reused by every transfer"""
+
+    def __init__(self, port: int = NODE_PORT, timeout: float = TRANSFER_TIMEOUT):
+        self.port = port
+        self.timeout = timeout
+        self._sessions: Dict[str, Session] = {}
+        self._legacy: Dict[str, float] = {}
+        self._dial_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def open_stream(self, host: str) -> Optional[Stream]:
+        """A new stream to ``host``, or None if it only speaks the one-shot protocol"""
+        for _ in range(2):
+            session = self._session(host)
+            if session is None:
+                return None
+            try:
+                return session.open_stream()
+            except SessionClosed:
+                self._drop(host, session)
+        return None
+
+    def _session(self, host: str) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(host)
+            if session and not session.closed:
+                return session
+            if time.monotonic() < self._legacy.get(host, 0):
+                return None
+            dial_lock = self._dial_locks.setdefault(host, threading.Lock())
+
+        with dial_lock:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session and not session.closed:
+                    return session
+            session = self._dial(host)
+            with self._lock:
+                if session is None:
+                    self._legacy[host] = time.monotonic() + LEGACY_RECHECK
+                else:
+                    self._sessions[host] = session
+            return session
+
+    def _dial(self, host: str) -> Optional[Session]:
+        profile = link_profile(host)
+        sock = connect(host, self.port, profile)
+        try:
+            sock.sendall(SESSION_PREAMBLE)
+            reply = recv_exact(sock, len(SESSION_PREAMBLE))
+        except OSError:
+            reply = None
+        if reply != SESSION_PREAMBLE:
+            logger.info(f"{host} does not accept sessions; using one-shot connections")
+            sock.close()
+            return None
+
+        session = Session(
+            sock, window=profile['window'], idle_timeout=SESSION_IDLE_TIMEOUT, name=host,
+            timeout=profile['timeout'], on_close=lambda closed: self._drop(host, closed)
+        )
+        session.request_window()
+        session.start()
+        logger.info(f"Session to {host} established")
+        return session
+
+    def _drop(self, host: str, session: Session):
+        with self._lock:
+            if self._sessions.get(host) is session:
+                del self._sessions[host]
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+# Singleton
+_pool = None
+
+def get_session_pool() -> SessionPool:
+    global _pool
+    if _pool is None:
+        _pool = SessionPool()
+    return _pool
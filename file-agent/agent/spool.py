@@ -0,0 +1,76 @@
+"""Pooled in-memory buffers for relaying small transfers without touching disk"""
+import threading
+from typing import Dict, List, Optional
+from .utils import get_logger, SPOOL_THRESHOLD, SPOOL_MEMORY_BYTES
+
+logger = get_logger('agent.spool')
+
+# Smallest buffer handed out; payloads are rounded up to a power of two
+MIN_BUFFER = 4096
+
+def _size_class(size: int) -> int:
+    return max(MIN_BUFFER, 1 << max(0, (size - 1).bit_length()))
+
+class MemorySpool:
+    """Buffers for relay payloads of at most ``threshold`` bytes.
+
+    Released buffers are kept per size class and reused, so a steady stream
+    of small transfers allocates nothing. Buffers in use plus those pooled
+    never exceed ``capacity``; pooled buffers of other sizes are dropped to
+    make room, and when that is not enough ``acquire`` returns None and the
+    transfer goes to disk as usual.
+    """
+
+    def __init__(self, threshold: int = SPOOL_THRESHOLD, capacity: int = SPOOL_MEMORY_BYTES):
+        self.threshold = threshold
+        self.capacity = capacity
+        self._free: Dict[int, List[bytearray]] = {}
+        self._allocated = 0
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._counters = {'spooled': 0, 'fallbacks': 0}
+
+    def eligible(self, size: int) -> bool:
+        return 0 < self.threshold and size <= self.threshold and _size_class(size) <= self.capacity
+
+    def acquire(self, size: int) -> Optional[bytearray]:
+        """A buffer of at least ``size`` bytes, or None if the cap is reached"""
+        size_class = _size_class(size)
+        with self._lock:
+            pooled = self._free.get(size_class)
+            if pooled:
+                buffer = pooled.pop()
+            else:
+                if self._allocated + size_class > self.capacity:
+                    self._trim(self._allocated + size_class - self.capacity)
+                if self._allocated + size_class > self.capacity:
+                    self._counters['fallbacks'] += 1
+                    return None
+                buffer = bytearray(size_class)
+                self._allocated += size_class
+            self._in_use += size_class
+            self._counters['spooled'] += 1
+            return buffer
+
+    def release(self, buffer: bytearray):
+        with self._lock:
+            self._in_use -= len(buffer)
+            self._free.setdefault(len(buffer), []).append(buffer)
+
+    def _trim(self, needed: int):
+        """Drop pooled buffers, largest first, until ``needed`` bytes are freed"""
+        for size_class in sorted(self._free, reverse=True):
+            pooled = self._free[size_class]
+            while pooled and needed > 0:
+                pooled.pop()
+                self._allocated -= size_class
+                needed -= size_class
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'in_use': self._in_use,
+                'allocated': self._allocated,
+                'capacity': self.capacity,
+                **self._counters
+            }
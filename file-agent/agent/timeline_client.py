@@ -1,18 +1,116 @@
-"""Timeline gRPC client for sending file transfer updates"""
+"""Timeline gRPC client for sending file transfer updates.
+
+Updates are queued and reported by a background thread over
+``StreamTimelineUpdates`` client streams, so a slow or unreachable backend
+never holds up a transfer. A stream stays open while updates keep arriving
+(up to TIMELINE_STREAM_SECONDS) and is only counted as delivered once the
+backend answers it; if it fails, its updates go to an on-disk journal that
+is replayed, in order, ahead of newer updates once the backend is back.
+"""
+import os
+import json
+import time
+import queue
+import threading
 import grpc
-from typing import Optional
-from .utils import get_logger, HOST_NAME, get_timestamp
+from typing import List, Optional
+from .utils import (
+    get_logger, ensure_directory, HOST_NAME, get_timestamp,
+    TIMELINE_QUEUE_SIZE, TIMELINE_FLUSH_INTERVAL, TIMELINE_STREAM_SECONDS, TIMELINE_DEADLINE,
+    TIMELINE_RETRY_MAX, TIMELINE_JOURNAL, TIMELINE_JOURNAL_BYTES
+)
 from proto import timeline_pb2, timeline_pb2_grpc
-import os
 
 logger = get_logger('agent.timeline_client')
 
+STATUSES = {
+    'PENDING': timeline_pb2.Status.PENDING,
+    'DONE': timeline_pb2.Status.DONE,
+    'FAILED': timeline_pb2.Status.FAILED
+}
+
+class TimelineJournal:
+    """Bounded JSON-lines spool of updates the backend has not confirmed.
+
+    When it would grow past ``max_bytes`` the oldest updates are dropped.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def append(self, updates: List[dict]):
+        if not updates:
+            return
+        lines = [json.dumps(update) + '\n' for update in updates]
+        with self._lock:
+            ensure_directory(os.path.dirname(self.path) or '.')
+            with open(self.path, 'a') as f:
+                f.writelines(lines)
+            if os.path.getsize(self.path) > self.max_bytes:
+                self._trim()
+
+    def _trim(self):
+        with open(self.path, 'r') as f:
+            lines = f.readlines()
+        kept = []
+        size = 0
+        for line in reversed(lines):
+            size += len(line)
+            if size > self.max_bytes:
+                break
+            kept.append(line)
+        kept.reverse()
+        logger.warning(f"Timeline journal full; dropped {len(lines) - len(kept)} oldest updates")
+        self._rewrite(kept)
+
+    def _rewrite(self, lines: List[str]):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.path)
+
+    def read(self) -> List[dict]:
+        with self._lock:
+            try:
+                with open(self.path, 'r') as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                return []
+        updates = []
+        for line in lines:
+            try:
+                updates.append(json.loads(line))
+            except ValueError:
+                continue  # torn final line from a crash
+        return updates
+
+    def discard(self, count: int):
+        """Drop the first ``count`` updates once the backend has confirmed them"""
+        with self._lock:
+            try:
+                with open(self.path, 'r') as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                return
+            if count >= len(lines):
+                os.remove(self.path)
+            else:
+                self._rewrite(lines[count:])
+
 class TimelineClient:
-    def __init__(self):
+    def __init__(self, journal_path: str = TIMELINE_JOURNAL):
         self.backend_url = os.getenv('TIMELINE_BACKEND_URL', 'localhost:50053')
         self.channel = None
         self.stub = None
-        
+        self.journal = TimelineJournal(journal_path, TIMELINE_JOURNAL_BYTES)
+        self._queue = queue.Queue(maxsize=TIMELINE_QUEUE_SIZE)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'sent': 0, 'journaled': 0, 'dropped': 0, 'streams': 0}
+
     def connect(self):
         try:
             self.channel = grpc.insecure_channel(self.backend_url)
@@ -21,37 +119,143 @@ class TimelineClient:
             logger.error(f"Failed to connect to timeline service: {e}")
 
     def send_update(
-        self, 
-        transfer_id: str, 
+        self,
+        transfer_id: str,
         hostname: Optional[str] = None,
         status: str = 'PENDING'
     ) -> bool:
+        """Queue an update for the background reporter; never blocks"""
+        self._ensure_reporter()
+        update = {
+            'transfer_id': transfer_id,
+            'hostname': hostname or HOST_NAME,
+            'timestamp': get_timestamp(),
+            'status': status.upper()
+        }
+        try:
+            self._queue.put_nowait(update)
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            logger.error(f"Timeline queue full; dropped {update['status']} for {transfer_id}")
+            return False
+
+    def _ensure_reporter(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='timeline-reporter', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        delay = 0.0
+        while True:
+            backlog = self.journal.read()
+            if not backlog:
+                try:
+                    first = self._queue.get(timeout=TIMELINE_FLUSH_INTERVAL)
+                except queue.Empty:
+                    if self._stopping.is_set():
+                        return
+                    continue
+                pending = [first]
+            else:
+                pending = []
+
+            if self._stream(backlog, pending):
+                delay = 0.0
+                continue
+
+            # Backend unavailable: spool what is queued and wait before retrying
+            delay = min(max(delay * 2, TIMELINE_FLUSH_INTERVAL), TIMELINE_RETRY_MAX)
+            if self._stopping.is_set():
+                self._spool_queue()
+                return
+            deadline = time.monotonic() + delay
+            while time.monotonic() < deadline and not self._stopping.is_set():
+                self._spool_queue()
+                self._stopping.wait(min(TIMELINE_FLUSH_INTERVAL, deadline - time.monotonic()))
+
+    def _stream(self, backlog: List[dict], pending: List[dict]) -> bool:
+        """One client stream: the journal backlog, then queued updates until
+        the queue goes quiet. False if the backend did not confirm it."""
         if not self.stub:
             self.connect()
-        
         if not self.stub:
-            logger.error("No connection to timeline service")
+            self.journal.append(pending)
             return False
-        
+
+        sent = list(pending)
+
+        def requests():
+            for update in backlog + pending:
+                yield self._to_proto(update)
+            opened = time.monotonic()
+            while time.monotonic() - opened < TIMELINE_STREAM_SECONDS:
+                try:
+                    update = self._queue.get(timeout=TIMELINE_FLUSH_INTERVAL)
+                except queue.Empty:
+                    return
+                sent.append(update)
+                yield self._to_proto(update)
+
         try:
-            status_enum = timeline_pb2.Status.DONE if status.upper() == 'DONE' else timeline_pb2.Status.PENDING
-            
-            update = timeline_pb2.TimelineUpdate(
-                transfer_id=transfer_id,
-                hostname=hostname or HOST_NAME,
-                timestamp=get_timestamp(),
-                status=status_enum
+            self.stub.StreamTimelineUpdates(
+                requests(), timeout=TIMELINE_STREAM_SECONDS + TIMELINE_DEADLINE
             )
-            
-            self.stub.SendTimelineUpdate(update)      
         except grpc.RpcError as e:
-            logger.error(f"gRPC error sending timeline update: {e.code()} - {e.details()}")
+            logger.error(f"gRPC error streaming timeline updates: {e.code()} - {e.details()}")
+            self._journal(sent)
             return False
         except Exception as e:
-            logger.error(f"Error sending timeline update: {e}")
+            logger.error(f"Error streaming timeline updates: {e}")
+            self._journal(sent)
             return False
-    
+
+        if backlog:
+            self.journal.discard(len(backlog))
+            logger.info(f"Replayed {len(backlog)} journaled timeline updates")
+        self.stats['sent'] += len(backlog) + len(sent)
+        self.stats['streams'] += 1
+        return True
+
+    def _journal(self, updates: List[dict]):
+        self.journal.append(updates)
+        self.stats['journaled'] += len(updates)
+
+    def _spool_queue(self):
+        updates = []
+        while True:
+            try:
+                updates.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._journal(updates)
+
+    @staticmethod
+    def _to_proto(update: dict):
+        status_enum = STATUSES.get(update['status'], timeline_pb2.Status.PENDING)
+        return timeline_pb2.TimelineUpdate(
+            transfer_id=update['transfer_id'],
+            hostname=update['hostname'],
+            timestamp=update['timestamp'],
+            status=status_enum
+        )
+
+    def flush(self, timeout: float = TIMELINE_DEADLINE):
+        """Stop the reporter, giving it ``timeout`` seconds to deliver what is
+        queued; anything left is journaled for the next run"""
+        self._stopping.set()
+        thread = self._thread
+        if thread and thread.is_alive():
+            thread.join(timeout)
+        if not thread or not thread.is_alive():
+            self._spool_queue()
+
     def close(self):
+        self.flush()
         if self.channel:
             self.channel.close()
             logger.info("Timeline client disconnected")
@@ -0,0 +1,65 @@
+"""Local route search over topology.json, used when the heuristic service
+cannot provide node-disjoint alternatives"""
+import json
+import heapq
+from typing import Dict, List, Optional, Set
+from .utils import get_logger, TOPOLOGY_FILE
+from .links import expected_link
+
+logger = get_logger('agent.topology')
+
+def load_adjacency(path: str = TOPOLOGY_FILE) -> Dict[str, Set[str]]:
+    try:
+        with open(path, 'r') as f:
+            topology = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to load topology {path}: {e}")
+        return {}
+
+    adjacency: Dict[str, Set[str]] = {}
+    for link in topology.get('links', []):
+        source = link.get('source')
+        target = link.get('target')
+        if source and target:
+            adjacency.setdefault(source, set()).add(target)
+            adjacency.setdefault(target, set()).add(source)
+    return adjacency
+
+def local_route(
+    src: str,
+    dst: str,
+    excluded: Set[str],
+    adjacency: Optional[Dict[str, Set[str]]] = None
+) -> Optional[dict]:
+    """Lowest expected-delay path from src to dst that avoids ``excluded``.
+
+    Returns a dict shaped like the heuristic ``RouteResult``.
+    """
+    if adjacency is None:
+        adjacency = load_adjacency()
+
+    queue = [(0.0, src, [src])]
+    best: Dict[str, float] = {src: 0.0}
+    while queue:
+        delay, node, path = heapq.heappop(queue)
+        if node == dst:
+            return route_summary(path)
+        if delay > best.get(node, float('inf')):
+            continue
+        for neighbor in adjacency.get(node, ()):
+            if neighbor in excluded and neighbor != dst:
+                continue
+            next_delay = delay + expected_link(node, neighbor)['delay_ms']
+            if next_delay < best.get(neighbor, float('inf')):
+                best[neighbor] = next_delay
+                heapq.heappush(queue, (next_delay, neighbor, path + [neighbor]))
+    return None
+
+def route_summary(path: List[str]) -> dict:
+    links = [expected_link(a, b) for a, b in zip(path, path[1:])]
+    return {
+        'path': path,
+        'total_delay_ms': sum(link['delay_ms'] for link in links),
+        'min_bandwidth_mbps': min((link['bandwidth_mbps'] for link in links), default=0.0),
+        'hop_count': len(path) - 1
+    }
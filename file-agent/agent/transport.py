@@ -0,0 +1,198 @@
+"""Per-link transport profiles.
+
+A profile sizes what one link needs from the transport: the session stream
+window, socket buffers, the chunk size of copy loops, the I/O timeout, the
+TCP congestion control, and whether payloads go as datagrams instead (see
+datagram.py). It starts from the node types at both ends (the
+metric agent's SAGSIN link model) and, when the metric agent has a fresh
+measurement of the link, from its measured delay and bandwidth instead.
+
+Socket buffers are only set where Linux autotuning would stop short of the
+link's bandwidth-delay product; an explicit SO_SNDBUF/SO_RCVBUF turns
+autotuning off and is capped by ``net.core.[rw]mem_max``, so setting one
+below the autotuning ceiling would only make the window smaller.
+"""
+import socket
+import threading
+from typing import Dict, Optional, Tuple
+from .utils import (
+    get_logger, HOST_NAME, NODE_PORT, NODE_ADDRESSES, CHUNK_SIZE, TRANSFER_TIMEOUT, LINK_PROFILES,
+    SESSION_WINDOW, SESSION_WINDOW_MAX, MAX_CHUNK_SIZE, TIMEOUT_RTTS, HIGH_RTT_MS, TCP_CONGESTION, TCP_CONGESTION_HIGH_RTT
+)
+from .links import expected_link, live_link
+from .datagram import choose as choose_datagram
+
+logger = get_logger('agent.transport')
+
+SYSCTL_DIR = '/proc/sys/net'
+
+_limits = {}
+_logged = {}
+_warned = set()
+_lock = threading.Lock()
+
+def _sysctl_max(name: str) -> Optional[int]:
+    """Last field of a net sysctl (the max of ``tcp_wmem``-style triples)"""
+    if name not in _limits:
+        try:
+            with open(f"{SYSCTL_DIR}/{name}", 'r') as f:
+                _limits[name] = int(f.read().split()[-1])
+        except (OSError, ValueError, IndexError):
+            _limits[name] = None
+    return _limits[name]
+
+def _socket_buffer(bdp: int, kind: str) -> Optional[int]:
+    """Explicit SO_SNDBUF (``kind`` 'w') or SO_RCVBUF ('r') for a link, or
+    None to leave the kernel's autotuning in charge"""
+    autotune = _sysctl_max(f"ipv4/tcp_{kind}mem")
+    cap = _sysctl_max(f"core/{kind}mem_max")
+    want = 2 * bdp
+    if autotune is None or cap is None or want <= autotune:
+        return None
+    # The kernel doubles the requested size to cover its bookkeeping
+    size = min(want, cap)
+    if size * 2 <= autotune:
+        _warn_once(f"{kind}mem", f"Link BDP needs {want} byte socket buffers; raise net.core.{kind}mem_max "
+                                 f"(now {cap}) above net.ipv4.tcp_{kind}mem (max {autotune})")
+        return None
+    return size
+
+def _warn_once(key: str, message: str):
+    with _lock:
+        if key in _warned:
+            return
+        _warned.add(key)
+    logger.warning(message)
+
+def _power_of_two(n: int) -> int:
+    return 1 << max(0, (max(n, 1) - 1).bit_length())
+
+def default_profile(neighbor: str) -> dict:
+    """The global settings, as used with LINK_PROFILES off"""
+    return {
+        'neighbor': neighbor,
+        'source': 'defaults',
+        'rtt_ms': None,
+        'bandwidth_mbps': None,
+        'bdp': None,
+        'window': SESSION_WINDOW,
+        'sndbuf': None,
+        'rcvbuf': None,
+        'chunk_size': CHUNK_SIZE,
+        'timeout': TRANSFER_TIMEOUT,
+        'congestion': TCP_CONGESTION or None,
+        'loss_rate': None,
+        'datagram': choose_datagram({})
+    }
+
+def link_profile(neighbor: str, src: str = HOST_NAME) -> dict:
+    """Transport settings for the link from ``src`` to ``neighbor``"""
+    if not LINK_PROFILES:
+        return default_profile(neighbor)
+
+    link = expected_link(src, neighbor)
+    rtt_ms, bandwidth_mbps, loss_rate = link['delay_ms'], link['bandwidth_mbps'], 0.0
+    expected_loss = link['loss_rate']
+    source = 'node types'
+    live = live_link(neighbor)
+    if live and live.get('available') and live.get('delay_ms', 0) > 0:
+        rtt_ms = live['delay_ms']
+        bandwidth_mbps = live.get('bandwidth_mbps') or bandwidth_mbps
+        loss_rate = expected_loss = live.get('loss_rate') or 0.0
+        source = 'measured'
+
+    # Delays are treated as round-trip times, as in bandwidth_delay_product
+    bdp = int(bandwidth_mbps * 1_000_000 / 8 * rtt_ms / 1000)
+    high_rtt = rtt_ms >= HIGH_RTT_MS or loss_rate >= 0.01
+    profile = {
+        'neighbor': neighbor,
+        'source': source,
+        'rtt_ms': round(rtt_ms, 1),
+        'bandwidth_mbps': round(bandwidth_mbps, 1),
+        'bdp': bdp,
+        'window': max(SESSION_WINDOW, min(_power_of_two(2 * bdp), SESSION_WINDOW_MAX)),
+        'sndbuf': _socket_buffer(bdp, 'w'),
+        'rcvbuf': _socket_buffer(bdp, 'r'),
+        'chunk_size': max(CHUNK_SIZE, min(_power_of_two(bdp // 64), MAX_CHUNK_SIZE)),
+        'timeout': TRANSFER_TIMEOUT + TIMEOUT_RTTS * rtt_ms / 1000,
+        'congestion': (TCP_CONGESTION_HIGH_RTT if high_rtt else TCP_CONGESTION) or None,
+        'loss_rate': round(expected_loss, 4)
+    }
+    profile['datagram'] = choose_datagram(profile)
+    _log_change(profile)
+    return profile
+
+def _log_change(profile: dict):
+    key = (profile['source'], profile['window'], profile['sndbuf'], profile['chunk_size'], profile['congestion'],
+           profile['datagram'])
+    with _lock:
+        if _logged.get(profile['neighbor']) == key:
+            return
+        _logged[profile['neighbor']] = key
+    logger.info(f"Transport profile for {profile['neighbor']} ({profile['source']}: "
+                f"{profile['rtt_ms']} ms, {profile['bandwidth_mbps']} Mbit/s): "
+                f"window {profile['window']}, sndbuf {profile['sndbuf'] or 'auto'}, "
+                f"rcvbuf {profile['rcvbuf'] or 'auto'}, chunk {profile['chunk_size']}, "
+                f"timeout {profile['timeout']:.0f}s, congestion {profile['congestion'] or 'default'}"
+                f"{_datagram_summary(profile['datagram'])}")
+
+def _datagram_summary(datagram: Optional[dict]) -> str:
+    if not datagram:
+        return ''
+    if not datagram['fec']:
+        return ', payload as datagrams'
+    return f", payload as datagrams with {datagram['fec']} FEC ({datagram['group']}+{datagram['parity']})"
+
+def tune_socket(sock: socket.socket, profile: dict):
+    """Apply a profile to a TCP socket; buffer sizes only take full effect
+    before ``connect``, when the window scale is negotiated"""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if profile['sndbuf']:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, profile['sndbuf'])
+    if profile['rcvbuf']:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, profile['rcvbuf'])
+    congestion = profile['congestion']
+    if congestion and hasattr(socket, 'TCP_CONGESTION'):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CONGESTION, congestion.encode())
+        except OSError as e:
+            _warn_once(f"cc-{congestion}", f"TCP congestion control {congestion!r} unavailable: {e}")
+    sock.settimeout(profile['timeout'])
+
+def parse_addresses(text: str) -> Dict[str, Tuple[str, int]]:
+    """``name=host:port`` entries, comma separated"""
+    addresses = {}
+    for entry in filter(None, (part.strip() for part in text.split(','))):
+        name, _, address = entry.partition('=')
+        host, _, port = address.rpartition(':')
+        if not name or not host or not port.isdigit():
+            raise ValueError(f"Invalid NODE_ADDRESSES entry {entry!r}; expected name=host:port")
+        addresses[name.strip()] = (host.strip(), int(port))
+    return addresses
+
+_addresses = parse_addresses(NODE_ADDRESSES)
+
+def node_address(name: str, port: int = NODE_PORT) -> Tuple[str, int]:
+    """Where node ``name`` listens: its NODE_ADDRESSES entry, otherwise the
+    name itself on ``port``"""
+    return _addresses.get(name, (name, port))
+
+def connect(neighbor: str, port: int = NODE_PORT, profile: Optional[dict] = None) -> socket.socket:
+    """A TCP connection to ``neighbor`` tuned for the link"""
+    profile = profile or link_profile(neighbor)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        tune_socket(sock, profile)
+        sock.connect(node_address(neighbor, port))
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+def receive_buffer_size(metadata: dict) -> int:
+    """Receive buffer for a transfer, sized for the link it arrives on"""
+    route = metadata.get('route') or []
+    index = metadata.get('current_index', 0)
+    if not isinstance(index, int) or not 0 < index < len(route):
+        return CHUNK_SIZE
+    return link_profile(route[index - 1])['chunk_size']
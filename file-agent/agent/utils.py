@@ -1,5 +1,4 @@
 import os
-import hashlib
 import logging
 from datetime import datetime
 from typing import Optional
@@ -24,19 +23,29 @@ def get_config(key: str, default: Optional[str] = None) -> str:
         raise ValueError(f"Missing required config: {key}")
     return value
 
-def calculate_md5(file_path: str) -> str:
-    md5_hash = hashlib.md5()
-    try:
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                md5_hash.update(chunk)
-        return md5_hash.hexdigest()
-    except Exception as e:
-        raise Exception(f"Failed to calculate MD5: {e}")
-
 def get_file_size(file_path: str) -> int:
     return os.path.getsize(file_path)
 
+def preallocate(f, size: int) -> None:
+    """Reserve ``size`` bytes for ``f`` (file object or descriptor) where the
+    platform supports it"""
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    fd = f if isinstance(f, int) else f.fileno()
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError:
+        pass
+
+def detach(path: str) -> None:
+    """Unlink ``path`` if it is a hard link (e.g. into the content cache), so
+    rewriting it in place cannot change the other copies"""
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
 def ensure_directory(dir_path: str) -> None:
     os.makedirs(dir_path, exist_ok=True)
 
@@ -52,3 +61,78 @@ ALGORITHM = get_config('ALGORITHM', 'astar')
 CHUNK_SIZE = int(get_config('CHUNK_SIZE', '8192'))
 TRANSFER_TIMEOUT = int(get_config('TRANSFER_TIMEOUT', '30'))
 TIMELINE_BACKEND_URL = get_config('TIMELINE_BACKEND_URL', 'localhost:50053')
+RELAY_MODE = get_config('RELAY_MODE', 'store-and-forward')
+RELAY_TEE = get_config('RELAY_TEE', 'false').lower() == 'true'
+INTEGRITY_MODE = get_config('INTEGRITY_MODE', 'trailer')
+ZERO_COPY = get_config('ZERO_COPY', 'true').lower() == 'true'
+SERVER_MODE = get_config('SERVER_MODE', 'thread')
+LISTEN_BACKLOG = int(get_config('LISTEN_BACKLOG', '128'))
+MAX_CONCURRENT_TRANSFERS = int(get_config('MAX_CONCURRENT_TRANSFERS', '64'))
+CONN_BUFFER_SIZE = int(get_config('CONN_BUFFER_SIZE', '262144'))
+MAX_METADATA_SIZE = int(get_config('MAX_METADATA_SIZE', '65536'))
+STREAM_WINDOW = int(get_config('STREAM_WINDOW', '262144'))
+MAX_PARALLEL_STREAMS = int(get_config('MAX_PARALLEL_STREAMS', '8'))
+MIN_STREAM_BYTES = int(get_config('MIN_STREAM_BYTES', '4194304'))
+RESUME_CHUNK_SIZE = int(get_config('RESUME_CHUNK_SIZE', '4194304'))
+HOP_RETRIES = int(get_config('HOP_RETRIES', '3'))
+RETRY_BACKOFF = float(get_config('RETRY_BACKOFF', '2'))
+TOPOLOGY_FILE = get_config('TOPOLOGY_FILE', '/topology/topology.json')
+ROUTE_CACHE_TTL = float(get_config('ROUTE_CACHE_TTL', '30'))
+ROUTE_CACHE_SIZE = int(get_config('ROUTE_CACHE_SIZE', '256'))
+ROUTE_DEADLINE = float(get_config('ROUTE_DEADLINE', '10'))
+CONNECTION_POOL = get_config('CONNECTION_POOL', 'true').lower() == 'true'
+SESSION_WINDOW = int(get_config('SESSION_WINDOW', '1048576'))
+SESSION_KEEPALIVE = float(get_config('SESSION_KEEPALIVE', '15'))
+SESSION_IDLE_TIMEOUT = float(get_config('SESSION_IDLE_TIMEOUT', '300'))
+COMPRESSION = get_config('COMPRESSION', 'none')
+COMPRESS_CHUNK_SIZE = int(get_config('COMPRESS_CHUNK_SIZE', '1048576'))
+COMPRESS_MIN_SAVING = float(get_config('COMPRESS_MIN_SAVING', '0.1'))
+CONTENT_CACHE_BYTES = int(get_config('CONTENT_CACHE_BYTES', '1073741824'))
+DELTA_TRANSFER = get_config('DELTA_TRANSFER', 'true').lower() == 'true'
+DELTA_MIN_SIZE = int(get_config('DELTA_MIN_SIZE', '1048576'))
+DELTA_BLOCK_SIZE = int(get_config('DELTA_BLOCK_SIZE', '2048'))
+INTEGRITY_HASH = get_config('INTEGRITY_HASH', 'md5')
+HASH_LEAF_SIZE = int(get_config('HASH_LEAF_SIZE', '4194304'))
+HASH_WORKERS = int(get_config('HASH_WORKERS', str(os.cpu_count() or 1)))
+TIMELINE_QUEUE_SIZE = int(get_config('TIMELINE_QUEUE_SIZE', '10000'))
+TIMELINE_FLUSH_INTERVAL = float(get_config('TIMELINE_FLUSH_INTERVAL', '0.5'))
+TIMELINE_STREAM_SECONDS = float(get_config('TIMELINE_STREAM_SECONDS', '30'))
+TIMELINE_DEADLINE = float(get_config('TIMELINE_DEADLINE', '5'))
+TIMELINE_RETRY_MAX = float(get_config('TIMELINE_RETRY_MAX', '30'))
+TIMELINE_JOURNAL = get_config('TIMELINE_JOURNAL', 'timeline-journal.jsonl')
+TIMELINE_JOURNAL_BYTES = int(get_config('TIMELINE_JOURNAL_BYTES', '16777216'))
+BATCH_PACK_THRESHOLD = int(get_config('BATCH_PACK_THRESHOLD', '65536'))
+BATCH_ARCHIVE_BYTES = int(get_config('BATCH_ARCHIVE_BYTES', '67108864'))
+BATCH_PIPELINE_DEPTH = int(get_config('BATCH_PIPELINE_DEPTH', '4'))
+LINK_METRICS_FILE = get_config('LINK_METRICS_FILE', '/tmp/link-metrics.json')
+LINK_METRICS_MAX_AGE = float(get_config('LINK_METRICS_MAX_AGE', '30'))
+SCHEDULER_SLOTS = int(get_config('SCHEDULER_SLOTS', '4'))
+SCHEDULER_PACING = get_config('SCHEDULER_PACING', 'true').lower() == 'true'
+PACING_FACTOR = float(get_config('PACING_FACTOR', '0.95'))
+PACING_BURST = float(get_config('PACING_BURST', '0.1'))
+SCHEDULER_STATS_INTERVAL = float(get_config('SCHEDULER_STATS_INTERVAL', '60'))
+LINK_PROFILES = get_config('LINK_PROFILES', 'true').lower() == 'true'
+SESSION_WINDOW_MAX = int(get_config('SESSION_WINDOW_MAX', '16777216'))
+MAX_CHUNK_SIZE = int(get_config('MAX_CHUNK_SIZE', '1048576'))
+TIMEOUT_RTTS = float(get_config('TIMEOUT_RTTS', '20'))
+HIGH_RTT_MS = float(get_config('HIGH_RTT_MS', '200'))
+TCP_CONGESTION = get_config('TCP_CONGESTION', '')
+TCP_CONGESTION_HIGH_RTT = get_config('TCP_CONGESTION_HIGH_RTT', 'bbr')
+NODE_ADDRESSES = get_config('NODE_ADDRESSES', '')
+RELAY_CACHE_BYTES = int(get_config('RELAY_CACHE_BYTES', '10737418240'))
+RELAY_CACHE_MAX_AGE = float(get_config('RELAY_CACHE_MAX_AGE', '86400'))
+MIN_FREE_BYTES = int(get_config('MIN_FREE_BYTES', '536870912'))
+RELAY_CACHE_STATS_INTERVAL = float(get_config('RELAY_CACHE_STATS_INTERVAL', '60'))
+SPOOL_THRESHOLD = int(get_config('SPOOL_THRESHOLD', '1048576'))
+SPOOL_MEMORY_BYTES = int(get_config('SPOOL_MEMORY_BYTES', '67108864'))
+CUSTODY_QUEUE = get_config('CUSTODY_QUEUE', 'true').lower() == 'true'
+CUSTODY_BACKOFF = float(get_config('CUSTODY_BACKOFF', '5'))
+CUSTODY_MAX_BACKOFF = float(get_config('CUSTODY_MAX_BACKOFF', '300'))
+CUSTODY_REROUTE_AFTER = int(get_config('CUSTODY_REROUTE_AFTER', '3'))
+CUSTODY_MAX_AGE = float(get_config('CUSTODY_MAX_AGE', '86400'))
+DATAGRAM_TRANSPORT = get_config('DATAGRAM_TRANSPORT', 'off').lower()
+DATAGRAM_MIN_LOSS = float(get_config('DATAGRAM_MIN_LOSS', '0.01'))
+DATAGRAM_FEC = get_config('DATAGRAM_FEC', 'auto').lower()
+DATAGRAM_FEC_GROUP = int(get_config('DATAGRAM_FEC_GROUP', '16'))
+DATAGRAM_PACKET_SIZE = int(get_config('DATAGRAM_PACKET_SIZE', '1200'))
+DATAGRAM_RATE_MBPS = float(get_config('DATAGRAM_RATE_MBPS', '10'))
@@ -0,0 +1,125 @@
+"""Latency that custody retries and reroutes add when a relay's next hop is down.
+
+Usage:
+    python benchmarks/bench_custody.py [--size 64K] [--count 20] [--detour 1] [--backoff 0.2]
+
+Agents run in this process on 127.0.0.x. The planned route is
+source → relay → dead → destination, where nothing listens on "dead";
+topology.json also links the relay to the destination through ``--detour``
+other nodes. The relay ACKs each transfer, fails to forward it, takes
+custody and, after CUSTODY_REROUTE_AFTER failed retries, reroutes through
+the detour. The heuristic service is unreachable, so the reroute comes from
+the local topology search.
+
+The same transfers are first sent over the detour directly; the difference
+in time from the relay's PENDING report to the destination's DONE is the
+latency custody added. Retry and reroute counts come from the relay's
+custody queue.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+SOURCE, RELAY, DEAD, DESTINATION = '127.0.0.1', '127.0.0.2', '127.0.0.99', '127.0.0.100'
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='64K')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--detour', type=int, default=1, help='relays on the alternative path')
+    parser.add_argument('--backoff', default='0.2', help='CUSTODY_BACKOFF for the run (s)')
+    parser.add_argument('--port', type=int, default=7331)
+    args = parser.parse_args()
+
+    base = tempfile.mkdtemp(prefix='bench-custody-')
+    detour = [f"127.0.0.{i + 3}" for i in range(args.detour)]
+    links = [(SOURCE, RELAY), (RELAY, DEAD), (DEAD, DESTINATION)]
+    links += list(zip([RELAY] + detour, detour + [DESTINATION]))
+    with open(f'{base}/topology.json', 'w') as f:
+        json.dump({'links': [{'source': a, 'target': b} for a, b in links]}, f)
+    os.environ.update(
+        HOST_NAME=SOURCE, NODE_PORT=str(args.port), TOPOLOGY_FILE=f'{base}/topology.json',
+        HEURISTIC_ADDR='127.0.0.1:1', TIMELINE_BACKEND_URL='127.0.0.1:1', CUSTODY_BACKOFF=args.backoff
+    )
+
+    from agent.node_agent import NodeAgent
+    from agent.sender import FileSender
+
+    arrivals = {}
+    done = {}
+    lock = threading.Lock()
+
+    class TimedAgent(NodeAgent):
+        def _send_timeline_update(self, transfer_id: str, status: str):
+            with lock:
+                arrivals.setdefault(transfer_id, {})[self.host] = time.perf_counter()
+                if status == 'DONE':
+                    done[transfer_id].set()
+
+    agents = {}
+    for host in [RELAY, DESTINATION] + detour:
+        agents[host] = TimedAgent(
+            host=host, port=args.port, receive_dir=f'{base}/{host}/recv', relay_dir=f'{base}/{host}/relay'
+        )
+        threading.Thread(target=agents[host].start, daemon=True).start()
+    time.sleep(0.5)
+
+    os.makedirs(f'{base}/send')
+    sender = FileSender(send_dir=f'{base}/send')
+    size = parse_size(args.size)
+
+    def forward_latencies(route: list) -> list:
+        """Seconds from the relay's PENDING to the destination's DONE"""
+        latencies = []
+        for _ in range(args.count):
+            transfer_id = str(uuid.uuid4())
+            path = f'{base}/send/{transfer_id}.bin'
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size))
+            done[transfer_id] = threading.Event()
+            if not sender._send_to_next_hop(path, f'{transfer_id}.bin', transfer_id, route, 0,
+                                            extra=sender._source_extra(None)):
+                raise RuntimeError("Relay refused the transfer")
+            if not done[transfer_id].wait(120):
+                raise RuntimeError(f"Transfer {transfer_id} was not delivered")
+            os.remove(path)
+            latencies.append(arrivals[transfer_id][DESTINATION] - arrivals[transfer_id][RELAY])
+        return latencies
+
+    direct = forward_latencies([SOURCE, RELAY] + detour + [DESTINATION])
+    custody = forward_latencies([SOURCE, RELAY, DEAD, DESTINATION])
+    stats = agents[RELAY].custody.stats()
+    for agent in agents.values():
+        agent.stop()
+
+    added = [c - percentile(direct, 0.5) for c in custody]
+    with open(f'{base}/results.json', 'w') as f:
+        json.dump({'direct': direct, 'custody': custody, 'stats': stats}, f)
+    print(f"{args.count} transfers of {size} bytes, detour of {args.detour} relays, CUSTODY_BACKOFF={args.backoff}s")
+    print(f"  direct over detour : p50 {percentile(direct, 0.5) * 1000:8.1f} ms  p99 {percentile(direct, 0.99) * 1000:8.1f} ms")
+    print(f"  via custody        : p50 {percentile(custody, 0.5) * 1000:8.1f} ms  p99 {percentile(custody, 0.99) * 1000:8.1f} ms")
+    print(f"  added by custody   : p50 {percentile(added, 0.5) * 1000:8.1f} ms  p99 {percentile(added, 0.99) * 1000:8.1f} ms")
+    print(f"  retries {stats['retries']} ({stats['retries'] / max(1, stats['delivered']):.1f} per transfer), "
+          f"reroutes {stats['reroutes']}, delivered {stats['delivered']}, given up {stats['given_up']}")
+    print(f"  results: {base}/results.json")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Goodput of the datagram transport against TCP across loss rates.
+
+Usage:
+    python benchmarks/bench_datagram.py [--link satellite:ground_station] [--weather stormy]
+                                        [--loss 0,0.01,0.02,0.05,0.1] [--size 2M] [--repeat 1]
+                                        [--output results.json]
+
+For every loss rate, one hop is sent over the emulated link (see
+bench_scenarios.py, which runs each case in a fresh process) as:
+
+    tcp          TCP, with the emulator's default loss model: a lost
+                 segment stalls the stream for one RTT but never slows it
+    tcp-reno     TCP with the emulator also modelling Reno's congestion
+                 window, which halves on every loss event
+    datagram     DATAGRAM_TRANSPORT=on with FEC sized to the loss rate
+    dgram-nofec  DATAGRAM_TRANSPORT=on, DATAGRAM_FEC=none
+    dgram-xor    DATAGRAM_TRANSPORT=on, DATAGRAM_FEC=xor
+
+The link's loss rate is published to the sender as the metric agent would,
+so ``datagram`` picks its parity from it. Reno at 10% loss and 500 ms RTT
+moves well under 1 Mbit/s, so keep ``--size`` small; a hop that outlasts
+the agent's ACK timeout is reported as failed.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_scenarios import run_scenario
+
+VARIANTS = [
+    ('tcp', {}, False),
+    ('tcp-reno', {}, True),
+    ('datagram', {'DATAGRAM_TRANSPORT': 'on'}, False),
+    ('dgram-nofec', {'DATAGRAM_TRANSPORT': 'on', 'DATAGRAM_FEC': 'none'}, False),
+    ('dgram-xor', {'DATAGRAM_TRANSPORT': 'on', 'DATAGRAM_FEC': 'xor'}, False)
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--link', default='satellite:ground_station')
+    parser.add_argument('--weather', default='stormy')
+    parser.add_argument('--loss', default='0,0.01,0.02,0.05,0.1', help='comma-separated loss rates')
+    parser.add_argument('--delay-ms', type=float, help='override the RTT')
+    parser.add_argument('--mbps', type=float, help='override the bandwidth')
+    parser.add_argument('--size', default='2M')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--variants', help='comma-separated subset of ' + ', '.join(v[0] for v in VARIANTS))
+    parser.add_argument('--output', help='write all results as one JSON document')
+    args = parser.parse_args()
+
+    variants = VARIANTS
+    if args.variants:
+        wanted = args.variants.split(',')
+        variants = [v for v in VARIANTS if v[0] in wanted]
+
+    workdir = tempfile.mkdtemp(prefix='bench-datagram-')
+    results = []
+    print(f"{'loss %':>7} " + ' '.join(f"{label:>12}" for label, _, _ in variants) + '   (goodput, Mbit/s)')
+    for loss in (float(x) for x in args.loss.split(',')):
+        row = []
+        for label, env, reno in variants:
+            scenario = {'link': args.link, 'weather': args.weather, 'loss_rate': loss, 'reno': reno}
+            if args.delay_ms is not None:
+                scenario['delay_ms'] = args.delay_ms
+            if args.mbps is not None:
+                scenario['bandwidth_mbps'] = args.mbps
+            result = run_scenario(scenario, f"{label}-{loss}", env, args, workdir)
+            result['variant'] = label
+            results.append(result)
+            row.append(f"{result['goodput_mbps']:.2f}" if result['goodput_mbps'] is not None else 'failed')
+        print(f"{loss * 100:>7.1f} " + ' '.join(f"{cell:>12}" for cell in row), flush=True)
+
+    link = results[0]['link']
+    print(f"{args.link} ({args.weather}): {link['delay_ms']:.0f} ms RTT ± {link['jitter_ms']:.0f} ms, "
+          f"{link['bandwidth_mbps']:.1f} Mbit/s; {args.size} per transfer")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Compare integrity hashes against a plain sequential read of the same file.
+
+Usage:
+    python benchmarks/bench_hash.py [--size 1G] [--hashes md5,blake2b-tree] [--workers 1,4]
+
+The file is read once before timing so every run hits the page cache; the
+"read" row is the floor a verification pass can reach.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('HOST_NAME', 'benchmark')
+
+from agent.hashing import hash_file
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+DEFAULT_HASHES = 'md5,sha256,blake2b,crc32,md5-tree,sha256-tree,blake2b-tree,crc32-tree'
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def make_file(directory: str, size: int) -> str:
+    path = os.path.join(directory, f'payload-{size}.bin')
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            n = min(len(block), remaining)
+            f.write(block[:n])
+            remaining -= n
+    return path
+
+def read_only(path: str):
+    with open(path, 'rb') as f:
+        while f.read(1024 * 1024):
+            pass
+
+def timed(func, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='256M')
+    parser.add_argument('--hashes', default=DEFAULT_HASHES)
+    parser.add_argument('--workers', default=f'1,{os.cpu_count() or 1}')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    workers = sorted({int(w) for w in args.workers.split(',')})
+    with tempfile.TemporaryDirectory() as directory:
+        path = make_file(directory, size)
+        read_only(path)
+
+        baseline = timed(lambda: read_only(path), args.repeat)
+        print(f"{'hash':<16} {'workers':>7} {'seconds':>8} {'MB/s':>8} {'x read':>7}")
+        print(f"{'read':<16} {1:>7} {baseline:>8.3f} {size / baseline / 1e6:>8.0f} {1.0:>7.2f}")
+        for spec in args.hashes.split(','):
+            for count in (workers if spec.endswith('-tree') else [1]):
+                elapsed = timed(lambda: hash_file(path, spec, count), args.repeat)
+                print(f"{spec:<16} {count:>7} {elapsed:>8.3f} {size / elapsed / 1e6:>8.0f} "
+                      f"{elapsed / baseline:>7.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Hop throughput over an emulated high-RTT link, with and without link profiles.
+
+Usage:
+    python benchmarks/bench_link_profile.py [--rtt-ms 500] [--mbps 100] [--size 32M]
+
+A destination NodeAgent listens on 127.0.0.3 behind a delay proxy on
+127.0.0.2 that holds every byte for half the RTT in each direction. The
+link's delay and bandwidth are published the way the metric agent does
+(LINK_METRICS_FILE), so sends are paced to ``--mbps`` in both runs; the
+difference is the transport profile. The proxy terminates TCP, so what it
+shows is the session stream window (application-level flow control), not
+kernel socket buffers; those need a kernel-level emulator such as netem.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+SOURCE, PROXY, DESTINATION = '127.0.0.1', '127.0.0.2', '127.0.0.3'
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def pipe(src: socket.socket, dst: socket.socket, delay: float):
+    """Copy src → dst, delivering each read ``delay`` seconds after it arrived"""
+    pending = queue.Queue()
+
+    def deliver():
+        while True:
+            due, data = pending.get()
+            if data is None:
+                break
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                dst.sendall(data)
+            except OSError:
+                break
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    writer = threading.Thread(target=deliver, daemon=True)
+    writer.start()
+    while True:
+        try:
+            data = src.recv(262144)
+        except OSError:
+            data = b''
+        pending.put((time.monotonic() + delay, data or None))
+        if not data:
+            break
+    writer.join()
+
+def delay_proxy(listen: tuple, target: tuple, one_way: float) -> socket.socket:
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(listen)
+    server.listen(16)
+
+    def serve():
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(target)
+            for a, b in ((client, upstream), (upstream, client)):
+                threading.Thread(target=pipe, args=(a, b, one_way), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server
+
+def run(args) -> dict:
+    """One measured send, in a process configured through the environment"""
+    from agent.node_agent import NodeAgent
+    from agent.sender import FileSender
+    from agent.transport import link_profile
+
+    base = tempfile.mkdtemp()
+    port = int(os.environ['NODE_PORT'])
+    agent = NodeAgent(host=DESTINATION, port=port, receive_dir=f'{base}/recv', relay_dir=f'{base}/relay')
+    threading.Thread(target=agent.start, daemon=True).start()
+    proxy = delay_proxy((PROXY, port), (DESTINATION, port), args.rtt_ms / 2000)
+    time.sleep(0.5)
+
+    size = parse_size(args.size)
+    os.makedirs(f'{base}/send')
+    with open(f'{base}/send/payload.bin', 'wb') as f:
+        f.write(os.urandom(size))
+    sender = FileSender(send_dir=f'{base}/send')
+    start = time.perf_counter()
+    ok = sender._send_to_next_hop(
+        f'{base}/send/payload.bin', 'payload.bin', str(uuid.uuid4()), [SOURCE, PROXY], 0,
+        streams=1, extra=sender._source_extra(None)
+    )
+    elapsed = time.perf_counter() - start
+    proxy.close()
+    agent.stop()
+    return {'ok': ok, 'seconds': elapsed, 'window': link_profile(PROXY)['window']}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rtt-ms', type=float, default=500)
+    parser.add_argument('--mbps', type=float, default=100)
+    parser.add_argument('--size', default='32M')
+    parser.add_argument('--port', type=int, default=7311)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run(args)))
+        return
+
+    metrics_path = os.path.join(tempfile.mkdtemp(), 'link-metrics.json')
+    link = {'delay_ms': args.rtt_ms, 'bandwidth_mbps': args.mbps, 'loss_rate': 0.0, 'available': True}
+    with open(metrics_path, 'w') as f:
+        json.dump({'timestamp': time.time(), 'links': {
+            host: dict(link, neighbor_id=host) for host in (PROXY, SOURCE)
+        }}, f)
+
+    size = parse_size(args.size)
+    print(f"{args.rtt_ms:.0f} ms RTT, paced to {args.mbps:.0f} Mbit/s, {size / 1e6:.0f} MB")
+    print(f"{'profile':<10} {'window':>10} {'seconds':>8} {'MB/s':>8} {'Mbit/s':>8}")
+    for profiles in ('false', 'true'):
+        env = dict(
+            os.environ, HOST_NAME=SOURCE, NODE_PORT=str(args.port), LINK_PROFILES=profiles,
+            LINK_METRICS_FILE=metrics_path, LINK_METRICS_MAX_AGE='86400',
+            TIMELINE_BACKEND_URL='127.0.0.1:1', CONTENT_CACHE_BYTES='0'
+        )
+        child = subprocess.run(
+            [sys.executable, __file__, '--child', '--rtt-ms', str(args.rtt_ms), '--size', args.size,
+             '--port', str(args.port)],
+            env=env, capture_output=True, text=True
+        )
+        lines = child.stdout.strip().splitlines()
+        if child.returncode or not lines:
+            print(child.stderr[-2000:])
+            sys.exit(1)
+        result = json.loads(lines[-1])
+        rate = size / result['seconds']
+        label = 'link' if profiles == 'true' else 'defaults'
+        print(f"{label:<10} {result['window']:>10} {result['seconds']:>8.2f} {rate / 1e6:>8.2f} "
+              f"{rate * 8 / 1e6:>8.1f}{'' if result['ok'] else '  (FAILED)'}")
+
+if __name__ == '__main__':
+    main()
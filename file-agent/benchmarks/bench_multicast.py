@@ -0,0 +1,140 @@
+"""Uplink bytes and delivery time of a multicast send against one send per destination.
+
+Usage:
+    python benchmarks/bench_multicast.py [--destinations 20] [--size 4M] [--mbps 50] [--delay-ms 100]
+
+Agents run in this process on 127.0.0.x: a relay (127.0.0.2) and
+``--destinations`` stations behind it. The source's link to the relay goes
+through a LinkEmulator, standing in for the first satellite hop; the relay
+reaches the stations over plain loopback. Routes come from a stub in place
+of the heuristic service, all through the relay.
+
+The file is sent once with ``send_file_multicast`` and once as concurrent
+``_send_with_retries`` transfers, one per destination, as separate
+``send`` runs would. Reported are the bytes that crossed the emulated
+uplink, the bytes over all edges, and the time until the last
+destination reported DONE.
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from link_emulator import LinkEmulator
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+SOURCE, RELAY = '127.0.0.1', '127.0.0.2'
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--destinations', type=int, default=20)
+    parser.add_argument('--size', default='4M')
+    parser.add_argument('--mbps', type=float, default=50, help='uplink bandwidth')
+    parser.add_argument('--delay-ms', type=float, default=100, help='uplink RTT')
+    parser.add_argument('--port', type=int, default=7351)
+    args = parser.parse_args()
+
+    base = tempfile.mkdtemp(prefix='bench-multicast-')
+    stations = [f"127.0.0.{i + 3}" for i in range(args.destinations)]
+    proxy_port = args.port + 1
+    os.environ.update(
+        HOST_NAME=SOURCE, NODE_PORT=str(args.port), NODE_ADDRESSES=f"{RELAY}=127.0.0.1:{proxy_port}",
+        HEURISTIC_ADDR='127.0.0.1:1', TIMELINE_BACKEND_URL='127.0.0.1:1',
+        CONTENT_CACHE_BYTES='0', DELTA_TRANSFER='false', SPOOL_THRESHOLD='0'
+    )
+
+    from agent.node_agent import NodeAgent
+    from agent.sender import FileSender
+    from agent.grpc_client import get_heuristic_client
+
+    routes = {station: [SOURCE, RELAY, station] for station in stations}
+    get_heuristic_client().find_route = lambda source, destination, algorithm='astar': routes[destination]
+
+    edges = Counter()
+    done = []
+    lock = threading.Lock()
+
+    class CountingAgent(NodeAgent):
+        def _complete_transfer(self, metadata, save_path, is_destination, actual_md5):
+            with lock:
+                edges[(metadata['route'][metadata['current_index'] - 1], self.host)] += metadata['file_size']
+            super()._complete_transfer(metadata, save_path, is_destination, actual_md5)
+
+        def _send_timeline_update(self, transfer_id: str, status: str):
+            if status == 'DONE':
+                with lock:
+                    done.append(time.perf_counter())
+
+    agents = []
+    for host in [RELAY] + stations:
+        agent = CountingAgent(
+            host=host, port=args.port, receive_dir=f'{base}/{host}/recv', relay_dir=f'{base}/{host}/relay'
+        )
+        agents.append(agent)
+        threading.Thread(target=agent.start, daemon=True).start()
+    link = {'name': 'uplink', 'delay_ms': args.delay_ms, 'jitter_ms': 0, 'loss_rate': 0,
+            'bandwidth_mbps': args.mbps}
+    emulator = LinkEmulator(('127.0.0.1', proxy_port), (RELAY, args.port), link).start()
+    time.sleep(0.5)
+
+    os.makedirs(f'{base}/send')
+    size = parse_size(args.size)
+    with open(f'{base}/send/payload.bin', 'wb') as f:
+        f.write(os.urandom(size))
+    sender = FileSender(send_dir=f'{base}/send')
+    sender._send_timeline_update = lambda transfer_id, status: None
+
+    def measure(send) -> dict:
+        edges.clear()
+        done.clear()
+        start = time.perf_counter()
+        ok = send()
+        deadline = time.time() + 600
+        while len(done) < len(stations) and time.time() < deadline:
+            time.sleep(0.01)
+        return {
+            'ok': ok and len(done) == len(stations),
+            'seconds': (max(done) if done else time.perf_counter()) - start,
+            'uplink': edges[(SOURCE, RELAY)],
+            'edges': sum(edges.values())
+        }
+
+    def unicast() -> bool:
+        extra = sender._source_extra(None)
+        with ThreadPoolExecutor(max_workers=len(stations)) as pool:
+            return all(pool.map(
+                lambda station: sender._send_with_retries(
+                    f'{base}/send/payload.bin', 'payload.bin', str(uuid.uuid4()), routes[station], 0, extra=extra
+                ),
+                stations
+            ))
+
+    results = {
+        'multicast': measure(lambda: sender.send_file_multicast('payload.bin', stations)),
+        'unicast': measure(unicast)
+    }
+    emulator.stop()
+    for agent in agents:
+        agent.stop()
+
+    print(f"{args.destinations} destinations behind one relay, {size} bytes, "
+          f"uplink {args.mbps} Mbit/s at {args.delay_ms:.0f} ms RTT")
+    for label, result in results.items():
+        print(f"  {label:<10} uplink {result['uplink'] / 1e6:8.1f} MB  all edges {result['edges'] / 1e6:8.1f} MB  "
+              f"last DONE after {result['seconds']:7.2f} s{'' if result['ok'] else '  (incomplete)'}")
+
+if __name__ == '__main__':
+    main()
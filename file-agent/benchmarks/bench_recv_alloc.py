@@ -0,0 +1,119 @@
+"""Count heap allocations per MB received: recv() loop vs recv_into() buffers.
+
+An "allocation" here is a receive-loop iteration during which the traced
+Python heap grew by at least ALLOC_THRESHOLD bytes (tracemalloc peak above
+the previous mark), which is what a fresh ``bytes`` object per chunk shows
+up as. Smaller growth is the sampler's own bookkeeping and is only counted
+in the byte total.
+
+Usage:
+    python benchmarks/bench_recv_alloc.py [--size 64] [--header 1]   # sizes in MB
+"""
+import os
+import sys
+import socket
+import argparse
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('HOST_NAME', 'benchmark')
+
+from agent.protocol import recv_exact, iter_recv
+from agent.utils import CHUNK_SIZE
+
+MB = 1024 * 1024
+ALLOC_THRESHOLD = 512
+
+class AllocationCounter:
+    """Socket proxy that samples tracemalloc before every receive call"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.allocations = 0
+        self.allocated_bytes = 0
+        tracemalloc.reset_peak()
+        self.mark = tracemalloc.get_traced_memory()[0]
+
+    def _sample(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if peak > self.mark:
+            self.allocated_bytes += peak - self.mark
+            if peak - self.mark >= ALLOC_THRESHOLD:
+                self.allocations += 1
+        tracemalloc.reset_peak()
+        self.mark = current
+
+    def recv(self, n: int) -> bytes:
+        self._sample()
+        return self.sock.recv(n)
+
+    def recv_into(self, buffer, n: int = 0) -> int:
+        self._sample()
+        return self.sock.recv_into(buffer, n)
+
+def legacy_recv_exact(sock, n: int) -> bytes:
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def legacy_receive(sock, size: int, sink):
+    bytes_received = 0
+    while bytes_received < size:
+        chunk = sock.recv(min(CHUNK_SIZE, size - bytes_received))
+        if not chunk:
+            break
+        sink.write(chunk)
+        bytes_received += len(chunk)
+
+def buffered_receive(sock, size: int, sink):
+    buffer = memoryview(bytearray(CHUNK_SIZE))
+    for chunk in iter_recv(sock, size, buffer):
+        sink.write(chunk)
+
+def measure(label: str, size: int, receive) -> None:
+    left, right = socket.socketpair()
+    payload = memoryview(os.urandom(min(size, 4 * MB)))
+
+    def feed():
+        remaining = size
+        while remaining > 0:
+            n = min(len(payload), remaining)
+            right.sendall(payload[:n])
+            remaining -= n
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    counter = AllocationCounter(left)
+    with open(os.devnull, 'wb') as sink:
+        receive(counter, size, sink)
+    counter._sample()
+    feeder.join()
+    left.close()
+    right.close()
+
+    per_mb = size / MB
+    print(f"{label:>22} {counter.allocations / per_mb:>12.1f} {counter.allocated_bytes / per_mb / 1024:>14.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='allocations per MB on the receive path')
+    parser.add_argument('--size', default='64', help='payload size in MB')
+    parser.add_argument('--header', default='1', help='metadata frame size in MB')
+    args = parser.parse_args()
+    size = int(float(args.size) * MB)
+    header = int(float(args.header) * MB)
+
+    tracemalloc.start()
+    print(f"{'path':>22} {'allocs/MB':>12} {'alloc KiB/MB':>14}")
+    measure('payload recv()', size, legacy_receive)
+    measure('payload recv_into()', size, buffered_receive)
+    measure('header data += chunk', header, lambda s, n, _: legacy_recv_exact(s, n))
+    measure('header recv_into()', header, lambda s, n, _: recv_exact(s, n))
+    tracemalloc.stop()
+
+if __name__ == '__main__':
+    main()
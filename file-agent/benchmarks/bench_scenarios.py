@@ -0,0 +1,218 @@
+"""Goodput of hops over emulated SAGSIN links, per link profile.
+
+Usage:
+    python benchmarks/bench_scenarios.py [--scenarios scenarios.json] [--size 8M] [--repeat 3]
+                                         [--variant profiles-off:LINK_PROFILES=false] [--output results.json]
+
+Each scenario is a node-type pair and a weather condition (see
+link_emulator.py). For every scenario and variant a fresh process starts a
+receiving NodeAgent behind a LinkEmulator on loopback and sends ``--size``
+``--repeat`` times. The source and destination are named after their node
+types and the emulated link is published as the metric agent would
+(LINK_METRICS_FILE), so link profiles, stream counts and pacing see the
+same link the emulator imposes. A DatagramEmulator on the same port carries
+datagram payloads (DATAGRAM_TRANSPORT) over the same link.
+
+A scenarios file is a JSON list of objects with ``link`` (e.g.
+``"satellite:ground_station"``) and optionally ``weather``, ``size``,
+``repeat``, ``seed``, ``env``, ``reno`` (model TCP's congestion window)
+and any of the overrides ``delay_ms``, ``jitter_ms``, ``loss_rate``,
+``bandwidth_mbps``. ``--variant
+LABEL:KEY=VALUE,...`` runs every scenario again under extra environment
+settings, so features and tuning can be compared link by link.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import argparse
+import tempfile
+import statistics
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from link_emulator import LinkEmulator, DatagramEmulator, emulated_link
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+DEFAULT_SCENARIOS = [
+    {'link': 'ground_station:ground_station', 'weather': 'clear'},
+    {'link': 'ground_station:drone', 'weather': 'cloudy'},
+    {'link': 'drone:ship', 'weather': 'rainy'},
+    {'link': 'satellite:ground_station', 'weather': 'clear'},
+    {'link': 'satellite:ground_station', 'weather': 'stormy'}
+]
+
+def parse_size(text: str) -> int:
+    text = str(text).strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def parse_variant(text: str) -> tuple:
+    label, _, settings = text.partition(':')
+    env = {}
+    for pair in filter(None, settings.split(',')):
+        key, _, value = pair.partition('=')
+        env[key.strip()] = value.strip()
+    return label, env
+
+def free_port() -> int:
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def scenario_link(scenario: dict) -> dict:
+    src_type, _, dst_type = scenario['link'].partition(':')
+    link = emulated_link(src_type, dst_type or src_type, scenario.get('weather', 'clear'))
+    for key in ('delay_ms', 'jitter_ms', 'loss_rate', 'bandwidth_mbps'):
+        if key in scenario:
+            link[key] = scenario[key]
+    return link
+
+def run(args) -> dict:
+    """Sends over one emulated link, in a process configured through the environment"""
+    from agent.node_agent import NodeAgent
+    from agent.sender import FileSender
+
+    link = json.loads(args.link_json)
+    base = tempfile.mkdtemp()
+    agent_port = free_port()
+    agent = NodeAgent(host='127.0.0.1', port=agent_port, receive_dir=f'{base}/recv', relay_dir=f'{base}/relay')
+    threading.Thread(target=agent.start, daemon=True).start()
+    proxy, target = ('127.0.0.1', args.proxy_port), ('127.0.0.1', agent_port)
+    emulator = LinkEmulator(proxy, target, link, args.seed, reno=args.reno).start()
+    datagrams = DatagramEmulator(proxy, target, link, args.seed).start()
+    time.sleep(0.5)
+
+    os.makedirs(f'{base}/send')
+    with open(f'{base}/send/payload.bin', 'wb') as f:
+        f.write(os.urandom(args.size))
+    sender = FileSender(send_dir=f'{base}/send')
+    route = [os.environ['HOST_NAME'], args.destination]
+    seconds, failures = [], 0
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        ok = sender._send_to_next_hop(
+            f'{base}/send/payload.bin', 'payload.bin', str(uuid.uuid4()), route, 0,
+            extra=sender._source_extra(None)
+        )
+        if ok:
+            seconds.append(time.perf_counter() - start)
+        else:
+            failures += 1
+    emulator.stop()
+    datagrams.stop()
+    agent.stop()
+    stats = emulator.stats()
+    stats['loss_events'] += datagrams.stats()['loss_events']
+    return {'seconds': seconds, 'failures': failures, 'emulator': stats}
+
+def run_scenario(scenario: dict, label: str, env: dict, args, workdir: str) -> dict:
+    link = scenario_link(scenario)
+    src_type, _, dst_type = scenario['link'].partition(':')
+    source, destination = f"{src_type}-src", f"{dst_type or src_type}-dst"
+    size = parse_size(scenario.get('size', args.size))
+    repeat = int(scenario.get('repeat', args.repeat))
+    proxy_port = free_port()
+
+    metrics_path = os.path.join(workdir, f"{link['name']}-{label}.json")
+    measured = {
+        'delay_ms': link['delay_ms'], 'jitter_ms': link['jitter_ms'], 'loss_rate': link['loss_rate'],
+        'bandwidth_mbps': link['bandwidth_mbps'], 'available': True
+    }
+    with open(metrics_path, 'w') as f:
+        json.dump({'timestamp': time.time(), 'links': {
+            host: dict(measured, neighbor_id=host) for host in (source, destination)
+        }}, f)
+
+    child_env = dict(
+        os.environ,
+        HOST_NAME=source,
+        NODE_ADDRESSES=f"{destination}=127.0.0.1:{proxy_port}",
+        LINK_METRICS_FILE=metrics_path,
+        LINK_METRICS_MAX_AGE='86400',
+        TIMELINE_BACKEND_URL='127.0.0.1:1',
+        CONTENT_CACHE_BYTES='0',
+        DELTA_TRANSFER='false',
+        **scenario.get('env', {}),
+        **env
+    )
+    child = subprocess.run(
+        [sys.executable, __file__, '--child', '--link-json', json.dumps(link), '--destination', destination,
+         '--size', str(size), '--repeat', str(repeat), '--proxy-port', str(proxy_port),
+         '--seed', str(scenario.get('seed', args.seed))] + (['--reno'] if scenario.get('reno') else []),
+        env=child_env, capture_output=True, text=True
+    )
+    lines = child.stdout.strip().splitlines()
+    if child.returncode or not lines:
+        raise RuntimeError(f"Scenario {link['name']} ({label}) failed:\n{child.stderr[-3000:]}")
+    result = json.loads(lines[-1])
+    seconds = result['seconds']
+    median = statistics.median(seconds) if seconds else None
+    return {
+        'scenario': link['name'],
+        'variant': label,
+        'link': link,
+        'size': size,
+        'runs': repeat,
+        'failures': result['failures'],
+        'seconds_median': round(median, 3) if median else None,
+        'goodput_mbps': round(size * 8 / median / 1e6, 2) if median else None,
+        'link_utilization': round(size * 8 / median / 1e6 / link['bandwidth_mbps'], 3) if median else None,
+        'loss_events': result['emulator']['loss_events']
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', help='JSON list of scenarios (default: a built-in set)')
+    parser.add_argument('--size', default='8M')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--variant', action='append', default=[], help='LABEL:KEY=VALUE,... (repeatable)')
+    parser.add_argument('--output', help='write all results as one JSON document')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--link-json', help=argparse.SUPPRESS)
+    parser.add_argument('--destination', help=argparse.SUPPRESS)
+    parser.add_argument('--proxy-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--reno', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.size = int(args.size)
+        print(json.dumps(run(args)))
+        return
+
+    scenarios = DEFAULT_SCENARIOS
+    if args.scenarios:
+        with open(args.scenarios) as f:
+            scenarios = json.load(f)
+    variants = [parse_variant(v) for v in args.variant] or [('default', {})]
+
+    workdir = tempfile.mkdtemp(prefix='bench-scenarios-')
+    results = []
+    print(f"{'scenario':<36} {'variant':<14} {'RTT ms':>7} {'loss %':>7} {'link Mbit/s':>11} "
+          f"{'goodput':>8} {'util':>6} {'fails':>5}")
+    for scenario in scenarios:
+        for label, env in variants:
+            result = run_scenario(scenario, label, env, args, workdir)
+            results.append(result)
+            link = result['link']
+            goodput = f"{result['goodput_mbps']:.2f}" if result['goodput_mbps'] is not None else '-'
+            utilization = f"{result['link_utilization']:.0%}" if result['link_utilization'] is not None else '-'
+            print(f"{result['scenario']:<36} {label:<14} {link['delay_ms']:>7.0f} {link['loss_rate'] * 100:>7.2f} "
+                  f"{link['bandwidth_mbps']:>11.1f} {goodput:>8} {utilization:>6} {result['failures']:>5}",
+                  flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
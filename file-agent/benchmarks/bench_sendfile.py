@@ -0,0 +1,91 @@
+"""Compare the zero-copy and read/sendall send paths on loopback.
+
+Usage:
+    python benchmarks/bench_sendfile.py [--sizes 1M,100M,1G] [--repeat 3]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('HOST_NAME', 'benchmark')
+
+from agent.protocol import send_stream
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def make_file(directory: str, size: int) -> str:
+    path = os.path.join(directory, f'payload-{size}.bin')
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            n = min(len(block), remaining)
+            f.write(block[:n])
+            remaining -= n
+    return path
+
+def drain(server: socket.socket, size: int, done: threading.Event):
+    conn, _ = server.accept()
+    buf = bytearray(1024 * 1024)
+    received = 0
+    with conn:
+        while received < size:
+            n = conn.recv_into(buf)
+            if not n:
+                break
+            received += n
+    done.set()
+
+def run_once(path: str, size: int, zero_copy: bool) -> tuple:
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    done = threading.Event()
+    receiver = threading.Thread(target=drain, args=(server, size, done), daemon=True)
+    receiver.start()
+
+    sock = socket.create_connection(server.getsockname())
+    with open(path, 'rb') as f:
+        cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        send_stream(sock, f, size, zero_copy=zero_copy)
+        sock.shutdown(socket.SHUT_WR)
+        done.wait()
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+    sock.close()
+    server.close()
+    return wall, cpu
+
+def main():
+    parser = argparse.ArgumentParser(description='sendfile vs read/sendall on loopback')
+    parser.add_argument('--sizes', default='1M,100M,1G')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'path':>10} {'MB/s':>10} {'sender CPU s':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for text in args.sizes.split(','):
+            size = parse_size(text)
+            path = make_file(tmp, size)
+            for label, zero_copy in (('sendfile', True), ('copy', False)):
+                runs = [run_once(path, size, zero_copy) for _ in range(args.repeat)]
+                wall = min(r[0] for r in runs)
+                cpu = min(r[1] for r in runs)
+                mbps = size / (1024 * 1024) / wall if wall else float('inf')
+                print(f"{text:>8} {label:>10} {mbps:>10.1f} {cpu:>13.3f}")
+            os.remove(path)
+
+if __name__ == '__main__':
+    main()
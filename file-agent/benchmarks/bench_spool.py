@@ -0,0 +1,137 @@
+"""Per-hop latency of small transfers with and without the relay memory spool.
+
+Usage:
+    python benchmarks/bench_spool.py [--sizes 1K,4K,16K,64K,256K,1M] [--relays 2] [--count 50]
+
+A chain of NodeAgents on 127.0.0.2, 127.0.0.3, ... runs in one process per
+variant (SPOOL_THRESHOLD=0 for disk, the default for the spool). The time
+each node reports a transfer (PENDING at relays, DONE at the destination)
+is recorded in-process, so a hop's latency is the gap between consecutive
+nodes: receive, verify and, at the relay it leaves, forward. Every transfer
+carries fresh random bytes, so the content cache never answers for it.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+SOURCE = '127.0.0.1'
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def run(args) -> list:
+    """Every size through one chain of agents, in a process configured through the environment"""
+    from agent.node_agent import NodeAgent
+    from agent.sender import FileSender
+
+    arrivals = {}
+    done = {}
+    lock = threading.Lock()
+
+    class TimedAgent(NodeAgent):
+        def _send_timeline_update(self, transfer_id: str, status: str):
+            with lock:
+                arrivals.setdefault(transfer_id, {})[self.host] = time.perf_counter()
+                if status == 'DONE':
+                    done[transfer_id].set()
+
+    base = tempfile.mkdtemp()
+    route = [SOURCE] + [f"127.0.0.{i + 2}" for i in range(args.relays + 1)]
+    agents = []
+    for host in route[1:]:
+        agent = TimedAgent(
+            host=host, port=int(os.environ['NODE_PORT']), receive_dir=f'{base}/{host}/recv', relay_dir=f'{base}/{host}/relay'
+        )
+        threading.Thread(target=agent.start, daemon=True).start()
+        agents.append(agent)
+    time.sleep(0.5)
+
+    os.makedirs(f'{base}/send')
+    sender = FileSender(send_dir=f'{base}/send')
+    results = []
+    for size in [parse_size(s) for s in args.sizes.split(',')]:
+        hops, totals = [], []
+        for i in range(args.warmup + args.count):
+            transfer_id = str(uuid.uuid4())
+            path = f'{base}/send/{transfer_id}.bin'
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size))
+            done[transfer_id] = threading.Event()
+            start = time.perf_counter()
+            ok = sender._send_to_next_hop(
+                path, f'{transfer_id}.bin', transfer_id, route, 0, extra=sender._source_extra(None)
+            )
+            if not ok or not done[transfer_id].wait(30):
+                raise RuntimeError(f"Transfer of {size} bytes did not complete")
+            os.remove(path)
+            if i < args.warmup:
+                continue
+            times = [start] + [arrivals[transfer_id][host] for host in route[1:]]
+            hops += [b - a for a, b in zip(times, times[1:])]
+            totals.append(times[-1] - start)
+        results.append({
+            'size': size,
+            'hop_p50_ms': round(percentile(hops, 0.5) * 1000, 3),
+            'hop_p99_ms': round(percentile(hops, 0.99) * 1000, 3),
+            'end_to_end_p50_ms': round(percentile(totals, 0.5) * 1000, 3)
+        })
+    for agent in agents:
+        agent.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1K,4K,16K,64K,256K,1M')
+    parser.add_argument('--relays', type=int, default=2)
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--port', type=int, default=7321)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run(args)))
+        return
+
+    variants = {}
+    for label, threshold in (('disk', '0'), ('spool', os.environ.get('SPOOL_THRESHOLD', '1048576'))):
+        env = dict(
+            os.environ, HOST_NAME=SOURCE, NODE_PORT=str(args.port), SPOOL_THRESHOLD=threshold,
+            TIMELINE_BACKEND_URL='127.0.0.1:1'
+        )
+        child = subprocess.run(
+            [sys.executable, __file__, '--child', '--sizes', args.sizes, '--relays', str(args.relays),
+             '--count', str(args.count), '--warmup', str(args.warmup)],
+            env=env, capture_output=True, text=True
+        )
+        lines = child.stdout.strip().splitlines()
+        if child.returncode or not lines:
+            print(child.stderr[-3000:])
+            sys.exit(1)
+        variants[label] = json.loads(lines[-1])
+
+    print(f"{args.relays} relays, {args.count} transfers per size; per-hop latency in ms")
+    print(f"{'size':>8} {'disk p50':>9} {'disk p99':>9} {'spool p50':>10} {'spool p99':>10} {'p50 saved':>10}")
+    for disk, spool in zip(variants['disk'], variants['spool']):
+        saved = 1 - spool['hop_p50_ms'] / disk['hop_p50_ms'] if disk['hop_p50_ms'] else 0
+        print(f"{disk['size']:>8} {disk['hop_p50_ms']:>9.2f} {disk['hop_p99_ms']:>9.2f} "
+              f"{spool['hop_p50_ms']:>10.2f} {spool['hop_p99_ms']:>10.2f} {saved:>10.0%}")
+
+if __name__ == '__main__':
+    main()
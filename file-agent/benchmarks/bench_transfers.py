@@ -0,0 +1,388 @@
+"""End-to-end multi-hop transfer benchmark on one machine.
+
+Usage:
+    python benchmarks/bench_transfers.py [--sizes 1K,1M,64M] [--hops 1,2,4] [--concurrency 1,4]
+                                         [--output results.json] [--baseline old.json]
+
+Starts one ``main.py listen`` process per hop (n1..nN), each on its own
+localhost port, wired together with NODE_ADDRESSES. Routes come from an
+in-process stub AlgorithmStreamService (always n0 → n1 → ... → n<hops>) and
+timeline events go to an in-process stub TimelineService that timestamps
+them on arrival. Each sweep point runs a fresh source process (n0) that
+sends ``--transfers`` files, ``concurrency`` at a time.
+
+For every point one JSON object is printed on stdout:
+
+- ``mb_per_s``: bytes delivered / (last DONE - first send)
+- ``latency_p50_s``/``latency_p99_s``: send start → DONE at the destination
+- ``hop_latency_p50_s``: between consecutive timeline events of a transfer
+- ``cpu_s_per_gb``: CPU of the source and every agent per GB delivered
+- ``peak_rss_mb``: largest agent peak RSS during the point (``source_peak_rss_mb``
+  for the source)
+
+``--baseline`` compares against an earlier ``--output`` file and exits 1
+if MB/s dropped or p99 latency rose by more than ``--tolerance``.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import signal
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from concurrent import futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('HOST_NAME', 'n0')
+
+import grpc
+from proto import algorithm_stream_pb2, algorithm_stream_pb2_grpc, timeline_pb2, timeline_pb2_grpc
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+MAIN = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'main.py'))
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+class RouteStub(algorithm_stream_pb2_grpc.AlgorithmStreamServiceServicer):
+    """Routes along the chain n0 → n1 → ... → nK"""
+
+    def RunAlgorithm(self, request, context):
+        first, last = int(request.src[1:]), int(request.dst[1:])
+        path = [f"n{i}" for i in range(first, last + 1)]
+        yield algorithm_stream_pb2.AlgorithmStreamEvent(
+            run_start=algorithm_stream_pb2.AlgorithmRunStart(algo=request.algo, src=request.src, dst=request.dst)
+        )
+        yield algorithm_stream_pb2.AlgorithmStreamEvent(complete=algorithm_stream_pb2.AlgorithmComplete(
+            algo=request.algo, src=request.src, dst=request.dst,
+            result=algorithm_stream_pb2.RouteResult(path=path, hop_count=len(path) - 1, min_bandwidth_mbps=1000)
+        ))
+
+class TimelineStub(timeline_pb2_grpc.TimelineServiceServicer):
+    """Records (arrival time, hostname, status) per transfer"""
+
+    def __init__(self):
+        self.events = {}
+        self._cond = threading.Condition()
+
+    def _record(self, update):
+        status = timeline_pb2.Status.Name(update.status)
+        with self._cond:
+            self.events.setdefault(update.transfer_id, []).append((time.time(), update.hostname, status))
+            self._cond.notify_all()
+
+    def StreamTimelineUpdates(self, request_iterator, context):
+        for update in request_iterator:
+            self._record(update)
+        return timeline_pb2.TimelineResponse(success=True, message='recorded')
+
+    def SendTimelineUpdate(self, request, context):
+        self._record(request)
+        return timeline_pb2.TimelineResponse(success=True, message='recorded')
+
+    def wait_done(self, transfer_ids: list, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not all(self.done_time(t) for t in transfer_ids):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def done_time(self, transfer_id: str):
+        return next((t for t, _, status in self.events.get(transfer_id, []) if status == 'DONE'), None)
+
+def start_stubs():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=32))
+    timeline = TimelineStub()
+    algorithm_stream_pb2_grpc.add_AlgorithmStreamServiceServicer_to_server(RouteStub(), server)
+    timeline_pb2_grpc.add_TimelineServiceServicer_to_server(timeline, server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    return server, timeline, f"127.0.0.1:{port}"
+
+def free_ports(count: int) -> list:
+    sockets = []
+    for _ in range(count):
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        sockets.append(s)
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+def wait_listening(port: int, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Agent on port {port} did not start")
+
+def process_cpu(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rpartition(')')[2].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+def peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def reset_peak_rss(pid: int):
+    try:
+        with open(f"/proc/{pid}/clear_refs", 'w') as f:
+            f.write('5')
+    except OSError:
+        pass  # the peak then covers the agent's whole life
+
+class Cluster:
+    """Agent processes n1..n<count> and the stub services"""
+
+    def __init__(self, count: int, workdir: str):
+        self.workdir = workdir
+        self.server, self.timeline, self.stub_addr = start_stubs()
+        ports = free_ports(count)
+        self.addresses = ','.join(f"n{i + 1}=127.0.0.1:{port}" for i, port in enumerate(ports))
+        self.agents = []
+        for i, port in enumerate(ports, start=1):
+            node_dir = os.path.join(workdir, f"n{i}")
+            os.makedirs(node_dir)
+            log = open(os.path.join(node_dir, 'agent.log'), 'w')
+            process = subprocess.Popen(
+                [sys.executable, MAIN, 'listen'], cwd=node_dir, stdout=log, stderr=subprocess.STDOUT,
+                env=self.env(f"n{i}", NODE_HOST='127.0.0.1', NODE_PORT=str(port))
+            )
+            self.agents.append((process, node_dir, log))
+        for port in ports:
+            wait_listening(port)
+
+    def env(self, host_name: str, **extra) -> dict:
+        return dict(
+            os.environ,
+            HOST_NAME=host_name,
+            NODE_ADDRESSES=self.addresses,
+            HEURISTIC_ADDR=self.stub_addr,
+            TIMELINE_BACKEND_URL=self.stub_addr,
+            # Every transfer is new content: no dedup or deltas against earlier points
+            CONTENT_CACHE_BYTES='0',
+            DELTA_TRANSFER='false',
+            LINK_METRICS_FILE=os.path.join(self.workdir, 'no-link-metrics.json'),
+            **extra
+        )
+
+    def pids(self, hops: int) -> list:
+        return [process.pid for process, _, _ in self.agents[:hops]]
+
+    def clean(self):
+        for _, node_dir, _ in self.agents:
+            for name in ('receive-file', 'relay-cache'):
+                shutil.rmtree(os.path.join(node_dir, name), ignore_errors=True)
+                os.makedirs(os.path.join(node_dir, name))
+
+    def stop(self):
+        for process, _, _ in self.agents:
+            process.send_signal(signal.SIGINT)
+        for process, _, log in self.agents:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+        self.server.stop(0)
+
+def run_point(cluster: Cluster, source_dir: str, size: int, hops: int, concurrency: int, transfers: int) -> dict:
+    pids = cluster.pids(hops)
+    for pid in pids:
+        reset_peak_rss(pid)
+    cpu_before = sum(process_cpu(pid) for pid in pids)
+
+    child = subprocess.run(
+        [sys.executable, __file__, '--source', '--size', str(size), '--destination', f"n{hops}",
+         '--concurrency', str(concurrency), '--transfers', str(transfers)],
+        cwd=source_dir, env=cluster.env('n0'), capture_output=True, text=True
+    )
+    lines = child.stdout.strip().splitlines()
+    if child.returncode or not lines:
+        raise RuntimeError(f"Source failed:\n{child.stderr[-3000:]}")
+    source = json.loads(lines[-1])
+    starts = source['starts']
+
+    # Destinations report DONE after the source has already returned
+    complete = cluster.timeline.wait_done(list(starts), timeout=60 + size * transfers / 20e6)
+    cpu = sum(process_cpu(pid) for pid in pids) - cpu_before + source['cpu_s']
+    peak = max(peak_rss_mb(pid) for pid in pids)
+
+    latencies, hop_latencies, done_times = [], [], []
+    for transfer_id, start in starts.items():
+        done = cluster.timeline.done_time(transfer_id)
+        if done is None:
+            continue
+        done_times.append(done)
+        latencies.append(done - start)
+        arrivals = {host: t for t, host, _ in cluster.timeline.events[transfer_id]}
+        times = [start] + [arrivals.get(f"n{i}") for i in range(1, hops + 1)]
+        hop_latencies += [b - a for a, b in zip(times, times[1:]) if a is not None and b is not None]
+
+    delivered = size * len(done_times)
+    elapsed = (max(done_times) - min(starts.values())) if done_times else None
+    cluster.clean()
+    return {
+        'size': size,
+        'hops': hops,
+        'concurrency': concurrency,
+        'transfers': len(starts),
+        'delivered': len(done_times),
+        'complete': complete and source['ok'] == len(starts),
+        'mb_per_s': round(delivered / elapsed / 1e6, 3) if elapsed else None,
+        'latency_p50_s': round(percentile(latencies, 0.5), 4) if latencies else None,
+        'latency_p99_s': round(percentile(latencies, 0.99), 4) if latencies else None,
+        'hop_latency_p50_s': round(percentile(hop_latencies, 0.5), 4) if hop_latencies else None,
+        'cpu_s_per_gb': round(cpu / (delivered / 1e9), 2) if delivered else None,
+        'peak_rss_mb': round(peak, 1),
+        'source_peak_rss_mb': source['peak_rss_mb']
+    }
+
+def run_source(args):
+    """Send ``--transfers`` copies of one payload from n0 and report start times"""
+    from agent.sender import FileSender
+    from agent.timeline_client import get_timeline_client
+
+    send_dir = 'send-file'
+    os.makedirs(send_dir, exist_ok=True)
+    payload = os.path.join(send_dir, f"payload-{args.size}.bin")
+    if not os.path.exists(payload):
+        with open(payload, 'wb') as f:
+            remaining = args.size
+            while remaining > 0:
+                f.write(os.urandom(min(remaining, 1024 * 1024)))
+                remaining -= min(remaining, 1024 * 1024)
+    # Distinct names so concurrent transfers never share a relay path
+    names = []
+    for _ in range(args.transfers):
+        name = f"t-{uuid.uuid4().hex[:12]}.bin"
+        os.link(payload, os.path.join(send_dir, name))
+        names.append(name)
+
+    sender = FileSender(send_dir=send_dir)
+    starts = {}
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    def send(name: str) -> bool:
+        transfer_id = str(uuid.uuid4())
+        starts[transfer_id] = time.time()
+        return sender.send_file_to_destination(name, args.destination, transfer_id=transfer_id)
+
+    with futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(send, names))
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    get_timeline_client().close()
+    for name in names:
+        os.remove(os.path.join(send_dir, name))
+
+    print(json.dumps({
+        'starts': starts,
+        'ok': sum(results),
+        'cpu_s': (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime),
+        'peak_rss_mb': round(after.ru_maxrss / 1024, 1)
+    }))
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    with open(baseline_path) as f:
+        baseline = {(r['size'], r['hops'], r['concurrency']): r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        old = baseline.get((result['size'], result['hops'], result['concurrency']))
+        if not old:
+            continue
+        if old['mb_per_s'] and result['mb_per_s'] is not None and result['mb_per_s'] < old['mb_per_s'] * (1 - tolerance):
+            regressions.append(f"{result['size']}B x{result['hops']} hops c{result['concurrency']}: "
+                               f"{old['mb_per_s']} → {result['mb_per_s']} MB/s")
+        if old['latency_p99_s'] and result['latency_p99_s'] is not None \
+                and result['latency_p99_s'] > old['latency_p99_s'] * (1 + tolerance):
+            regressions.append(f"{result['size']}B x{result['hops']} hops c{result['concurrency']}: "
+                               f"p99 {old['latency_p99_s']} → {result['latency_p99_s']} s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1K,1M,64M', help='file sizes, 1K up to 2G')
+    parser.add_argument('--hops', default='1,2,4')
+    parser.add_argument('--concurrency', default='1,4')
+    parser.add_argument('--transfers', type=int, default=8, help='transfers per point')
+    parser.add_argument('--max-bytes', default='1G', help='fewer transfers for large files (at least concurrency)')
+    parser.add_argument('--output', help='write all results as one JSON document')
+    parser.add_argument('--baseline', help='earlier --output to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--source', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--destination', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.source:
+        args.concurrency = int(args.concurrency)
+        run_source(args)
+        return
+
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    hop_counts = [int(h) for h in args.hops.split(',')]
+    concurrencies = [int(c) for c in args.concurrency.split(',')]
+    max_bytes = parse_size(args.max_bytes)
+
+    workdir = tempfile.mkdtemp(prefix='bench-transfers-')
+    cluster = Cluster(max(hop_counts), workdir)
+    source_dir = os.path.join(workdir, 'n0')
+    os.makedirs(source_dir)
+    results = []
+    try:
+        for size in sizes:
+            for hops in hop_counts:
+                for concurrency in concurrencies:
+                    transfers = max(concurrency, min(args.transfers, max_bytes // size))
+                    result = run_point(cluster, source_dir, size, hops, concurrency, transfers)
+                    results.append(result)
+                    print(json.dumps(result), flush=True)
+    finally:
+        cluster.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'cpu_count': os.cpu_count(),
+                'python': sys.version.split()[0],
+                'results': results
+            }, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+"""Userspace SAGSIN link emulator for loopback benchmarks.
+
+Usage:
+    python benchmarks/link_emulator.py --listen 127.0.0.1:7100 --target 127.0.0.1:7000 \\
+        --link satellite:ground_station --weather stormy [--udp] [--seed 1]
+
+Sits between two agents (or any two endpoints) and imposes a link drawn
+from the metric agent's tables: ``LINK_DELAYS`` and ``BANDWIDTH_RANGES`` by
+node-type pair, ``JITTER_RATIOS`` and ``BASE_LOSS_RATES`` by node type, all
+scaled by ``WEATHER_IMPACT``, as calculate_realistic_link_metrics does.
+Ranges are taken at their midpoint; ``--delay-ms``/``--jitter-ms``/
+``--loss``/``--mbps`` override single values. No root or netem needed.
+
+TCP mode terminates the connection on both sides. Bytes are serialized at
+the link bandwidth, then held for half the RTT plus gaussian jitter in each
+direction, in order. A TCP stream cannot lose bytes, so loss is modelled
+by its effect on TCP: a lost segment (1448 bytes, each lost independently)
+stalls delivery for one RTT while it is retransmitted, at most once per RTT.
+That alone never slows the sender down; ``--reno`` also models TCP Reno's
+congestion window, so no more than cwnd bytes are in flight: slow start from ten segments, halved on each loss event, then grown by
+one segment per RTT. UDP mode relays datagrams for one client and really drops, delays and
+reorders them.
+"""
+import os
+import sys
+import time
+import heapq
+import random
+import socket
+import argparse
+import itertools
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'metric-agent'))
+os.environ.setdefault('HOST_NAME', 'link-emulator')
+
+from network.utils import (
+    LINK_DELAYS, BANDWIDTH_RANGES, JITTER_RATIOS, BASE_LOSS_RATES, WEATHER_IMPACT, WEATHER_CONDITIONS
+)
+
+MSS = 1448
+READ_SIZE = 16 * 1024
+MAX_LOSS = 0.10
+INITIAL_CWND = 10 * MSS
+UDP_BUFFER = 4 * 1024 * 1024
+
+def _pair_lookup(table: dict, src_type: str, dst_type: str, default: tuple) -> tuple:
+    return table.get((src_type, dst_type)) or table.get((dst_type, src_type)) or default
+
+def _midpoint(bounds: tuple) -> float:
+    return (bounds[0] + bounds[1]) / 2
+
+def emulated_link(src_type: str, dst_type: str, weather: str = 'clear') -> dict:
+    """Delay (RTT, ms), jitter (ms), loss rate and bandwidth (Mbit/s) of a
+    typical link between two node types in the given weather"""
+    if weather not in WEATHER_IMPACT:
+        raise ValueError(f"Unknown weather {weather!r}; expected one of {', '.join(WEATHER_CONDITIONS)}")
+    impact = WEATHER_IMPACT[weather]
+    delay_ms = _midpoint(_pair_lookup(LINK_DELAYS, src_type, dst_type, (50, 250))) * impact['delay']
+    jitter_ratio = max(JITTER_RATIOS.get(t, JITTER_RATIOS['unknown']) for t in (src_type, dst_type))
+    loss = max(_midpoint(BASE_LOSS_RATES.get(t, BASE_LOSS_RATES['unknown'])) for t in (src_type, dst_type))
+    bandwidth = _midpoint(_pair_lookup(BANDWIDTH_RANGES, src_type, dst_type, (10, 100))) * impact['bandwidth']
+    return {
+        'name': f"{src_type}-{dst_type}-{weather}",
+        'delay_ms': round(delay_ms, 1),
+        'jitter_ms': round(delay_ms * jitter_ratio * impact['jitter'], 1),
+        'loss_rate': round(min(loss * impact['loss'], MAX_LOSS), 4),
+        'bandwidth_mbps': round(bandwidth, 1)
+    }
+
+class Direction:
+    """Timing of one direction of a link: serialization at the bandwidth,
+    propagation delay with jitter, and loss; with ``reno`` a stream's bytes
+    in flight are also held to a Reno congestion window"""
+
+    def __init__(self, link: dict, rng: random.Random, reno: bool = False):
+        self.rate = link['bandwidth_mbps'] * 1_000_000 / 8
+        self.one_way = link['delay_ms'] / 2000
+        self.rtt = link['delay_ms'] / 1000
+        self.jitter = link['jitter_ms'] / 2000
+        self.loss = link['loss_rate']
+        self.rng = rng
+        self.reno = reno
+        self.cwnd = INITIAL_CWND
+        self.ssthresh = float('inf')
+        # Past twice the BDP a bigger window only fills the bottleneck queue
+        self.max_cwnd = max(2 * self.rate * self.rtt, INITIAL_CWND)
+        self.link_free = 0.0
+        self.last_due = 0.0
+        self.recovering_until = 0.0
+        self.sent = 0
+        self.dropped = 0
+
+    def _serialize(self, nbytes: int, now: float) -> float:
+        self.link_free = max(self.link_free, now) + nbytes / self.rate
+        self.sent += nbytes
+        return self.link_free
+
+    def _propagate(self) -> float:
+        return max(0.0, self.one_way + self.rng.gauss(0, self.jitter)) if self.jitter else self.one_way
+
+    def stream_due(self, nbytes: int, now: float) -> float:
+        """When bytes of an in-order stream arrive"""
+        due = self._serialize(nbytes, now) + self._propagate()
+        lost = False
+        if self.loss:
+            segments = -(-nbytes // MSS)
+            lost = self.rng.random() < 1 - (1 - self.loss) ** segments and due >= self.recovering_until
+            if lost:
+                self.dropped += 1
+                due += self.rtt
+                self.recovering_until = due + self.rtt
+        if self.reno:
+            self._grow_window(nbytes, lost)
+        self.last_due = max(self.last_due, due)
+        return self.last_due
+
+    def in_flight_limit(self, queue_bytes: int) -> float:
+        """Bytes of a stream that may be queued or in flight at once"""
+        return min(queue_bytes, self.cwnd) if self.reno else queue_bytes
+
+    def _grow_window(self, nbytes: int, lost: bool):
+        if lost:
+            self.ssthresh = max(self.cwnd / 2, 2 * MSS)
+            self.cwnd = self.ssthresh
+        elif self.cwnd < self.ssthresh:
+            self.cwnd += nbytes
+        else:
+            self.cwnd += MSS * nbytes / self.cwnd
+        self.cwnd = min(self.cwnd, self.max_cwnd)
+
+    def datagram_due(self, nbytes: int, now: float):
+        """When a datagram arrives, or None if it is lost"""
+        if self.loss and self.rng.random() < self.loss:
+            self.dropped += 1
+            return None
+        return self._serialize(nbytes, now) + self._propagate()
+
+class Delivery:
+    """Hands queued data to its destination when it falls due"""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def put(self, due: float, action, *args):
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), action, args))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    if self._closed and not self._heap:
+                        return
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, action, args = heapq.heappop(self._heap)
+            action(*args)
+
+class StreamPipe:
+    """One direction of a proxied TCP connection; at most ``queue_bytes``
+    are held, so the sender is pushed back as by a bottleneck router"""
+
+    def __init__(self, src: socket.socket, dst: socket.socket, direction: Direction, queue_bytes: int):
+        self.src, self.dst, self.direction = src, dst, direction
+        self.queue_bytes = queue_bytes
+        self.queued = 0
+        self.failed = False
+        self._cond = threading.Condition()
+        self._delivery = Delivery()
+
+    def run(self):
+        while True:
+            try:
+                data = self.src.recv(READ_SIZE)
+            except OSError:
+                data = b''
+            if not data or self.failed:
+                self._delivery.put(self.direction.last_due, self._shutdown)
+                self._delivery.close()
+                return
+            with self._cond:
+                while self.queued >= self.direction.in_flight_limit(self.queue_bytes):
+                    self._cond.wait()
+                self.queued += len(data)
+            self._delivery.put(self.direction.stream_due(len(data), time.monotonic()), self._deliver, data)
+
+    def _deliver(self, data: bytes):
+        if not self.failed:
+            try:
+                self.dst.sendall(data)
+            except OSError:
+                self.failed = True
+        with self._cond:
+            self.queued -= len(data)
+            self._cond.notify()
+
+    def _shutdown(self):
+        try:
+            self.dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+class LinkEmulator:
+    """TCP proxy from ``listen`` to ``target`` over an emulated link"""
+
+    def __init__(
+        self, listen: tuple, target: tuple, link: dict, seed: int = None, queue_bytes: int = None, reno: bool = False
+    ):
+        self.target = target
+        self.link = link
+        self.reno = reno
+        self.rng = random.Random(seed)
+        bdp = int(link['bandwidth_mbps'] * 1_000_000 / 8 * link['delay_ms'] / 1000)
+        self.queue_bytes = queue_bytes or max(bdp, 1024 * 1024)
+        self.directions = []
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(listen)
+        self.server.listen(64)
+        self.address = self.server.getsockname()
+
+    def start(self) -> 'LinkEmulator':
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.close()
+
+    def stats(self) -> dict:
+        return {
+            'bytes': sum(d.sent for d in self.directions),
+            'loss_events': sum(d.dropped for d in self.directions)
+        }
+
+    def _serve(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            try:
+                upstream = socket.create_connection(self.target)
+            except OSError:
+                client.close()
+                continue
+            for a, b in ((client, upstream), (upstream, client)):
+                a.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                direction = Direction(self.link, random.Random(self.rng.random()), self.reno)
+                self.directions.append(direction)
+                pipe = StreamPipe(a, b, direction, self.queue_bytes)
+                threading.Thread(target=pipe.run, daemon=True).start()
+
+class DatagramEmulator:
+    """UDP relay from ``listen`` to ``target`` for one client at a time;
+    replies go back to whoever sent last"""
+
+    def __init__(self, listen: tuple, target: tuple, link: dict, seed: int = None):
+        self.target = target
+        self.link = link
+        rng = random.Random(seed)
+        self.forward = Direction(link, random.Random(rng.random()))
+        self.backward = Direction(link, random.Random(rng.random()))
+        self.directions = [self.forward, self.backward]
+        self.front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # A burst queued in the kernel must not be dropped before the link sees it
+        for sock in (self.front, self.back):
+            for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                sock.setsockopt(socket.SOL_SOCKET, option, UDP_BUFFER)
+        self.front.bind(listen)
+        self.back.connect(target)
+        self.address = self.front.getsockname()
+        self.client = None
+        self._delivery = Delivery()
+
+    def start(self) -> 'DatagramEmulator':
+        threading.Thread(target=self._relay_forward, daemon=True).start()
+        threading.Thread(target=self._relay_backward, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.front.close()
+        self.back.close()
+        self._delivery.close()
+
+    def stats(self) -> dict:
+        return {
+            'bytes': sum(d.sent for d in self.directions),
+            'loss_events': sum(d.dropped for d in self.directions)
+        }
+
+    def _send(self, sock: socket.socket, data: bytes, address=None):
+        try:
+            if address is None:
+                sock.send(data)
+            else:
+                sock.sendto(data, address)
+        except OSError:
+            pass
+
+    def _relay_forward(self):
+        while True:
+            try:
+                data, self.client = self.front.recvfrom(65536)
+            except OSError:
+                return
+            due = self.forward.datagram_due(len(data), time.monotonic())
+            if due is not None:
+                self._delivery.put(due, self._send, self.back, data)
+
+    def _relay_backward(self):
+        while True:
+            try:
+                data = self.back.recv(65536)
+            except OSError:
+                return
+            due = self.backward.datagram_due(len(data), time.monotonic())
+            if due is not None and self.client:
+                self._delivery.put(due, self._send, self.front, data, self.client)
+
+def parse_address(text: str) -> tuple:
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+def add_link_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--link', default='satellite:ground_station', help='node-type pair, e.g. drone:ship')
+    parser.add_argument('--weather', default='clear', choices=WEATHER_CONDITIONS)
+    parser.add_argument('--delay-ms', type=float, help='override the RTT')
+    parser.add_argument('--jitter-ms', type=float)
+    parser.add_argument('--loss', type=float, help='override the loss rate (0-1)')
+    parser.add_argument('--mbps', type=float, help='override the bandwidth')
+
+def link_from_args(args) -> dict:
+    src_type, _, dst_type = args.link.partition(':')
+    link = emulated_link(src_type, dst_type or src_type, args.weather)
+    for key, value in (('delay_ms', args.delay_ms), ('jitter_ms', args.jitter_ms),
+                       ('loss_rate', args.loss), ('bandwidth_mbps', args.mbps)):
+        if value is not None:
+            link[key] = value
+    return link
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--listen', required=True, help='host:port to accept on')
+    parser.add_argument('--target', required=True, help='host:port to forward to')
+    parser.add_argument('--udp', action='store_true', help='relay datagrams instead of TCP')
+    parser.add_argument('--reno', action='store_true', help='model the TCP congestion window too')
+    parser.add_argument('--seed', type=int)
+    add_link_arguments(parser)
+    args = parser.parse_args()
+
+    link = link_from_args(args)
+    if args.udp:
+        emulator = DatagramEmulator(parse_address(args.listen), parse_address(args.target), link, args.seed)
+    else:
+        emulator = LinkEmulator(parse_address(args.listen), parse_address(args.target), link, args.seed, reno=args.reno)
+    emulator.start()
+    print(f"{link['name']}: {link['delay_ms']} ms RTT ± {link['jitter_ms']} ms, "
+          f"{link['loss_rate'] * 100:.2f}% loss, {link['bandwidth_mbps']} Mbit/s; "
+          f"{args.listen} → {args.target}{' (udp)' if args.udp else ''}", flush=True)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        emulator.stop()
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,52 @@
 import sys
+import time
 import argparse
-from agent import get_node_agent, get_file_sender, get_logger
+from typing import List, Optional
+from agent import get_node_agent, get_async_node_agent, get_file_sender, get_timeline_client, get_logger
+from agent.utils import SERVER_MODE, COMPRESSION, BATCH_PACK_THRESHOLD
+from agent.scheduler import PRIORITIES, DEFAULT_PRIORITY
 
 logger = get_logger('main')
 
-def cmd_listen():
-    agent = get_node_agent()
+def cmd_listen(server: str = SERVER_MODE):
+    agent = get_async_node_agent() if server == 'asyncio' else get_node_agent()
     try:
         agent.start()
     except KeyboardInterrupt:
         logger.info("\nInterrupt received in main")
     finally:
         agent.stop()
+        get_timeline_client().close()
         logger.info("Goodbye!")
 
-def cmd_send(filename: str, destination: str, algorithm: str = 'astar'):
-    logger.info(f"Sending file: {filename} → {destination} ({algorithm})")
-    
+def cmd_send(
+    filename: str,
+    destination: str,
+    algorithm: str = 'astar',
+    streams: Optional[int] = None,
+    resume: Optional[str] = None,
+    paths: int = 1,
+    compression: str = COMPRESSION,
+    priority: Optional[str] = None,
+    deadline: Optional[float] = None
+):
     sender = get_file_sender()
-    success = sender.send_file_to_destination(filename, destination, algorithm)
+    if resume:
+        success = sender.resume_transfer(resume)
+    elif paths > 1:
+        logger.info(f"Sending file: {filename} → {destination} ({algorithm}, {paths} paths)")
+        success = sender.send_file_multipath(
+            filename, destination, algorithm, paths=paths, compression=compression,
+            priority=priority, deadline=deadline
+        )
+    else:
+        logger.info(f"Sending file: {filename} → {destination} ({algorithm})")
+        success = sender.send_file_to_destination(
+            filename, destination, algorithm, streams=streams, compression=compression,
+            priority=priority, deadline=deadline
+        )
+    # Give queued timeline updates a chance to reach the backend
+    get_timeline_client().close()
     
     if success:
         logger.info("File transfer initiated successfully")
@@ -27,6 +55,56 @@ def cmd_send(filename: str, destination: str, algorithm: str = 'astar'):
         logger.error("File transfer failed")
         sys.exit(1)
 
+def cmd_batch(
+    destination: str,
+    patterns: List[str],
+    algorithm: str = 'astar',
+    pack_threshold: int = BATCH_PACK_THRESHOLD,
+    compression: str = COMPRESSION,
+    priority: Optional[str] = None,
+    deadline: Optional[float] = None
+):
+    sender = get_file_sender()
+    logger.info(f"Sending batch: {' '.join(patterns)} → {destination} ({algorithm})")
+    success = sender.send_batch(
+        patterns, destination, algorithm, pack_threshold=pack_threshold, compression=compression,
+        priority=priority, deadline=deadline
+    )
+    get_timeline_client().close()
+    
+    if success:
+        logger.info("Batch transfer completed successfully")
+        sys.exit(0)
+    else:
+        logger.error("Batch transfer failed")
+        sys.exit(1)
+
+def cmd_multicast(
+    filename: str,
+    destinations: List[str],
+    algorithm: str = 'astar',
+    compression: str = COMPRESSION,
+    priority: Optional[str] = None,
+    deadline: Optional[float] = None
+):
+    sender = get_file_sender()
+    logger.info(f"Sending file: {filename} → {', '.join(destinations)} ({algorithm}, multicast)")
+    success = sender.send_file_multicast(
+        filename, destinations, algorithm, compression=compression, priority=priority, deadline=deadline
+    )
+    get_timeline_client().close()
+    
+    if success:
+        logger.info("Multicast transfer initiated successfully")
+        sys.exit(0)
+    else:
+        logger.error("Multicast transfer failed")
+        sys.exit(1)
+
+def deadline_from(seconds: Optional[float]) -> Optional[float]:
+    """A relative ``--deadline`` as the absolute time carried in metadata"""
+    return time.time() + seconds if seconds is not None else None
+
 def main():
     parser = argparse.ArgumentParser(
         description='SAGSIN File Agent - Hop-by-hop file transfer'
@@ -35,12 +113,53 @@ def main():
     subparsers = parser.add_subparsers(dest='command', help='Commands')
     
     parser_listen = subparsers.add_parser('listen', help='Start listening for incoming files')
+    parser_listen.add_argument('--server', default=SERVER_MODE, choices=['thread', 'asyncio'],
+                             help=f'Server implementation (default: {SERVER_MODE})')
     
     parser_send = subparsers.add_parser('send', help='Send a file to destination')
-    parser_send.add_argument('filename', help='Filename in send-file directory')
-    parser_send.add_argument('destination', help='Destination node name')
+    parser_send.add_argument('filename', nargs='?', help='Filename in send-file directory')
+    parser_send.add_argument('destination', nargs='?', help='Destination node name')
     parser_send.add_argument('--algo', default='astar', choices=['astar', 'dijkstra', 'greedy'],
                            help='Routing algorithm (default: astar)')
+    parser_send.add_argument('--streams', type=int, default=None,
+                           help='Parallel connections per hop (default: derived from link delay/bandwidth)')
+    parser_send.add_argument('--paths', type=int, default=1,
+                           help='Stripe the file across up to K node-disjoint routes (default: 1)')
+    parser_send.add_argument('--compress', default=COMPRESSION, metavar='CODEC[:LEVEL]',
+                           help=f'Compress at the source: none, zlib[:0-9] or lzma[:0-9] (default: {COMPRESSION})')
+    parser_send.add_argument('--resume', metavar='TRANSFER_ID',
+                           help='Resume a failed transfer from the chunks already delivered')
+    parser_send.add_argument('--priority', choices=PRIORITIES, default=None,
+                           help=f'Scheduling class on every hop (default: {DEFAULT_PRIORITY})')
+    parser_send.add_argument('--deadline', type=float, default=None, metavar='SECONDS',
+                           help='Deliver within this many seconds; orders transfers within a class')
+    
+    parser_batch = subparsers.add_parser('batch', help='Send many files to one destination')
+    parser_batch.add_argument('destination', help='Destination node name')
+    parser_batch.add_argument('patterns', nargs='+',
+                            help='Files, globs or directories in send-file directory')
+    parser_batch.add_argument('--algo', default='astar', choices=['astar', 'dijkstra', 'greedy'],
+                            help='Routing algorithm (default: astar)')
+    parser_batch.add_argument('--pack', type=int, default=BATCH_PACK_THRESHOLD, metavar='BYTES',
+                            help=f'Pack files smaller than this into archives, 0 to disable (default: {BATCH_PACK_THRESHOLD})')
+    parser_batch.add_argument('--compress', default=COMPRESSION, metavar='CODEC[:LEVEL]',
+                            help=f'Compress each file or archive at the source (default: {COMPRESSION})')
+    parser_batch.add_argument('--priority', choices=PRIORITIES, default=None,
+                            help=f'Scheduling class on every hop (default: {DEFAULT_PRIORITY})')
+    parser_batch.add_argument('--deadline', type=float, default=None, metavar='SECONDS',
+                            help='Deliver within this many seconds; orders transfers within a class')
+    
+    parser_multicast = subparsers.add_parser('multicast', help='Send a file to several destinations')
+    parser_multicast.add_argument('filename', help='Filename in send-file directory')
+    parser_multicast.add_argument('destinations', nargs='+', help='Destination node names')
+    parser_multicast.add_argument('--algo', default='astar', choices=['astar', 'dijkstra', 'greedy'],
+                                help='Routing algorithm (default: astar)')
+    parser_multicast.add_argument('--compress', default=COMPRESSION, metavar='CODEC[:LEVEL]',
+                                help=f'Compress at the source (default: {COMPRESSION})')
+    parser_multicast.add_argument('--priority', choices=PRIORITIES, default=None,
+                                help=f'Scheduling class on every hop (default: {DEFAULT_PRIORITY})')
+    parser_multicast.add_argument('--deadline', type=float, default=None, metavar='SECONDS',
+                                help='Deliver within this many seconds; orders transfers within a class')
     
     args = parser.parse_args()
     
@@ -49,9 +168,24 @@ def main():
         sys.exit(1)
     
     if args.command == 'listen':
-        cmd_listen()
+        cmd_listen(args.server)
     elif args.command == 'send':
-        cmd_send(args.filename, args.destination, args.algo)
+        if not args.resume and not (args.filename and args.destination):
+            parser_send.error('filename and destination are required unless --resume is given')
+        cmd_send(
+            args.filename, args.destination, args.algo, args.streams, args.resume,
+            args.paths, args.compress, args.priority, deadline_from(args.deadline)
+        )
+    elif args.command == 'batch':
+        cmd_batch(
+            args.destination, args.patterns, args.algo, args.pack, args.compress,
+            args.priority, deadline_from(args.deadline)
+        )
+    elif args.command == 'multicast':
+        cmd_multicast(
+            args.filename, args.destinations, args.algo, args.compress,
+            args.priority, deadline_from(args.deadline)
+        )
     else:
         parser.print_help()
         sys.exit(1)
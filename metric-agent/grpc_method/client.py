@@ -1,7 +1,7 @@
 import asyncio
 import socket
 import grpc
-from network.metrics import measure_links
+from network.metrics import measure_links, save_link_metrics
 from grpc_method.monitor_pb2 import LinkMetric, HeartbeatRequest, NodeMetric
 from network.node_metrics import collect_node_metrics
 from grpc_method.monitor_pb2_grpc import NodeMonitorStub
@@ -22,11 +22,17 @@ async def heartbeat_generator(stop_event, neighbors):
     INTERVAL_SEC = float(os.getenv("INTERVAL_SEC", "5.0"))
     LAT = float(os.getenv("LAT", "0.0"))
     LNG = float(os.getenv("LNG", "0.0"))
+    LINK_METRICS_FILE = os.getenv("LINK_METRICS_FILE", "/tmp/link-metrics.json")
 
     while not stop_event.is_set():
         start_time = asyncio.get_event_loop().time()
         try:
             link_metrics = await measure_links(neighbors)
+            if LINK_METRICS_FILE:
+                try:
+                    save_link_metrics(link_metrics, LINK_METRICS_FILE)
+                except OSError as e:
+                    print(f"[WARN] Could not write {LINK_METRICS_FILE}: {e}")
             links = [LinkMetric(**metric) for metric in link_metrics]
 
             node_metrics_data = await collect_node_metrics()
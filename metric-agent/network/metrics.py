@@ -2,7 +2,9 @@ import asyncio
 import random
 import re
 import os
+import json
 import math
+import time
 from .utils import (
     get_node_type,
     get_weather_condition,
@@ -188,3 +190,18 @@ async def measure_links(neighbors: list) -> list:
                 "queue_length": 0
             })
     return links
+
+def save_link_metrics(links: list, path: str) -> None:
+    """Write the latest measurements to ``path`` for agents on the same node.
+
+    The file agent paces its sends from these; the file is replaced
+    atomically so a reader never sees a partial write.
+    """
+    snapshot = {
+        "timestamp": time.time(),
+        "links": {link["neighbor_id"]: link for link in links}
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)